@@ -111,6 +111,19 @@ os.makedirs(MEDIA_ROOT, exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'uploads'), exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'hls'), exist_ok=True)
 
+# Las subidas se hashean (SHA-256) al recibirse para reutilizar el HLS de videos repetidos
+FILE_UPLOAD_HANDLERS = [
+    'videos.upload_handlers.HashingMemoryFileUploadHandler',
+    'videos.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+# Subida por partes (/api/upload/): tamaño máximo de cada parte, del archivo (0 = sin límite)
+# y horas sin actividad tras las que se borra una subida incompleta
+UPLOAD_CHUNK_SIZE = env.int('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024)
+UPLOAD_MAX_SIZE = env.int('UPLOAD_MAX_SIZE', default=4 * 1024 * 1024 * 1024)
+UPLOAD_SESSION_TTL_HOURS = env.int('UPLOAD_SESSION_TTL_HOURS', default=24)
+# Segundos tras los cuales un finalize sin terminar (proceso caído) puede reintentarse
+UPLOAD_FINALIZE_TIMEOUT = env.int('UPLOAD_FINALIZE_TIMEOUT', default=300)
+
 STATICFILES_STORAGE = env('DJANGO_STATICFILES_STORAGE', default='whitenoise.storage.CompressedManifestStaticFilesStorage')
 
 # Configuración FFmpeg accesible en código
@@ -118,6 +131,60 @@ FFMPEG_BIN_DIR = env('FFMPEG_BIN_DIR', default='')
 FFMPEG_BIN = env('FFMPEG_BIN', default='ffmpeg')
 FFPROBE_BIN = env('FFPROBE_BIN', default='ffprobe')
 
+# Transcodificación HLS: decodificar una sola vez y emitir todas las calidades
+HLS_SINGLE_PASS = env.bool('HLS_SINGLE_PASS', default=True)
+# Si hay que generar calidades por separado, hacerlo en paralelo; hilos por ffmpeg (0 = según núcleos y trabajos)
+HLS_PARALLEL_RENDITIONS = env.bool('HLS_PARALLEL_RENDITIONS', default=True)
+HLS_FFMPEG_THREADS = env.int('HLS_FFMPEG_THREADS', default=0)
+# Ajustar bitrates y calidades al origen (False = bitrates fijos de QUALITY_PROFILES)
+HLS_SOURCE_AWARE_LADDER = env.bool('HLS_SOURCE_AWARE_LADDER', default=True)
+# Copiar sin recodificar la calidad superior si el origen ya es H.264/AAC compatible
+HLS_STREAM_COPY = env.bool('HLS_STREAM_COPY', default=True)
+# Formato de segmentos: mpegts (.ts) o fmp4 (CMAF: init + .m4s, menos overhead; requiere EXT-X-VERSION 7)
+HLS_SEGMENT_FORMAT = env('HLS_SEGMENT_FORMAT', default='mpegts')
+# Audio: per_variant (dentro de cada calidad), shared (una sola rendición EXT-X-MEDIA) o none (pantallas sin audio)
+HLS_AUDIO_MODE = env('HLS_AUDIO_MODE', default='per_variant')
+# Un archivo por calidad con EXT-X-BYTERANGE en vez de cientos de segmentos (se sirve por Range)
+HLS_SINGLE_FILE = env.bool('HLS_SINGLE_FILE', default=False)
+# Preset por calidad medido con `manage.py tune_encoder --output ...` (vacío: veryfast para todas)
+HLS_ENCODER_PROFILE = env('HLS_ENCODER_PROFILE', default='')
+# Subidas por partes: transcodificar mientras llegan los bytes (MP4 con moov al inicio o MKV/WebM).
+# Ocupa un worker de TRANSCODE_MAX_WORKERS durante toda la subida
+HLS_TRANSCODE_WHILE_UPLOADING = env.bool('HLS_TRANSCODE_WHILE_UPLOADING', default=False)
+
+# Pool de transcodificación dentro del proceso web (trabajos simultáneos y tamaño de cola; 0 lo desactiva)
+TRANSCODE_MAX_WORKERS = env.int('TRANSCODE_MAX_WORKERS', default=1)
+TRANSCODE_QUEUE_SIZE = env.int('TRANSCODE_QUEUE_SIZE', default=20)
+# Cada cuántos segundos el pool busca videos pendientes huérfanos (reinicios); 0 = solo al arrancar
+TRANSCODE_RECOVERY_SECONDS = env.int('TRANSCODE_RECOVERY_SECONDS', default=300)
+# Segundos que un worker retiene un video reclamado sin renovar (se reclama tras un fallo)
+TRANSCODE_LEASE_SECONDS = env.int('TRANSCODE_LEASE_SECONDS', default=300)
+# Cada cuántos segundos se guarda el progreso de ffmpeg en la base de datos
+TRANSCODE_PROGRESS_INTERVAL = env.int('TRANSCODE_PROGRESS_INTERVAL', default=2)
+# Aviso UDP a process_video_queue al subir un video (0 desactiva y queda solo el polling)
+TRANSCODE_WAKEUP_PORT = env.int('TRANSCODE_WAKEUP_PORT', default=8765)
+TRANSCODE_WAKEUP_BIND = env('TRANSCODE_WAKEUP_BIND', default='127.0.0.1')
+TRANSCODE_WAKEUP_HOSTS = env.list('TRANSCODE_WAKEUP_HOSTS', default=['127.0.0.1'])
+
+# Cache (LocMem por proceso; DJANGO_CACHE_URL permite uno compartido entre procesos)
+CACHES = {
+    'default': env.cache('DJANGO_CACHE_URL', default='locmemcache://'),
+}
+# Máximo de segundos que un proceso sirve el snapshot de /api/sync/ sin recalcularlo
+SYNC_SNAPSHOT_TTL = env.int('SYNC_SNAPSHOT_TTL', default=30)
+# Conexiones SSE/long-poll simultáneas por proceso (cada una ocupa un hilo de Waitress)
+SYNC_STREAM_MAX_CLIENTS = env.int('SYNC_STREAM_MAX_CLIENTS', default=50)
+SYNC_STREAM_SECONDS = env.int('SYNC_STREAM_SECONDS', default=300)
+SYNC_LONG_POLL_SECONDS = env.int('SYNC_LONG_POLL_SECONDS', default=25)
+# Elementos siguientes incluidos en /api/sync/ para precarga en las pantallas
+SYNC_LOOKAHEAD = env.int('SYNC_LOOKAHEAD', default=2)
+# Rangos de video: entregar el archivo al servidor (wsgi.file_wrapper/sendfile) en vez de leerlo en Python
+MEDIA_RANGE_FILE_WRAPPER = env.bool('MEDIA_RANGE_FILE_WRAPPER', default=True)
+# Cache LRU por proceso de tamaño/mtime/ETag de archivos de /media/ (0 = desactivado)
+MEDIA_INFO_CACHE_SIZE = env.int('MEDIA_INFO_CACHE_SIZE', default=2048)
+# Segundos que una entrada se usa sin volver a hacer stat (cambios hechos por otros procesos)
+MEDIA_INFO_CACHE_TTL = env.int('MEDIA_INFO_CACHE_TTL', default=2)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -12,6 +12,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AdiclaVideo.settings')
 
 application = get_wsgi_application()
 
+# Retomar videos pendientes cuya cola en memoria se perdió al reiniciar el servidor
+from videos.transcoding import get_executor
+get_executor().start()
+
 # Solo usar WhiteNoise en producción (cuando esté disponible)
 try:
     from whitenoise import WhiteNoise
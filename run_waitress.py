@@ -1,32 +1,31 @@
 from waitress import serve
-from AdiclaVideo.wsgi import application
 import multiprocessing
 import os
 
 """Script de arranque Waitress.
 
 Ajustes enfocados a equilibrio CPU/RAM en Windows sin proxy inverso:
-- Menos hilos (cpu * 2) para evitar excesivo contexto en transcodificaciones paralelas.
+- Menos hilos (cpu * 2) para evitar excesivo contexto en transcodificaciones paralelas,
+  más un hilo por conexión SSE/long-poll permitida (mayormente dormidos).
 - Buffers moderados: suficientes para servir segmentos HLS (normalmente ~300-800KB) sin inflar RAM.
+- Envío inmediato (send_bytes por defecto = 1): con un umbral mayor Waitress retiene
+  la salida de respuestas en streaming y los eventos SSE no llegan hasta cerrar el stream.
 - Timeouts razonables (5 min) para requests prolongadas pero no ilimitadas.
 - Permite override por variables de entorno para tuning futuro.
 """
 
 CPU_COUNT = multiprocessing.cpu_count()
-THREADS = int(os.getenv('WAITRESS_THREADS', CPU_COUNT * 2))
+# Conexiones SSE/long-poll de /api/sync/ retienen un hilo cada una: se suman aparte
+SYNC_STREAM_MAX_CLIENTS = int(os.getenv('SYNC_STREAM_MAX_CLIENTS', 50))
+THREADS = int(os.getenv('WAITRESS_THREADS', CPU_COUNT * 2 + SYNC_STREAM_MAX_CLIENTS))
 PORT = int(os.getenv('PORT', 8000))
 CHANNEL_TIMEOUT = int(os.getenv('WAITRESS_CHANNEL_TIMEOUT', 300))  # 5 min
 
-print(f"Iniciando Waitress en 0.0.0.0:{PORT} con {THREADS} hilos (CPUs={CPU_COUNT})")
-
-serve(
-    application,
-    host='0.0.0.0',
-    port=PORT,
+# Opciones compartidas con las pruebas (videos/tests.py corre /api/sync/stream/ con ellas)
+WAITRESS_OPTIONS = dict(
     threads=THREADS,
     url_scheme='http',
     channel_timeout=CHANNEL_TIMEOUT,
-    send_bytes=512 * 1024,          # 512KB por envío
     connection_limit=int(os.getenv('WAITRESS_CONN_LIMIT', 300)),
     cleanup_interval=30,
     max_request_header_size=32768,  # 32KB headers
@@ -37,4 +36,10 @@ serve(
     asyncore_use_poll=True,
     ident=None,
     expose_tracebacks=False,
-)
\ No newline at end of file
+)
+
+if __name__ == '__main__':
+    from AdiclaVideo.wsgi import application
+
+    print(f"Iniciando Waitress en 0.0.0.0:{PORT} con {THREADS} hilos (CPUs={CPU_COUNT})")
+    serve(application, host='0.0.0.0', port=PORT, **WAITRESS_OPTIONS)
@@ -0,0 +1,505 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Media, UploadSession, media_upload_to
+from .transcoding import (
+    LeaseHeartbeat, get_executor, get_lease_seconds, requeue_media, stream_ready_fields
+)
+from .upload_handlers import file_sha256
+from .utils import VideoProcessor
+
+logger = logging.getLogger('videos.ffmpeg')
+
+COPY_BUFFER = 1024 * 1024
+# Bytes mínimos recibidos antes de arrancar ffmpeg con un Matroska/WebM (cabecera y primeros clusters)
+LIVE_PROBE_BYTES = 2 * 1024 * 1024
+MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+
+# SHA-256 del archivo completo calculado a medida que llegan las partes, por sesión:
+# {session_id: (bytes_incluidos, hasher)}. Vive en memoria; si la subida cambia de
+# proceso o este se reinicia, el finalize lee el archivo (ver ``_file_digest``)
+_running_digests = {}
+_digests_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Error de la subida por partes; ``status`` es el código HTTP a devolver."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def get_chunk_size():
+    return int(getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+
+def start_session(title, media_type, filename, total_size, sha256=''):
+    """Crea la sesión y su archivo de staging vacío."""
+    if media_type not in dict(Media.MEDIA_TYPES):
+        raise UploadError('Tipo de archivo inválido')
+    if not title or not filename:
+        raise UploadError('Faltan título o nombre de archivo')
+    max_size = int(getattr(settings, 'UPLOAD_MAX_SIZE', 0))
+    if total_size <= 0 or (max_size and total_size > max_size):
+        raise UploadError('Tamaño de archivo inválido', status=413 if total_size > 0 else 400)
+
+    purge_stale_sessions()
+    session = UploadSession.objects.create(
+        title=title[:200],
+        media_type=media_type,
+        filename=Path(filename).name[:255],
+        total_size=total_size,
+        sha256=(sha256 or '').lower(),
+    )
+    session.staging_path.parent.mkdir(parents=True, exist_ok=True)
+    session.staging_path.touch()
+    return session
+
+
+def append_chunk(session, offset, stream, length, chunk_sha256=''):
+    """Escribe ``length`` bytes de ``stream`` en ``offset`` y avanza ``received``.
+
+    Solo se acepta el siguiente tramo (``offset == received``); si no coincide
+    se responde 409 con el offset real para que el cliente continúe desde ahí.
+    El archivo no se bloquea mientras se reciben los bytes: dos reintentos del
+    mismo tramo escriben lo mismo y solo uno logra avanzar ``received``.
+    """
+    if session.status != 'uploading':
+        raise UploadError('La subida ya fue finalizada', status=409, offset=session.received)
+    if offset != session.received:
+        raise UploadError('Offset fuera de orden', status=409, offset=session.received)
+    if length <= 0 or length > get_chunk_size():
+        raise UploadError('Tamaño de parte inválido', status=413 if length > 0 else 400, offset=session.received)
+    if offset + length > session.total_size:
+        raise UploadError('La parte excede el tamaño declarado', offset=session.received)
+
+    digest = hashlib.sha256()
+    file_digest = _running_digest(session.pk, offset)
+    written = 0
+    with open(session.staging_path, 'r+b') as handle:
+        handle.seek(offset)
+        while written < length:
+            data = stream.read(min(COPY_BUFFER, length - written))
+            if not data:
+                break
+            handle.write(data)
+            digest.update(data)
+            if file_digest is not None:
+                file_digest.update(data)
+            written += len(data)
+    if written != length:
+        raise UploadError('Parte incompleta', offset=session.received)
+    if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+        raise UploadError('Checksum de la parte no coincide', status=422, offset=session.received)
+
+    advanced = UploadSession.objects.filter(
+        pk=session.pk, status='uploading', received=offset
+    ).update(received=offset + length, updated_at=timezone.now())
+    if advanced and file_digest is not None:
+        with _digests_lock:
+            _running_digests[session.pk] = (offset + length, file_digest)
+    session.refresh_from_db(fields=['received', 'status', 'updated_at'])
+    if not advanced and session.received < offset + length:
+        raise UploadError('Otra petición modificó la subida', status=409, offset=session.received)
+    maybe_start_live_transcode(session)
+    return session.received
+
+
+def finalize_session(session):
+    """Verifica el archivo completo, lo mueve a ``uploads/`` y crea el ``Media``.
+
+    El ``post_save`` de ``Media`` encola la transcodificación como en la subida
+    normal, por eso el ``Media`` se guarda fuera de una transacción (el worker
+    debe poder verlo al reclamarlo). El estado ``finalizing`` evita que dos
+    finalize simultáneos creen dos registros; si queda así más de
+    ``UPLOAD_FINALIZE_TIMEOUT`` segundos (proceso caído) se puede reclamar de nuevo.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=get_finalize_timeout())
+    claimed = UploadSession.objects.filter(
+        Q(status='uploading') | Q(status='finalizing', updated_at__lt=stale_before),
+        pk=session.pk, received=session.total_size,
+    ).update(status='finalizing', updated_at=now)
+    session.refresh_from_db()
+    if not claimed:
+        if session.status == 'completed':
+            return session.media
+        if session.status == 'finalizing':
+            raise UploadError('La subida se está finalizando', status=409, offset=session.received)
+        raise UploadError('Faltan partes por subir', status=409, offset=session.received)
+
+    if session.target_path:
+        media = _resume_interrupted_finalize(session)
+        if media is not None:
+            return media
+
+    staging = session.staging_path
+    target = None
+    try:
+        if not staging.exists():
+            # El archivo se perdió (p.ej. borrado a mano): la subida vuelve a empezar
+            staging.parent.mkdir(parents=True, exist_ok=True)
+            staging.touch()
+            session.received = 0
+            raise UploadError('Archivo de la subida no encontrado', status=409, offset=0)
+        with open(staging, 'r+b') as handle:
+            # Restos de un tramo interrumpido más allá del tamaño declarado
+            handle.truncate(session.total_size)
+        digest = _file_digest(session)
+        if session.sha256 and digest != session.sha256:
+            # Contenido corrupto: se reinicia la subida desde cero
+            with open(staging, 'r+b') as handle:
+                handle.truncate(0)
+            session.received = 0
+            raise UploadError('Checksum del archivo no coincide', status=422, offset=0)
+
+        relative = Path(media_upload_to(None, session.filename)).as_posix()
+        target = Path(settings.MEDIA_ROOT) / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Antes de mover: si el proceso cae aquí, el próximo finalize sabe dónde quedó el archivo
+        UploadSession.objects.filter(pk=session.pk).update(target_path=relative)
+        session.target_path = relative
+        os.replace(staging, target)
+        media = Media(title=session.title, media_type=session.media_type, content_hash=digest)
+        media.file.name = relative
+        if session.live_status == 'running':
+            # Ya se está transcodificando desde la subida: el Media nace reclamado por ese
+            # trabajo (el post_save no logra reclamarlo y el lease cubre una caída)
+            media.stream_status = 'processing'
+            media.worker_id = live_worker_id(session.pk)
+            media.lease_expires_at = timezone.now() + timedelta(seconds=get_lease_seconds())
+        media.save()
+    except Exception:
+        if session.received == 0:
+            _forget_digest(session.pk)
+        # Dejar el archivo donde estaba para poder reintentar el finalize
+        if target is not None and target.exists():
+            os.replace(target, staging)
+        UploadSession.objects.filter(pk=session.pk).update(
+            status='uploading', received=session.received, target_path=''
+        )
+        raise
+
+    session.status = 'completed'
+    session.media = media
+    session.save(update_fields=['status', 'media', 'updated_at'])
+    _forget_digest(session.pk)
+    logger.info(f"Subida por partes {session.pk} finalizada: media {media.pk} ({session.total_size} bytes)")
+    if media.worker_id and UploadSession.objects.filter(pk=session.pk, live_status='failed').exists():
+        # El trabajo en vivo falló mientras se creaba el Media: transcodificación normal
+        requeue_media(media.pk, media.worker_id)
+    return media
+
+
+def _running_digest(session_id, offset):
+    """Copia del hash acumulado hasta ``offset`` (uno nuevo si es la primera parte) o None."""
+    if offset == 0:
+        return hashlib.sha256()
+    with _digests_lock:
+        entry = _running_digests.get(session_id)
+    if entry is None or entry[0] != offset:
+        return None
+    return entry[1].copy()
+
+
+def _forget_digest(session_id):
+    with _digests_lock:
+        _running_digests.pop(session_id, None)
+
+
+def _file_digest(session):
+    """SHA-256 del archivo completo para ``content_hash`` y la verificación del cliente.
+
+    Sale del hash acumulado en ``append_chunk``. Si no está (partes recibidas en
+    otro proceso o tras un reinicio) se lee el archivo solo cuando el cliente
+    envió su SHA-256; si no, queda vacío y lo calcula el worker al transcodificar.
+    """
+    with _digests_lock:
+        entry = _running_digests.get(session.pk)
+    if entry is not None and entry[0] == session.total_size:
+        return entry[1].hexdigest()
+    if session.sha256:
+        logger.info(f"Subida por partes {session.pk}: sin hash acumulado, se lee el archivo completo")
+        return file_sha256(session.staging_path)
+    return ''
+
+
+def get_finalize_timeout():
+    return int(getattr(settings, 'UPLOAD_FINALIZE_TIMEOUT', 300))
+
+
+def _resume_interrupted_finalize(session):
+    """Retoma un finalize que se cortó después de elegir ``target_path``.
+
+    Si el ``Media`` llegó a crearse solo falta marcar la sesión como completada;
+    si no, el archivo vuelve a staging y el finalize se repite desde el inicio.
+    """
+    media = Media.objects.filter(file=session.target_path).first()
+    if media is not None:
+        session.status = 'completed'
+        session.media = media
+        session.save(update_fields=['status', 'media', 'updated_at'])
+        logger.info(f"Subida por partes {session.pk}: finalize interrumpido retomado (media {media.pk})")
+        return media
+    target = Path(settings.MEDIA_ROOT) / session.target_path
+    if target.exists() and not session.staging_path.exists():
+        os.replace(target, session.staging_path)
+    return None
+
+
+def abort_session(session):
+    if session.status == 'uploading':
+        session.staging_path.unlink(missing_ok=True)
+        _forget_digest(session.pk)
+        session.delete()
+
+
+def purge_stale_sessions():
+    """Borra sesiones sin actividad por más de ``UPLOAD_SESSION_TTL_HOURS`` y sus archivos.
+
+    Incluye las que quedaron en ``finalizing`` por un proceso caído: se borra el
+    staging y, si el archivo ya se había movido a ``uploads/`` sin llegar a crear
+    el ``Media``, también ese archivo huérfano.
+    """
+    ttl_hours = int(getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+    cutoff = timezone.now() - timedelta(hours=ttl_hours)
+    stale = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in stale:
+        session.staging_path.unlink(missing_ok=True)
+        _forget_digest(session.pk)
+        if session.status != 'completed' and session.target_path:
+            if not Media.objects.filter(file=session.target_path).exists():
+                (Path(settings.MEDIA_ROOT) / session.target_path).unlink(missing_ok=True)
+    deleted, _ = UploadSession.objects.filter(pk__in=[session.pk for session in stale]).delete()
+    if deleted:
+        logger.info(f"Sesiones de subida vencidas eliminadas: {deleted}")
+
+
+# ---------------------------------------------------------------------------
+# Transcodificación mientras se sube (HLS_TRANSCODE_WHILE_UPLOADING)
+# ---------------------------------------------------------------------------
+
+def live_worker_id(session_id):
+    return f"live:{str(session_id).replace('-', '')}"
+
+
+def streamable_head(path, available):
+    """Indica si ffmpeg puede decodificar el archivo leyéndolo desde el inicio.
+
+    True: MP4/MOV con ``moov`` completo antes de ``mdat`` (fast start) o Matroska/WebM
+    con al menos ``LIVE_PROBE_BYTES``. False: formato no apto (p.ej. ``moov`` al final,
+    que recién llega con el último byte). None: aún faltan bytes para decidir.
+    """
+    with open(path, 'rb') as handle:
+        head = handle.read(16)
+        if len(head) < 8:
+            return None
+        if head[:4] == MATROSKA_MAGIC:
+            return True if available >= LIVE_PROBE_BYTES else None
+        if head[4:8] != b'ftyp':
+            return False
+        offset = 0
+        for _ in range(64):
+            if offset + 16 > available:
+                return None
+            handle.seek(offset)
+            header = handle.read(16)
+            size = int.from_bytes(header[:4], 'big')
+            kind = header[4:8]
+            if size == 1:
+                size = int.from_bytes(header[8:16], 'big')
+            if kind == b'moov':
+                return True if size and offset + size <= available else None
+            if kind == b'mdat' or size < 8:
+                return False
+            offset += size
+    return False
+
+
+def maybe_start_live_transcode(session):
+    """Encola la transcodificación en vivo en cuanto la cabecera recibida lo permite."""
+    if session.live_status or session.media_type != 'video':
+        return
+    if not getattr(settings, 'HLS_TRANSCODE_WHILE_UPLOADING', False):
+        return
+    if getattr(settings, 'HLS_AUDIO_MODE', 'per_variant') == 'shared':
+        # El audio compartido es un segundo ffmpeg y el origen solo se lee una vez
+        ready = False
+    else:
+        ready = streamable_head(session.staging_path, session.received)
+    if ready is None:
+        return
+
+    status = 'running' if ready else 'unsupported'
+    if not UploadSession.objects.filter(pk=session.pk, live_status='').update(live_status=status):
+        return  # Otra petición ya lo decidió
+    session.live_status = status
+    if not ready:
+        logger.info(f"Subida {session.pk}: formato no apto para transcodificar mientras se sube")
+        return
+    if not get_executor().submit(transcode_while_uploading, session.pk, priority=5):
+        UploadSession.objects.filter(pk=session.pk).update(live_status='failed')
+        session.live_status = 'failed'
+
+
+class UploadFeed:
+    """Itera los bytes de una subida a medida que se confirman (para el stdin de ffmpeg).
+
+    Lee hasta ``received`` (lo ya escrito en staging) y espera más; abre el archivo
+    en cada lectura para no impedir que el finalize lo mueva. Al terminar deja el
+    SHA-256 del archivo completo en ``sha256``. Falla si la subida se cancela, se
+    reinicia desde cero, no avanza en ``STALL_SECONDS`` o su archivo no aparece en
+    ``MISSING_SECONDS``.
+    """
+
+    POLL_SECONDS = 0.5
+    STALL_SECONDS = 600
+    # El archivo solo falta por un instante (entre el os.replace del finalize y el Media)
+    MISSING_SECONDS = 30
+
+    def __init__(self, session):
+        self.session_id = session.pk
+        self.total_size = session.total_size
+        self.sha256 = None
+
+    @staticmethod
+    def source_path(session):
+        """Dónde están hoy los bytes de la subida: staging, destino del finalize o el Media."""
+        if session.staging_path.exists():
+            return session.staging_path
+        if session.target_path and (Path(settings.MEDIA_ROOT) / session.target_path).exists():
+            return Path(settings.MEDIA_ROOT) / session.target_path
+        if session.media_id:
+            return Path(session.media.file.path)
+        # Entre el os.replace del finalize y el guardado del Media
+        raise FileNotFoundError(session.staging_path)
+
+    def __iter__(self):
+        digest = hashlib.sha256()
+        offset = 0
+        last_progress = time.monotonic()
+        missing_since = None
+        try:
+            while offset < self.total_size:
+                session = UploadSession.objects.filter(pk=self.session_id).first()
+                if session is None:
+                    raise UploadError('Subida cancelada', status=410)
+                if session.received < offset:
+                    # El finalize la reinició (archivo perdido o checksum): lo leído ya no vale
+                    raise UploadError('La subida se reinició', status=409)
+                if session.received == offset:
+                    if time.monotonic() - last_progress > self.STALL_SECONDS:
+                        raise UploadError('La subida no avanza', status=408)
+                    time.sleep(self.POLL_SECONDS)
+                    continue
+                while offset < session.received:
+                    try:
+                        with open(self.source_path(session), 'rb') as handle:
+                            handle.seek(offset)
+                            data = handle.read(min(COPY_BUFFER, session.received - offset))
+                    except FileNotFoundError:
+                        # Se movió al finalizar; se vuelve a leer la sesión
+                        missing_since = missing_since or time.monotonic()
+                        if time.monotonic() - missing_since > self.MISSING_SECONDS:
+                            raise UploadError('Archivo de la subida no encontrado', status=409)
+                        time.sleep(self.POLL_SECONDS)
+                        break
+                    if not data:
+                        break
+                    missing_since = None
+                    digest.update(data)
+                    offset += len(data)
+                    last_progress = time.monotonic()
+                    yield data
+        finally:
+            # Corre en el hilo que alimenta a ffmpeg
+            connection.close()
+        self.sha256 = digest.hexdigest()
+
+
+class UploadLeaseHeartbeat(LeaseHeartbeat):
+    """Renueva el lease del Media de una subida; el Media recién existe tras el finalize."""
+
+    def __init__(self, session_id, worker_id, lease_seconds=None):
+        super().__init__(f"upload-{session_id}", worker_id, lease_seconds)
+        self.session_id = session_id
+
+    def renew(self):
+        media_id = UploadSession.objects.filter(pk=self.session_id).values_list('media_id', flat=True).first()
+        if media_id is None:
+            return True
+        self.media_id = media_id
+        return super().renew()
+
+
+def _wait_for_finalize(session_id, timeout):
+    """Espera a que el cliente finalice la subida; devuelve la sesión completada o None."""
+    deadline = time.monotonic() + timeout
+    while True:
+        session = UploadSession.objects.filter(pk=session_id).first()
+        if session is None or session.status == 'completed' or time.monotonic() > deadline:
+            return session if session is not None and session.status == 'completed' else None
+        time.sleep(UploadFeed.POLL_SECONDS)
+
+
+def transcode_while_uploading(session_id):
+    """Trabajo del pool: genera el HLS leyendo la subida a medida que llega.
+
+    ffmpeg recibe los bytes por stdin (una sola pasada), por lo que el HLS queda
+    listo segundos después del último byte. El resultado se asigna al Media creado
+    en el finalize; si algo falla, el Media vuelve a 'pending' y sigue el camino
+    normal (o, si aún no existe, el finalize lo crea como cualquier subida).
+    """
+    worker_id = live_worker_id(session_id)
+    session = UploadSession.objects.filter(pk=session_id, live_status='running').first()
+    if session is None:
+        return False
+
+    name = slugify(Path(session.filename).stem) or 'video'
+    output_dir = Path(settings.MEDIA_ROOT) / 'hls' / f"upload_{session.pk.hex[:12]}_{name}"
+    success = False
+    try:
+        feed = UploadFeed(session)
+        processor = VideoProcessor(
+            feed.source_path(session),
+            # Provisorio: el SHA-256 real se toma del feed al terminar de leer
+            content_hash=session.sha256 or worker_id,
+            output_dir=output_dir,
+            input_feed=feed,
+        )
+        with UploadLeaseHeartbeat(session.pk, worker_id):
+            success, metadata = processor.transcode_to_hls()
+            # El finalize verifica el archivo tras el último byte: normalmente ya llegó
+            session = _wait_for_finalize(session_id, get_lease_seconds()) if success else None
+    except Exception as exc:
+        logger.exception(f"[Live {session_id}] Error transcodificando mientras se sube: {exc}")
+        success = False
+
+    if success and session is not None and session.media_id:
+        updated = Media.objects.filter(pk=session.media_id, worker_id=worker_id).update(**stream_ready_fields(metadata))
+        if updated:
+            UploadSession.objects.filter(pk=session_id).update(live_status='done')
+            logger.info(f"[Live {session_id}] HLS listo para media {session.media_id}: {', '.join(metadata['qualities'])}")
+            return True
+        logger.warning(f"[Live {session_id}] Media {session.media_id} ya lo procesa otro worker")
+
+    UploadSession.objects.filter(pk=session_id).update(live_status='failed')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    media_id = UploadSession.objects.filter(pk=session_id).values_list('media_id', flat=True).first()
+    if media_id and requeue_media(media_id, worker_id):
+        logger.warning(f"[Live {session_id}] Falló, media {media_id} vuelve a la cola normal")
+    return False
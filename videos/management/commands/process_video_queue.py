@@ -1,73 +1,53 @@
-import time
-import shutil
-from pathlib import Path
 from django.core.management.base import BaseCommand
-from django.conf import settings
-from videos.models import Media
-from videos.utils import VideoProcessor
+from videos.transcoding import (
+    WakeupListener, claim_next_media, default_worker_id, get_lease_seconds, transcode_media
+)
 
 class Command(BaseCommand):
-    help = 'Procesa videos en cola de manera continua'
+    help = 'Worker de transcodificación: reclama videos pendientes de forma atómica y los procesa'
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write('Iniciando procesador de cola de videos...')
-        
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=None, help='Identificador del worker (por defecto host:pid)')
+        parser.add_argument('--lease', type=int, default=None, help='Segundos de lease por trabajo reclamado')
+        parser.add_argument('--poll', type=float, default=60, help='Máximo de segundos entre verificaciones sin trabajo')
+        parser.add_argument('--min-poll', type=float, default=1, help='Primera espera sin trabajo (se duplica hasta --poll)')
+        parser.add_argument('--once', action='store_true', help='Procesar lo pendiente y salir')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        lease_seconds = options['lease'] or get_lease_seconds()
+        self.stdout.write(f'Iniciando worker de transcodificación {worker_id} (lease={lease_seconds}s)...')
+
+        # Con --once no se escucha: un aviso recibido aquí no despertaría al worker residente
+        listener = None if options['once'] else WakeupListener()
+        try:
+            self._run(worker_id, lease_seconds, listener, options)
+        finally:
+            if listener:
+                listener.close()
+
+    def _run(self, worker_id, lease_seconds, listener, options):
+        delay = options['min_poll']
         while True:
-            # Buscar videos pendientes
-            pending_videos = Media.objects.filter(
-                media_type='video',
-                is_stream_ready=False,
-                stream_status='pending'
-            ).order_by('uploaded_at')[:1]  # Procesar uno a la vez
-            
-            if pending_videos:
-                video = pending_videos[0]
-                self.stdout.write(f'Procesando video: {video.file.name}')
-                
-                try:
-                    # Marcar como en procesamiento
-                    Media.objects.filter(pk=video.pk).update(
-                        stream_status='processing',
-                        error_message=''
-                    )
+            # Reclamar el siguiente video (pendiente o con lease vencido)
+            video = claim_next_media(worker_id, lease_seconds)
 
-                    processor = VideoProcessor(video.file.path, media_id=video.pk)
-                    previous_hls_path = video.hls_path
-                    success, metadata = processor.transcode_to_hls()
+            if video:
+                self.stdout.write(f'Procesando video: {video.file.name}')
+                if transcode_media(video, worker_id, lease_seconds):
+                    self.stdout.write(self.style.SUCCESS(
+                        f'✓ Video {video.file.name} procesado exitosamente'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(f'✗ Error procesando {video.file.name}'))
+                delay = options['min_poll']
+                continue
 
-                    if success:
-                        Media.objects.filter(pk=video.pk).update(
-                            is_stream_ready=True,
-                            stream_status='ready',
-                            hls_path=metadata.get('relative_output_dir'),
-                            available_qualities=metadata.get('qualities', []),
-                            duration=metadata.get('duration') or 0.0,
-                            width=metadata.get('width'),
-                            height=metadata.get('height'),
-                            error_message=''
-                        )
-                        new_hls_path = metadata.get('relative_output_dir')
-                        if previous_hls_path and new_hls_path and previous_hls_path != new_hls_path:
-                            old_dir = Path(settings.MEDIA_ROOT) / previous_hls_path
-                            shutil.rmtree(old_dir, ignore_errors=True)
-                        self.stdout.write(self.style.SUCCESS(
-                            f'✓ Video {video.file.name} procesado exitosamente'
-                        ))
-                    else:
-                        Media.objects.filter(pk=video.pk).update(
-                            stream_status='failed',
-                            is_stream_ready=False,
-                            available_qualities=[],
-                            error_message=metadata.get('error', 'Error en la transcodificación')
-                        )
+            if options['once']:
+                break
 
-                except Exception as exc:
-                    Media.objects.filter(pk=video.pk).update(
-                        stream_status='failed',
-                        is_stream_ready=False,
-                        error_message=str(exc)
-                    )
-                    self.stdout.write(self.style.ERROR(f'Error: {str(exc)}'))
-            
-            # Esperar antes de la siguiente verificación
-            time.sleep(10)  # 10 segundos entre verificaciones
\ No newline at end of file
+            # Esperar un aviso de upload; sin avisos, backoff exponencial hasta --poll
+            if listener.wait(delay):
+                delay = options['min_poll']
+            else:
+                delay = min(delay * 2, options['poll'])
@@ -0,0 +1,110 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from videos.models import Media
+from videos.transcoding import (
+    LeaseHeartbeat, claim_published_media, default_worker_id, release_published_media
+)
+from videos.utils import VideoProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        'Ajusta las calidades HLS de los videos listos a QUALITY_PROFILES: codifica solo '
+        'las faltantes, borra las que sobran y reescribe master.m3u8 de forma atómica'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--media-id', type=int, action='append', dest='media_ids', help='Limitar a estos ids (repetible)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo mostrar qué se codificaría y qué se borraría')
+
+    def handle(self, *args, **options):
+        videos = Media.objects.filter(
+            media_type='video', stream_status='ready', is_stream_ready=True
+        ).exclude(hls_path='').order_by('pk')
+        if options['media_ids']:
+            videos = videos.filter(pk__in=options['media_ids'])
+
+        # Videos idénticos comparten hls_path: cada directorio se procesa una sola vez
+        seen = set()
+        changed = 0
+        for media in videos:
+            if media.hls_path in seen:
+                continue
+            seen.add(media.hls_path)
+            if not media.file or not Path(media.file.path).is_file():
+                self.stdout.write(self.style.WARNING(f'id={media.id}: archivo original no encontrado, se omite'))
+                continue
+            if self._sync(media, options['dry_run']):
+                changed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Directorios revisados: {len(seen)} | Con cambios: {changed}'))
+
+    @staticmethod
+    def _same_layout(stored, configured):
+        # Videos procesados antes de guardar hls_layout: MPEG-TS con audio por variante
+        stored = {'segment_format': 'mpegts', 'audio': 'per_variant', 'single_file': False, **(stored or {})}
+        return (
+            stored['segment_format'] == configured['segment_format']
+            and stored['single_file'] == configured['single_file']
+            and stored['audio'] == configured['audio']
+        )
+
+    def _sync(self, media, dry_run):
+        processor = VideoProcessor(
+            media.file.path,
+            media_id=media.pk,
+            content_hash=media.content_hash,
+            output_dir=Path(settings.MEDIA_ROOT) / media.hls_path,
+        )
+        # Las calidades publicadas se dan por buenas aunque no tengan huella registrada,
+        # salvo que se hayan generado con otro formato de segmento o modo de audio
+        on_disk = []
+        if self._same_layout(media.hls_layout, processor.get_layout()):
+            on_disk = [
+                quality for quality in media.available_qualities
+                if (processor.output_dir / f'{quality}.m3u8').exists()
+            ]
+        plan = processor.plan_renditions(keep_existing=on_disk)
+        if 'error' in plan:
+            self.stdout.write(self.style.ERROR(f"id={media.id}: {plan['error']}"))
+            return False
+
+        if not plan['missing'] and not plan['obsolete']:
+            self.stdout.write(f'id={media.id}: sin cambios ({", ".join(sorted(plan["keep"]))})')
+            return False
+
+        summary = (
+            f"id={media.id} {media.hls_path}: codificar [{', '.join(plan['missing'])}] "
+            f"borrar [{', '.join(plan['obsolete'])}]"
+        )
+        self.stdout.write(summary)
+        if dry_run:
+            return True
+
+        # Un worker podría estar escribiendo el mismo directorio: se toma el lease antes
+        worker_id = default_worker_id('sync_renditions')
+        if not claim_published_media(media.pk, worker_id):
+            self.stdout.write(self.style.WARNING(f'id={media.id}: en uso por otro worker, se omite'))
+            return False
+        try:
+            with LeaseHeartbeat(media.pk, worker_id):
+                success, metadata = processor.transcode_to_hls(keep_existing=on_disk)
+            if not success:
+                self.stdout.write(self.style.ERROR(f"id={media.id}: {metadata.get('error')}"))
+                return False
+
+            Media.objects.filter(hls_path=media.hls_path).update(
+                available_qualities=metadata['qualities'],
+                hls_layout=metadata['layout'],
+            )
+        finally:
+            release_published_media(media.pk, worker_id)
+        if metadata.get('failed'):
+            self.stdout.write(self.style.WARNING(
+                f"id={media.id}: no se generaron [{', '.join(metadata['failed'])}], se conserva lo publicado"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"id={media.id}: calidades {', '.join(metadata['qualities'])}"))
+        return True
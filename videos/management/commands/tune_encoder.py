@@ -0,0 +1,187 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from videos.utils import VideoProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide en este servidor cada preset de libx264 por calidad y guarda en '
+        'HLS_ENCODER_PROFILE el preset más lento que aún codifica a la velocidad mínima'
+    )
+
+    DEFAULT_PRESETS = 'ultrafast,superfast,veryfast,faster,fast,medium'
+    # Tope por corrida: un preset que tarda más de TIMEOUT_RATIO x la duración ya no sirve
+    TIMEOUT_RATIO = 10
+    CLIP_TIMEOUT = 600
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clip', help='Video de referencia (por defecto se genera uno sintético 1080p)')
+        parser.add_argument('--seconds', type=int, default=10, help='Duración del clip sintético')
+        parser.add_argument('--presets', default=self.DEFAULT_PRESETS, help='Presets a probar, separados por coma')
+        parser.add_argument('--threads', help=(
+            'Hilos a probar, separados por coma (por defecto los que recibe cada calidad '
+            'al codificar todas a la vez)'
+        ))
+        parser.add_argument('--min-speed', type=float, default=2.0, help=(
+            'Velocidad mínima aceptable (segundos de video por segundo de reloj). Deja margen '
+            'para otros trabajos y subidas en paralelo; 1.0 es apenas tiempo real'
+        ))
+        parser.add_argument('--crf', type=int, help='Guardar un CRF con tope de bitrate en el perfil (no se mide calidad)')
+        parser.add_argument('--output', default=getattr(settings, 'HLS_ENCODER_PROFILE', ''), help='Archivo JSON de salida')
+        parser.add_argument('--dry-run', action='store_true', help='Medir y mostrar el perfil sin guardarlo')
+
+    def handle(self, *args, **options):
+        if not options['output'] and not options['dry_run']:
+            raise CommandError('Indique --output o configure HLS_ENCODER_PROFILE')
+        presets = [preset.strip() for preset in options['presets'].split(',') if preset.strip()]
+        cpus = os.cpu_count() or 1
+        thread_counts = None
+        if options['threads']:
+            thread_counts = sorted({int(value) for value in options['threads'].split(',') if value.strip()})
+
+        workdir = Path(tempfile.mkdtemp(prefix='tune_encoder_'))
+        try:
+            clip = Path(options['clip']) if options['clip'] else self._synthetic_clip(workdir, options['seconds'])
+            if not clip.is_file():
+                raise CommandError(f'No existe el clip {clip}')
+            results = self._benchmark(clip, workdir, presets, thread_counts)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        tiers = self._pick(results, presets, options['min_speed'], options['crf'])
+        profile = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'host': platform.node(),
+            'cpu_count': cpus,
+            'ffmpeg': self.ffmpeg_version,
+            'clip': options['clip'] or f"testsrc2 1080p {options['seconds']}s",
+            'min_speed': options['min_speed'],
+            'tiers': tiers,
+            'results': results,
+        }
+        for quality, tier in tiers.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{quality}: preset={tier['preset']} threads={tier['threads']} speed={tier['speed']}x"
+            ))
+        if options['dry_run']:
+            return
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = output.with_name(output.name + '.tmp')
+        tmp_path.write_text(json.dumps(profile, indent=2), encoding='utf-8')
+        os.replace(tmp_path, output)
+        self.stdout.write(self.style.SUCCESS(f'Perfil guardado en {output} (reinicie los workers para aplicarlo)'))
+
+    def _synthetic_clip(self, workdir, seconds):
+        """Clip 1080p30 con ruido: más parecido a video real que un patrón estático."""
+        clip = workdir / 'clip.mp4'
+        processor = VideoProcessor(clip, output_dir=workdir)
+        cmd = [
+            processor.ffmpeg_binary, '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={seconds}',
+            '-vf', 'noise=alls=12:allf=t',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '10', '-pix_fmt', 'yuv420p',
+            clip.as_posix(),
+        ]
+        self.stdout.write('Generando clip sintético...')
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.CLIP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise CommandError(f'El clip sintético no se generó en {self.CLIP_TIMEOUT}s')
+        if result.returncode != 0 or not clip.is_file():
+            raise CommandError(f'No se pudo generar el clip: {result.stderr[-500:]}')
+        return clip
+
+    def _benchmark(self, clip, workdir, presets, thread_counts):
+        """Codifica cada calidad con el mismo comando que usa el procesamiento real."""
+        processor = VideoProcessor(clip, output_dir=workdir / 'out')
+        processor.encoder_profile = {}
+        self.ffmpeg_version = processor.ffmpeg_version()
+        duration = processor.probe_duration()
+        if not duration:
+            raise CommandError('ffprobe no pudo leer la duración del clip')
+        timeout = max(60, duration * self.TIMEOUT_RATIO)
+        if not thread_counts:
+            # Mismo reparto que una transcodificación real con todas las calidades a la vez
+            thread_counts = [processor.threads_per_encoder(len(VideoProcessor.QUALITY_PROFILES))]
+
+        results = []
+        for quality, profile in VideoProcessor.QUALITY_PROFILES.items():
+            for preset in presets:
+                for threads in thread_counts:
+                    variant = {
+                        'quality': quality,
+                        'width': profile['width'],
+                        'height': profile['height'],
+                        'video_bitrate': profile['video_bitrate'],
+                        'maxrate': int(profile['video_bitrate'] * profile['maxrate_ratio']),
+                        'bufsize': int(profile['video_bitrate'] * profile['bufsize_ratio']),
+                        'audio_bitrate': profile['audio_bitrate'],
+                        'preset': preset,
+                    }
+                    shutil.rmtree(processor.output_dir, ignore_errors=True)
+                    processor.output_dir.mkdir(parents=True)
+                    cmd = processor.build_variant_command(variant, threads=threads)
+                    started = time.monotonic()
+                    try:
+                        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+                    except subprocess.TimeoutExpired:
+                        self.stdout.write(self.style.WARNING(f'{quality} {preset} x{threads}: más de {timeout:.0f}s, se omite'))
+                        continue
+                    elapsed = time.monotonic() - started
+                    if result.returncode != 0:
+                        self.stdout.write(self.style.WARNING(
+                            f'{quality} {preset} x{threads}: falló ({result.stderr.strip()[-200:]})'
+                        ))
+                        continue
+                    size = sum(path.stat().st_size for path in processor.output_dir.iterdir() if path.is_file())
+                    speed = round(duration / elapsed, 2) if elapsed else 0
+                    self.stdout.write(f'{quality} {preset} x{threads}: {speed}x, {size // 1024} KB')
+                    results.append({
+                        'quality': quality, 'preset': preset, 'threads': threads,
+                        'seconds': round(elapsed, 2), 'speed': speed, 'size_bytes': size,
+                    })
+        return results
+
+    @staticmethod
+    def _pick(results, presets, min_speed, crf):
+        """Por calidad: el preset más lento (mejor compresión) que llega a ``min_speed``.
+
+        Con varios valores de ``--threads`` se guarda la corrida con menos hilos que
+        lo logra; es solo una referencia, al codificar los hilos los reparte
+        ``VideoProcessor.threads_per_encoder``.
+        """
+        tiers = {}
+        for quality in VideoProcessor.QUALITY_PROFILES:
+            runs = [run for run in results if run['quality'] == quality]
+            if not runs:
+                continue
+            passing = [run for run in runs if run['speed'] >= min_speed]
+            if passing:
+                slowest = max(passing, key=lambda run: presets.index(run['preset']))
+                candidates = [run for run in passing if run['preset'] == slowest['preset']]
+                best = min(candidates, key=lambda run: run['threads'])
+            else:
+                # Ningún preset alcanza la velocidad: el más rápido medido
+                best = max(runs, key=lambda run: run['speed'])
+            tiers[quality] = {
+                'preset': best['preset'],
+                'threads': best['threads'],
+                'speed': best['speed'],
+                'size_bytes': best['size_bytes'],
+            }
+            if crf:
+                tiers[quality]['crf'] = crf
+        return tiers
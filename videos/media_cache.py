@@ -0,0 +1,88 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.utils.http import http_date
+
+# Metadatos de un archivo de /media/ que necesita StreamingMediaMiddleware en cada petición
+MediaFileInfo = namedtuple('MediaFileInfo', 'size mtime etag last_modified content_type checked_at')
+
+_entries = OrderedDict()  # ruta normalizada -> MediaFileInfo, en orden de uso (LRU)
+_lock = threading.Lock()
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.normpath(os.fspath(path)))
+
+
+def get_media_info(path, content_type):
+    """Metadatos cacheados de ``path`` o None si no es un archivo regular.
+
+    Dentro de ``MEDIA_INFO_CACHE_TTL`` segundos no se toca el disco; pasado ese
+    tiempo se hace un ``os.stat`` y la entrada se reconstruye si cambió mtime o
+    tamaño (reemplazos hechos por otros procesos). Los borrados/reemplazos de
+    este proceso invalidan la entrada al momento vía señales.
+    """
+    key = _normalize(path)
+    now = time.monotonic()
+    with _lock:
+        info = _entries.get(key)
+        if info is not None and now - info.checked_at < getattr(settings, 'MEDIA_INFO_CACHE_TTL', 2):
+            _entries.move_to_end(key)
+            return info
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        invalidate_media_info(path)
+        return None
+
+    if info is not None and info.etag == _etag(st) and info.content_type == content_type:
+        info = info._replace(checked_at=now)
+    else:
+        info = MediaFileInfo(
+            size=st.st_size,
+            mtime=int(st.st_mtime),
+            etag=_etag(st),
+            last_modified=http_date(st.st_mtime),
+            content_type=content_type,
+            checked_at=now,
+        )
+
+    max_entries = getattr(settings, 'MEDIA_INFO_CACHE_SIZE', 2048)
+    with _lock:
+        if max_entries > 0:
+            _entries[key] = info
+            _entries.move_to_end(key)
+            while len(_entries) > max_entries:
+                _entries.popitem(last=False)
+    return info
+
+
+def _etag(st):
+    # Los archivos de media no se reescriben en el lugar (un reemplazo cambia mtime/tamaño)
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def invalidate_media_info(path):
+    """Olvida los metadatos de un archivo (borrado o reemplazado)."""
+    with _lock:
+        _entries.pop(_normalize(path), None)
+
+
+def invalidate_media_dir(directory):
+    """Olvida todos los archivos bajo ``directory`` (p.ej. un directorio HLS eliminado)."""
+    prefix = _normalize(directory) + os.sep
+    with _lock:
+        for key in [key for key in _entries if key.startswith(prefix)]:
+            del _entries[key]
+
+
+def clear_media_info():
+    with _lock:
+        _entries.clear()
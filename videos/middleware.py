@@ -1,10 +1,27 @@
 import re
 import os
+import uuid
+import mimetypes
 from django.conf import settings
 from django.http import StreamingHttpResponse, HttpResponse, FileResponse
+from django.utils.cache import get_conditional_response
 from django.urls import re_path
 from wsgiref.util import FileWrapper as WSGIFileWrapper
 
+from .media_cache import get_media_info, invalidate_media_info
+
+# Tipos HLS para cuando Django/WhiteNoise sirven el archivo (mimetypes no los trae todos)
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+mimetypes.add_type('video/iso.segment', '.m4s')
+
+# Más rangos que esto en un mismo Range se ignoran (se sirve el archivo completo)
+MAX_RANGES = 16
+
+# Archivos HLS (playlists, init y segmentos): sync_renditions los reescribe con el mismo
+# nombre, así que se cachean poco tiempo y luego se revalidan con ETag/Last-Modified (304)
+HLS_CACHE_CONTROL = 'public, max-age=60'
+
 # Usar nuestro wrapper personalizado para mejor rendimiento
 class RangeFileWrapper(object):
     """
@@ -34,13 +51,103 @@ class RangeFileWrapper(object):
             self.remaining -= len(data)
             return data
 
+def parse_range_header(header, size, max_ranges=MAX_RANGES):
+    """Interpreta ``Range: bytes=...`` (RFC 7233) para un archivo de ``size`` bytes.
+
+    Acepta ``a-b``, ``a-`` y sufijos ``-n`` separados por comas. Devuelve la lista
+    de rangos ``(inicio, fin)`` inclusivos, ordenados y fusionados si se solapan;
+    ``[]`` si ninguno es satisfacible (416); ``None`` si la cabecera es inválida o
+    pide demasiados rangos (se ignora y se envía el archivo completo).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if not first:
+            if not last:
+                return None
+            # Sufijo: los últimos n bytes (p.ej. el moov al final de un MP4)
+            suffix = int(last)
+            if suffix and size:
+                ranges.append((max(0, size - suffix), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    if len(ranges) > max_ranges:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class RangeFile:
+    """Vista de solo lectura del tramo ``[offset, offset + length)`` de un archivo.
+
+    Expone ``fileno``/``seek``/``tell``/``read`` con posiciones absolutas acotadas
+    al tramo. ``FileResponse`` calcula con ellas el Content-Length y el servidor
+    recibe el archivo por ``wsgi.file_wrapper``: Waitress lo envía desde su hilo
+    de I/O (el hilo de la petición queda libre) y los servidores con sendfile usan
+    ``fileno()`` desde la posición actual. Nunca se lee fuera del tramo.
+    """
+    def __init__(self, filelike, offset, length):
+        self.filelike = filelike
+        self.start = offset
+        self.end = offset + length
+        self.filelike.seek(offset, os.SEEK_SET)
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.filelike.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self.end
+        return self.filelike.seek(min(max(offset, self.start), self.end), os.SEEK_SET)
+
+    def read(self, size=-1):
+        remaining = self.end - self.tell()
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.filelike.read(size)
+
+    def close(self):
+        self.filelike.close()
+
 class StreamingMediaMiddleware:
     """Middleware para servir videos MP4 con soporte de Range.
 
-    Se elimina intervención sobre HLS (.m3u8 / .ts) para que WhiteNoise/Django
-    los sirva directamente (reduce overhead y evita manipular cabeceras que
-    algunos players cachean de forma inesperada). Solo manejamos Range en
-    archivos grandes tipo MP4/WebM/Mov.
+    También sirve HLS (.m3u8 / .ts / .m4s) sin pasar por la vista estática de
+    Django (que volvería a hacer stat): sin Range van completos con su
+    Content-Type y ``HLS_CACHE_CONTROL`` (CacheControlMiddleware, más adentro en
+    producción, no llega a verlas); con Range (``HLS_SINGLE_FILE``:
+    un archivo por calidad direccionado con EXT-X-BYTERANGE) siguen la ruta MP4.
+    Tamaño, mtime y ETag salen de un LRU por archivo (``videos.media_cache``),
+    así las peticiones repetidas no hacen llamadas de metadatos al disco.
+    Los init de fMP4 (``*_init.mp4``) son pequeños y pasan por la ruta MP4.
+    Los rangos siguen RFC 7233 (sufijos ``-n``, varios rangos como
+    multipart/byteranges, ``If-Range``) y las peticiones condicionales
+    (``If-None-Match``/``If-Modified-Since``) se responden con 304.
     """
     def __init__(self, get_response):
         self.get_response = get_response
@@ -48,6 +155,7 @@ class StreamingMediaMiddleware:
         media_url = settings.MEDIA_URL.lstrip('/').rstrip('/')
         regex = r'^/{}/(.*?)$'.format(media_url)
         self.media_re = re.compile(regex)
+        self.media_root = os.path.normpath(os.path.abspath(settings.MEDIA_ROOT))
         
         # Mapeo de extensiones a content types
         self.content_types = {
@@ -57,6 +165,7 @@ class StreamingMediaMiddleware:
             '.mov': 'video/quicktime',
             '.m3u8': 'application/vnd.apple.mpegurl',
             '.ts': 'video/mp2t',
+            '.m4s': 'video/iso.segment',
             '.jpg': 'image/jpeg',
             '.png': 'image/png',
         }
@@ -68,72 +177,157 @@ class StreamingMediaMiddleware:
         if not media_match:
             return self.get_response(request)
             
-        media_path = os.path.join(settings.MEDIA_ROOT, media_match.group(1))
-        
-        # Verificar si el archivo existe
-        if not os.path.exists(media_path):
+        media_path = os.path.normpath(os.path.join(self.media_root, media_match.group(1)))
+        # Nunca servir fuera de MEDIA_ROOT (rutas con '..')
+        if not media_path.startswith(self.media_root + os.sep):
             return self.get_response(request)
-            
-        # Detectar tipo de archivo
+
+        # Detectar tipo de archivo (solo por la URL, sin tocar el disco)
         file_ext = os.path.splitext(media_path)[1].lower()
         is_video = file_ext in ['.mp4', '.webm', '.ogg', '.mov']
-        is_hls = file_ext in ['.m3u8', '.ts']
-        
+        is_hls = file_ext in ['.m3u8', '.ts', '.m4s']
+        # Archivos generados por VideoProcessor (incluido el init fMP4): se reescriben con el mismo nombre
+        is_hls_file = is_hls or media_path.endswith('_init.mp4')
+
+        # Imágenes y demás: las sirve Django
+        if not is_video and not is_hls:
+            return self.get_response(request)
+
         # Content-Type específico para el tipo de archivo
         content_type = self.content_types.get(file_ext, 'application/octet-stream')
-        
-        # HLS: no intervenir (lo sirve WhiteNoise / default). Evitar overhead.
-        if is_hls:
-            return self.get_response(request)
-            
-        # Si no es video o no hay Range header, servir normalmente
-        if not is_video:
+
+        # Tamaño/validadores desde el LRU: segmentos y MP4 repetidos no hacen stat
+        info = get_media_info(media_path, content_type)
+        if info is None:
             return self.get_response(request)
+        size = info.size
+        etag = info.etag
+        validators = {'ETag': etag, 'Last-Modified': info.last_modified}
+
+        # If-None-Match / If-Modified-Since (304) e If-Match / If-Unmodified-Since (412)
+        conditional = get_conditional_response(request, etag=etag, last_modified=info.mtime)
+        if conditional is not None:
+            for header, value in validators.items():
+                conditional[header] = value
+            conditional['Accept-Ranges'] = 'bytes'
+            if is_hls_file:
+                conditional['Cache-Control'] = HLS_CACHE_CONTROL
+            return conditional
+
+        ranges = None
+        if request.method in ('GET', 'HEAD') and 'HTTP_RANGE' in request.META:
+            # If-Range: si el archivo cambió se ignora el rango y se envía completo
+            if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+            if not if_range or if_range in validators.values():
+                ranges = parse_range_header(request.META['HTTP_RANGE'], size)
 
-        # Sin Range: devolver respuesta completa (fallback). Navegadores suelen iniciar con Range.
-        if 'HTTP_RANGE' not in request.META:
-            resp = FileResponse(open(media_path, 'rb'), content_type=content_type)
+        # Sin Range (o Range inválido/ignorado): respuesta completa. Navegadores suelen iniciar con Range.
+        if ranges is None:
+            try:
+                resp = FileResponse(open(media_path, 'rb'), content_type=content_type)
+            except FileNotFoundError:
+                # Borrado por otro proceso dentro del TTL del cache
+                invalidate_media_info(media_path)
+                return self.get_response(request)
             resp['Accept-Ranges'] = 'bytes'
-            resp['Cache-Control'] = 'public, max-age=604800, immutable'
+            # CacheControlMiddleware no ve estas respuestas: la política HLS se aplica aquí
+            if is_hls_file:
+                resp['Cache-Control'] = HLS_CACHE_CONTROL
+                resp['X-Content-Type-Options'] = 'nosniff'
+            else:
+                resp['Cache-Control'] = 'public, max-age=604800, immutable'
+            for header, value in validators.items():
+                resp[header] = value
             return resp
-            
-        # Manejar Range requests para video
-        size = os.path.getsize(media_path)
-        content_type = 'video/mp4' if file_ext == '.mp4' else 'application/octet-stream'
-        
+
+        if not ranges:
+            resp = HttpResponse(status=416)  # Range Not Satisfiable
+            resp['Content-Range'] = f'bytes */{size}'
+            return resp
+
         # Detectar dispositivos de baja potencia como Smart TVs
         user_agent = request.META.get('HTTP_USER_AGENT', '').lower()
         is_tv = 'lg' in user_agent or 'webos' in user_agent or 'smart-tv' in user_agent or 'tv' in user_agent
-        
-        # Chunk adaptativo moderado: menos agresivo (reduce latencia inicial)
-        if is_tv:
-            chunk_size = 5 * 1024 * 1024   # 5MB
-            buffer_size = 256 * 1024       # 256KB
+
+        # Bloques de lectura cuando el rango se copia en Python (fallback y multipart)
+        buffer_size = 256 * 1024 if is_tv else 512 * 1024
+
+        if len(ranges) > 1:
+            response = self._multipart_response(media_path, ranges, size, buffer_size, content_type)
         else:
-            chunk_size = 8 * 1024 * 1024   # 8MB
-            buffer_size = 512 * 1024       # 512KB
-        
-        # Parsear el header Range
-        range_header = request.META['HTTP_RANGE']
-        range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-        
-        if not range_match:
-            return HttpResponse(status=416)  # Range Not Satisfiable
-            
-        start = int(range_match.group(1))
-        end = int(range_match.group(2)) if range_match.group(2) else size - 1
-        
-        # Límite de tamaño de chunk para mejorar el rendimiento
-        # Garantiza que no enviamos chunks demasiado grandes
-        if end - start > chunk_size:
-            end = start + chunk_size
+            start, end = ranges[0]
+            length = end - start + 1
+
+            # Camino principal: archivo acotado al rango vía wsgi.file_wrapper (sin bucle en Python).
+            # Sin buffer: cada lectura del fallback es una sola llamada y fileno() queda en la posición real
+            try:
+                if getattr(settings, 'MEDIA_RANGE_FILE_WRAPPER', True):
+                    response = FileResponse(
+                        RangeFile(open(media_path, 'rb', buffering=0), start, length),
+                        status=206,
+                        content_type=content_type,
+                    )
+                    response.block_size = buffer_size
+                else:
+                    response = self._range_stream(media_path, start, length, buffer_size, content_type, is_tv)
+            except FileNotFoundError:
+                invalidate_media_info(media_path)
+                return self.get_response(request)
+
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        for header, value in validators.items():
+            response[header] = value
+        response['Accept-Ranges'] = 'bytes'
+        response['X-Accel-Buffering'] = 'yes'  # Habilitar buffering en proxy
         
-        if start >= size:
-            return HttpResponse(status=416)  # Range Not Satisfiable
-            
-        length = end - start + 1
+        # Cabeceras específicas según el dispositivo
+        if is_hls_file:
+            # Nunca immutable: un rango viejo mezclado con el archivo recodificado no se reproduce
+            response['Cache-Control'] = HLS_CACHE_CONTROL
+            response['X-Content-Type-Options'] = 'nosniff'
+        elif is_tv:
+            # Cabeceras optimizadas para Smart TVs
+            response['Cache-Control'] = 'public, max-age=2592000'  # 30 días
+            # Evitar cabeceras complejas que pueden no ser bien soportadas
+            response['X-Content-Type-Options'] = 'nosniff'
+            # No añadir cabeceras Link complejas para TVs
+        else:
+            # Cabeceras estándar para navegadores de escritorio
+            response['Cache-Control'] = 'public, max-age=604800, immutable'
+            response['X-Content-Type-Options'] = 'nosniff'
         
-        # Abrir archivo con buffer optimizado para videos grandes
+        return response
+
+    def _multipart_response(self, media_path, ranges, size, buffer_size, content_type):
+        """206 multipart/byteranges: una parte por rango, con Content-Length exacto"""
+        boundary = uuid.uuid4().hex
+        heads = [
+            (
+                f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode('ascii')
+            for start, end in ranges
+        ]
+        tail = f'--{boundary}--\r\n'.encode('ascii')
+        length = sum(len(head) + (end - start + 1) + 2 for head, (start, end) in zip(heads, ranges)) + len(tail)
+
+        def parts():
+            with open(media_path, 'rb', buffering=0) as file_obj:
+                for head, (start, end) in zip(heads, ranges):
+                    yield head
+                    yield from RangeFileWrapper(file_obj, buffer_size, offset=start, length=end - start + 1)
+                    yield b'\r\n'
+            yield tail
+
+        response = StreamingHttpResponse(
+            parts(), status=206, content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(length)
+        return response
+
+    def _range_stream(self, media_path, start, length, buffer_size, content_type, is_tv):
+        """Fallback: el rango se lee en Python por bloques (``MEDIA_RANGE_FILE_WRAPPER=False``)"""
         try:
             # Abrir con buffer optimizado
             buffer_value = 512 * 1024 if is_tv else 1024 * 1024
@@ -151,24 +345,6 @@ class StreamingMediaMiddleware:
                 status=206,
                 content_type=content_type
             )
-        
-        response['Content-Length'] = str(length)
-        response['Content-Range'] = f'bytes {start}-{end}/{size}'
-        response['Accept-Ranges'] = 'bytes'
-        response['X-Accel-Buffering'] = 'yes'  # Habilitar buffering en proxy
-        
-        # Cabeceras específicas según el dispositivo
-        if is_tv:
-            # Cabeceras optimizadas para Smart TVs
-            response['Cache-Control'] = 'public, max-age=2592000'  # 30 días
-            # Evitar cabeceras complejas que pueden no ser bien soportadas
-            response['X-Content-Type-Options'] = 'nosniff'
-            # No añadir cabeceras Link complejas para TVs
-        else:
-            # Cabeceras estándar para navegadores de escritorio
-            response['Cache-Control'] = 'public, max-age=604800, immutable'
-            response['X-Content-Type-Options'] = 'nosniff'
-        
         return response
 
 
@@ -181,6 +357,8 @@ class CacheControlMiddleware:
         self.get_response = get_response
         # Extensiones de archivos de media
         self.media_extensions = ['.mp4', '.webm', '.ogg', '.mp3', '.jpg', '.jpeg', '.png', '.gif']
+        # Segmentos HLS (TS, fMP4) e init de fMP4: se reescriben al recodificar una calidad
+        self.segment_extensions = ['.ts', '.m4s', '_init.mp4']
         
     def __call__(self, request):
         response = self.get_response(request)
@@ -188,6 +366,15 @@ class CacheControlMiddleware:
         # Verificar si es un archivo multimedia basado en la extensión
         path = request.path.lower()
         is_media = any(path.endswith(ext) for ext in self.media_extensions)
+
+        if any(path.endswith(ext) for ext in self.segment_extensions):
+            response['Cache-Control'] = HLS_CACHE_CONTROL
+            response['X-Content-Type-Options'] = 'nosniff'
+            return response
+        if path.endswith('.m3u8'):
+            # Playlists: sync_renditions puede reescribir master.m3u8
+            response['Cache-Control'] = HLS_CACHE_CONTROL
+            return response
         
         if is_media:
             # Agregar encabezados de caché para archivos multimedia
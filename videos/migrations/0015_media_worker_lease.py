@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0014_alter_media_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
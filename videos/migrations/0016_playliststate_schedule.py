@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0015_media_worker_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playliststate',
+            name='schedule',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0016_playliststate_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0017_media_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
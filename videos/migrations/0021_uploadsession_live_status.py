@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0020_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='live_status',
+            field=models.CharField(blank=True, choices=[('running', 'En curso'), ('done', 'Lista'), ('failed', 'Falló'), ('unsupported', 'No aplica')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0021_uploadsession_live_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='target_path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -5,8 +5,10 @@ from django.contrib.auth.models import User
 import os
 import json
 import uuid
+import bisect
 from pathlib import Path
 from django.conf import settings
+from datetime import timedelta
 from django.utils import timezone
 from django.utils.text import slugify
 from django.urls import reverse
@@ -29,10 +31,15 @@ def media_upload_to(instance, filename):
 
 class PlaylistState(models.Model):
     """Estado global de la reproducción sincronizada"""
+    IMAGE_DURATION = 10          # Imágenes 10 segundos
+    DEFAULT_VIDEO_DURATION = 30  # Videos sin duración conocida
+
     is_active = models.BooleanField(default=False)
-    current_media_id = models.IntegerField(null=True, blank=True)
+    current_media_id = models.IntegerField(null=True, blank=True)  # Primer elemento al iniciar; el actual se deriva
     started_at = models.DateTimeField(null=True, blank=True)
     playlist_data = models.JSONField(default=list, blank=True)  # Lista de IDs shuffled
+    # Precalculado al iniciar: ids, durations, offsets (acumulados) y total del ciclo
+    schedule = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -44,91 +51,113 @@ class PlaylistState(models.Model):
         """Obtiene o crea el estado actual"""
         state, created = cls.objects.get_or_create(pk=1)
         return state
-    
-    def get_current_media(self):
-        """Obtiene el media actual basado en el tiempo transcurrido y duración"""
+
+    @classmethod
+    def item_duration(cls, media):
+        """Segundos que un elemento permanece en pantalla"""
+        if media.media_type == 'image':
+            return cls.IMAGE_DURATION
+        return int(media.duration) if media.duration else cls.DEFAULT_VIDEO_DURATION
+
+    @classmethod
+    def build_schedule(cls, media_list):
+        """Precalcula duraciones y offsets acumulados de la playlist en orden"""
+        ids, durations, offsets = [], [], []
+        total = 0
+        for media in media_list:
+            duration = cls.item_duration(media)
+            if duration <= 0:
+                continue
+            ids.append(media.id)
+            durations.append(duration)
+            offsets.append(total)
+            total += duration
+        return {'ids': ids, 'durations': durations, 'offsets': offsets, 'total': total}
+
+    def get_schedule(self):
+        """Schedule guardado; para estados previos se arma en memoria con una sola consulta"""
+        if self.schedule and self.schedule.get('ids'):
+            return self.schedule
+        if not self.playlist_data:
+            return None
+        media_map = Media.objects.in_bulk(self.playlist_data)
+        return self.build_schedule(media_map[i] for i in self.playlist_data if i in media_map)
+
+    def get_position(self, now=None):
+        """(índice en el schedule, segundos dentro del elemento) o None si no hay reproducción"""
         if not self.playlist_data or not self.is_active or not self.started_at:
             return None
-        
-        # Calcular qué elemento debería estar reproduciéndose ahora
-        total_elapsed = int((timezone.now() - self.started_at).total_seconds())
-        current_time = 0
-        
-        for i, media_id in enumerate(self.playlist_data):
-            try:
-                media = Media.objects.get(id=media_id)
-                
-                # Duración del elemento actual
-                if media.media_type == 'image':
-                    duration = 10  # Imágenes 10 segundos
-                else:
-                    duration = int(media.duration) if media.duration else 30
-                
-                # Si estamos dentro del tiempo de este elemento
-                if total_elapsed < current_time + duration:
-                    # Actualizar current_media_id si cambió
-                    if self.current_media_id != media_id:
-                        self.current_media_id = media_id
-                        self.save()
-                    return media
-                
-                current_time += duration
-                
-            except Media.DoesNotExist:
-                continue
-        
-        # Si llegamos aquí, la playlist terminó - reiniciar
-        if self.playlist_data:
-            first_media_id = self.playlist_data[0]
-            try:
-                first_media = Media.objects.get(id=first_media_id)
-                self.started_at = timezone.now()  # Reiniciar tiempo
-                self.current_media_id = first_media_id
-                self.save()
-                return first_media
-            except Media.DoesNotExist:
-                pass
-        
-        return None
+        schedule = self.get_schedule()
+        if not schedule or not schedule['total']:
+            return None
+
+        # La playlist se repite: el módulo del ciclo resuelve el reinicio
+        total_elapsed = int(((now or timezone.now()) - self.started_at).total_seconds())
+        cycle_position = total_elapsed % schedule['total']
+        index = bisect.bisect_right(schedule['offsets'], cycle_position) - 1
+        return index, cycle_position - schedule['offsets'][index]
+    
+    def remove_media(self, media_id, now=None):
+        """Quita un media borrado de la playlist sin saltos para las pantallas.
+
+        Se rearma el schedule sin ese elemento y se corre ``started_at`` para que
+        el elemento en curso siga en el mismo segundo; si el borrado era el actual,
+        continúa el siguiente desde su inicio. Devuelve True si hubo que guardar.
+        """
+        if media_id not in self.playlist_data:
+            return False
+        now = now or timezone.now()
+        position = self.get_position(now)
+        schedule = self.get_schedule() or {'ids': []}
+        ids = schedule['ids']
+
+        resume_id, resume_offset = None, 0
+        if position is not None:
+            index, resume_offset = position
+            resume_id = ids[index]
+            # Conservar también la fracción de segundo que get_position trunca
+            resume_offset += (now - self.started_at).total_seconds() % 1
+            if resume_id == media_id:
+                survivors = [i for i in ids[index + 1:] + ids[:index] if i != media_id]
+                resume_id, resume_offset = (survivors[0] if survivors else None), 0
+
+        self.playlist_data = [i for i in self.playlist_data if i != media_id]
+        media_map = Media.objects.in_bulk([i for i in ids if i != media_id])
+        self.schedule = self.build_schedule(media_map[i] for i in ids if i in media_map)
+
+        if not self.schedule['ids']:
+            self.is_active = False
+            self.current_media_id = None
+            self.started_at = None
+            self.schedule = {}
+        elif self.is_active and resume_id in self.schedule['ids']:
+            new_index = self.schedule['ids'].index(resume_id)
+            self.started_at = now - timedelta(seconds=self.schedule['offsets'][new_index] + resume_offset)
+        self.save()
+        return True
+
+    def get_current_media(self):
+        """Obtiene el media actual basado en el tiempo transcurrido y duración.
+
+        Solo lectura: la posición se deriva de ``started_at`` y el schedule, por
+        lo que no se guarda nada (ni al cambiar de elemento ni al reiniciar el ciclo).
+        """
+        position = self.get_position()
+        if position is None:
+            return None
+
+        media_id = self.get_schedule()['ids'][position[0]]
+        return Media.objects.filter(id=media_id).first()
     
     def get_elapsed_time(self):
         """Calcula tiempo transcurrido del media actual en segundos"""
-        if not self.started_at or not self.is_active or not self.playlist_data:
-            return 0
-        
-        total_elapsed = int((timezone.now() - self.started_at).total_seconds())
-        current_time = 0
-        
-        for media_id in self.playlist_data:
-            try:
-                media = Media.objects.get(id=media_id)
-                
-                # Duración del elemento
-                if media.media_type == 'image':
-                    duration = 10
-                else:
-                    duration = int(media.duration) if media.duration else 30
-                
-                # Si es el elemento actual, devolver tiempo dentro de él
-                if total_elapsed < current_time + duration:
-                    return total_elapsed - current_time
-                
-                current_time += duration
-                
-            except Media.DoesNotExist:
-                continue
-        
-        return 0
+        position = self.get_position()
+        return position[1] if position else 0
 
     def get_current_index(self):
         """Obtiene el índice actual en la playlist"""
-        if not self.playlist_data or not self.current_media_id:
-            return 0
-        
-        try:
-            return self.playlist_data.index(self.current_media_id)
-        except ValueError:
-            return 0
+        position = self.get_position()
+        return position[0] if position else 0
 
 class Media(models.Model):
     MEDIA_TYPES = (
@@ -162,6 +191,16 @@ class Media(models.Model):
     available_qualities = models.JSONField(default=list, blank=True)
     error_message = models.TextField(blank=True)
 
+    # Reclamo atómico de trabajos de transcodificación
+    worker_id = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # Nombres de archivos HLS generados (formato/extensión de segmento, init fMP4)
+    hls_layout = models.JSONField(default=dict, blank=True)
+    # SHA-256 del archivo original; videos idénticos comparten el mismo hls_path
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Avance de la transcodificación en curso (porcentaje, velocidad, ETA por calidad)
+    progress = models.JSONField(default=dict, blank=True)
+
     def __str__(self):
         return f"{self.title} ({self.media_type})"
     
@@ -184,6 +223,36 @@ class Media(models.Model):
         # Ahora raw debería ser 'hls/<basename>'
         return f"{settings.MEDIA_URL}{raw}/master.m3u8"
 
+    def get_hls_prefetch_urls(self):
+        """Playlist, init (fMP4) y primer segmento de la calidad más baja (la que hls.js carga primero)"""
+        manifest_url = self.get_hls_manifest_url()
+        if not manifest_url or not self.available_qualities:
+            return None
+        base_url = manifest_url[:-len('master.m3u8')]
+        lowest = self.available_qualities[-1]
+        layout = self.hls_layout or {}
+        extension = layout.get('segment_extension', '.ts')
+        if layout.get('single_file'):
+            # El segmento es un rango de un archivo que contiene toda la calidad:
+            # descargarlo completo no sirve como precarga
+            return {
+                'variant_url': f"{base_url}{lowest}.m3u8",
+                'init_url': None,
+                'first_segment_url': None,
+                'audio_urls': [f"{base_url}audio.m3u8"] if layout.get('audio') == 'shared' else [],
+            }
+        urls = {
+            'variant_url': f"{base_url}{lowest}.m3u8",
+            'init_url': f"{base_url}{lowest}_init.mp4" if layout.get('init') else None,
+            'first_segment_url': f"{base_url}{lowest}_000{extension}",
+            'audio_urls': [],
+        }
+        if layout.get('audio') == 'shared':
+            urls['audio_urls'] = [f"{base_url}audio.m3u8", f"{base_url}audio_000{extension}"]
+            if layout.get('init'):
+                urls['audio_urls'].insert(1, f"{base_url}audio_init.mp4")
+        return urls
+
     def get_stream_url(self):
         """Retorna la URL para reproducción, HLS si está listo, sino el archivo original"""
         if self.media_type == 'video':
@@ -192,6 +261,52 @@ class Media(models.Model):
         return self.file.url
 
 
+class UploadSession(models.Model):
+    """Subida por partes de un archivo grande (reanudable tras un corte de red).
+
+    Los bytes se agregan a un archivo de staging; el ``Media`` se crea recién al
+    finalizar, cuando el tamaño (y el SHA-256 si el cliente lo envió) coinciden.
+    """
+    STATUS = (
+        ('uploading', 'Subiendo'),
+        ('finalizing', 'Finalizando'),
+        ('completed', 'Completada'),
+    )
+    LIVE_STATUS = (
+        ('running', 'En curso'),
+        ('done', 'Lista'),
+        ('failed', 'Falló'),
+        ('unsupported', 'No aplica'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=200)
+    media_type = models.CharField(max_length=10, choices=Media.MEDIA_TYPES)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # SHA-256 esperado del archivo completo (opcional)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS, default='uploading')
+    # Transcodificación mientras se sube (HLS_TRANSCODE_WHILE_UPLOADING); vacío = aún no decidida
+    live_status = models.CharField(max_length=20, choices=LIVE_STATUS, blank=True)
+    # Destino en uploads/ elegido al finalizar (permite retomar un finalize interrumpido)
+    target_path = models.CharField(max_length=255, blank=True)
+    media = models.ForeignKey(Media, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'upload_session'
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.total_size})"
+
+    @property
+    def staging_path(self):
+        return Path(settings.MEDIA_ROOT) / 'uploads' / '_staging' / f"{self.id.hex}.part"
+
+
 # --- Eliminar archivo anterior al actualizar ---
 @receiver(pre_save, sender=Media)
 def delete_old_file_on_update(sender, instance, **kwargs):
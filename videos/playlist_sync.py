@@ -0,0 +1,203 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Media, PlaylistState
+
+SNAPSHOT_CACHE_KEY = 'videos:sync_snapshot'
+RECHECK_SECONDS = 2  # Relectura del snapshot (cambios hechos en otros procesos)
+
+_rebuild_lock = threading.Lock()
+_changed = threading.Condition()
+_streams_lock = threading.Lock()
+_open_streams = 0
+
+
+def _media_payload(media):
+    """Datos del media que necesita el reproductor"""
+    return {
+        'id': media.id,
+        'title': media.title,
+        'media_type': media.media_type,
+        'file_url': media.file.url if media.file else None,
+        'stream_url': media.get_stream_url(),
+        'hls_manifest_url': media.get_hls_manifest_url() if media.media_type == 'video' else None,
+        'is_stream_ready': media.is_stream_ready,
+        'width': media.width or 0,
+        'height': media.height or 0
+    }
+
+
+def build_sync_snapshot():
+    """Calcula desde la base de datos el estado compartido por todas las pantallas.
+
+    Los tiempos van en epoch (segundos) para que cada cliente calcule su
+    posición como ``ahora - item_started_at`` sin volver a consultar.
+    """
+    state = PlaylistState.get_current_state()
+    if not state.is_active or not state.playlist_data:
+        return {'active': False, 'message': 'Reproducción no iniciada'}
+
+    now = timezone.now()
+    position = state.get_position(now)
+    if position is None:
+        return {'active': False, 'message': 'Media no encontrado'}
+
+    # Actual y siguientes del schedule en una sola consulta
+    schedule = state.get_schedule()
+    index, offset = position
+    count = len(schedule['ids'])
+    lookahead = min(getattr(settings, 'SYNC_LOOKAHEAD', 2), count - 1)
+    upcoming = [(index + step) % count for step in range(1, lookahead + 1)]
+    media_map = Media.objects.in_bulk([schedule['ids'][i] for i in [index] + upcoming])
+    current_media = media_map.get(schedule['ids'][index])
+
+    started = state.started_at.timestamp()
+    item_started_at = started + int((now - state.started_at).total_seconds()) - offset
+    duration = schedule['durations'][index]
+    switch_at = item_started_at + duration
+    if current_media is None:
+        # Borrado en otro proceso antes de rearmar el schedule: solo esta franja queda vacía
+        return {'active': False, 'message': 'Media no encontrado', 'switch_at': switch_at}
+
+    next_items = []
+    starts_at = switch_at
+    for next_index in upcoming:
+        media = media_map.get(schedule['ids'][next_index])
+        if media is not None:
+            next_items.append({
+                'media': _media_payload(media),
+                'index': next_index,
+                'starts_at': starts_at,
+                'duration': schedule['durations'][next_index],
+                'prefetch': media.get_hls_prefetch_urls() if media.media_type == 'video' else None,
+            })
+        starts_at += schedule['durations'][next_index]
+
+    return {
+        'active': True,
+        'current_media': _media_payload(current_media),
+        'duration': duration,
+        'current_index': index,
+        'total_items': len(state.playlist_data),
+        'playlist': state.playlist_data,
+        'item_started_at': item_started_at,
+        'switch_at': switch_at,
+        'next': next_items,
+    }
+
+
+def get_sync_snapshot():
+    """Snapshot cacheado; solo se recalcula al cambiar de elemento, al expirar o al invalidarse.
+
+    Usa el cache de Django (LocMem por proceso o compartido según ``CACHES``).
+    ``SYNC_SNAPSHOT_TTL`` acota cuánto puede tardar un proceso en ver un
+    start/stop hecho en otro cuando el cache no es compartido.
+    """
+    snapshot = cache.get(SNAPSHOT_CACHE_KEY)
+    if _is_fresh(snapshot):
+        return snapshot
+    with _rebuild_lock:
+        # Otro hilo pudo reconstruirlo mientras esperábamos
+        snapshot = cache.get(SNAPSHOT_CACHE_KEY)
+        if _is_fresh(snapshot):
+            return snapshot
+        snapshot = build_sync_snapshot()
+        ttl = getattr(settings, 'SYNC_SNAPSHOT_TTL', 30)
+        if snapshot.get('switch_at'):
+            ttl = min(ttl, max(1, snapshot['switch_at'] - time.time()))
+        cache.set(SNAPSHOT_CACHE_KEY, snapshot, timeout=ttl)
+        return snapshot
+
+
+def _is_fresh(snapshot):
+    if snapshot is None:
+        return False
+    switch_at = snapshot.get('switch_at')
+    return not switch_at or time.time() < switch_at
+
+
+def invalidate_sync_snapshot():
+    cache.delete(SNAPSHOT_CACHE_KEY)
+    # Despertar streams/long-polls de este proceso
+    with _changed:
+        _changed.notify_all()
+
+
+def snapshot_version(snapshot):
+    """Identifica el elemento en curso; cambia al avanzar, iniciar o detener"""
+    if not snapshot['active']:
+        return 'inactive'
+    return f"{snapshot['current_media']['id']}@{snapshot['item_started_at']}"
+
+
+def sync_payload(snapshot, now=None):
+    """Respuesta de /api/sync/ a partir del snapshot (sin consultas)"""
+    if not snapshot['active']:
+        return {
+            'active': False,
+            'message': snapshot['message'],
+            'version': snapshot_version(snapshot),
+        }
+
+    # Posición derivada del reloj del servidor; el cliente puede seguir calculándola localmente
+    now = now or time.time()
+    elapsed_time = int(now - snapshot['item_started_at'])
+    return {
+        'active': True,
+        'current_media': snapshot['current_media'],
+        'position': elapsed_time,
+        'elapsed': elapsed_time,
+        'duration': snapshot['duration'],
+        'current_index': snapshot['current_index'],
+        'total_items': snapshot['total_items'],
+        'playlist': snapshot['playlist'],
+        'server_time': now,
+        'item_started_at': snapshot['item_started_at'],
+        'switch_at': snapshot['switch_at'],
+        'next': snapshot['next'],
+        'version': snapshot_version(snapshot),
+    }
+
+
+def wait_for_sync_change(version, timeout):
+    """Bloquea hasta que el snapshot deje de tener ``version`` o pase ``timeout``.
+
+    Devuelve el snapshot nuevo, o None si no hubo cambios.
+    """
+    deadline = time.time() + timeout
+    while True:
+        snapshot = get_sync_snapshot()
+        if snapshot_version(snapshot) != version:
+            return snapshot
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        wait = min(remaining, RECHECK_SECONDS)
+        if snapshot.get('switch_at'):
+            wait = min(wait, max(0.05, snapshot['switch_at'] - time.time()))
+        with _changed:
+            _changed.wait(wait)
+
+
+def acquire_stream_slot():
+    """Reserva un hilo para una conexión SSE/long-poll; False si se alcanzó el límite.
+
+    Cada conexión abierta ocupa un hilo de Waitress; run_waitress.py suma
+    ``SYNC_STREAM_MAX_CLIENTS`` a sus hilos para que no falten a las demás peticiones.
+    """
+    global _open_streams
+    with _streams_lock:
+        if _open_streams >= getattr(settings, 'SYNC_STREAM_MAX_CLIENTS', 50):
+            return False
+        _open_streams += 1
+        return True
+
+
+def release_stream_slot():
+    global _open_streams
+    with _streams_lock:
+        _open_streams -= 1
@@ -1,28 +1,23 @@
 import os
-import shutil
+from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
-from django.conf import settings
-from .models import Media
-from .utils import VideoProcessor
-import threading
-from pathlib import Path
+from .media_cache import invalidate_media_dir, invalidate_media_info
+from .models import Media, PlaylistState
+from .playlist_sync import invalidate_sync_snapshot
+from .transcoding import get_executor, notify_workers, process_media_job, release_hls_dir
 
 # Cuando se elimina un registro, borrar también el archivo físico
 @receiver(post_delete, sender=Media)
 def delete_media_file(sender, instance, **kwargs):
     if instance.file and os.path.isfile(instance.file.path):
         os.remove(instance.file.path)
-        # Borrar también los archivos HLS si existen
-        if instance.hls_path:
-            hls_dir = os.path.join(settings.MEDIA_ROOT, instance.hls_path)
-            if os.path.exists(hls_dir):
-                for root, dirs, files in os.walk(hls_dir, topdown=False):
-                    for name in files:
-                        os.remove(os.path.join(root, name))
-                    for name in dirs:
-                        os.rmdir(os.path.join(root, name))
-                os.rmdir(hls_dir)
+    if instance.file:
+        invalidate_media_info(instance.file.path)
+    # Borrar también los archivos HLS si ningún otro video idéntico los usa
+    if release_hls_dir(instance.hls_path):
+        invalidate_media_dir(os.path.join(settings.MEDIA_ROOT, instance.hls_path))
 
 # Cuando se actualiza un archivo, borrar el anterior
 @receiver(pre_save, sender=Media)
@@ -40,66 +35,38 @@ def replace_media_file(sender, instance, **kwargs):
     if old_file and old_file != new_file:
         if os.path.isfile(old_file.path):
             os.remove(old_file.path)
-        # Borrar también los archivos HLS si existen
-        if old_instance.hls_path:
-            hls_dir = os.path.join(settings.MEDIA_ROOT, old_instance.hls_path)
-            if os.path.exists(hls_dir):
-                for root, dirs, files in os.walk(hls_dir, topdown=False):
-                    for name in files:
-                        os.remove(os.path.join(root, name))
-                    for name in dirs:
-                        os.rmdir(os.path.join(root, name))
-                os.rmdir(hls_dir)
-
-def process_video(media_instance):
-    """Procesa un video en segundo plano"""
-    try:
-        previous_hls_path = media_instance.hls_path
-        ffmpeg_bin_dir = os.getenv('FFMPEG_BIN_DIR')
-        if ffmpeg_bin_dir:
-            os.environ['PATH'] = f"{ffmpeg_bin_dir}{os.pathsep}" + os.environ.get('PATH', '')
-
-        processor = VideoProcessor(media_instance.file.path, media_id=media_instance.pk)
-        success, metadata = processor.transcode_to_hls()
-
-        if success:
-            new_hls_path = metadata.get('relative_output_dir')
-            if previous_hls_path and new_hls_path and previous_hls_path != new_hls_path:
-                old_dir = Path(settings.MEDIA_ROOT) / previous_hls_path
-                if old_dir.exists() and old_dir.is_dir():
-                    shutil.rmtree(old_dir, ignore_errors=True)
+        invalidate_media_info(old_file.path)
+        # Borrar también los archivos HLS si ningún otro video idéntico los usa
+        if release_hls_dir(old_instance.hls_path, exclude_pk=instance.pk):
+            invalidate_media_dir(os.path.join(settings.MEDIA_ROOT, old_instance.hls_path))
 
-            Media.objects.filter(pk=media_instance.pk).update(
-                is_stream_ready=True,
-                stream_status='ready',
-                hls_path=new_hls_path,
-                available_qualities=metadata.get('qualities', []),
-                duration=metadata.get('duration') or 0.0,
-                width=metadata.get('width'),
-                height=metadata.get('height'),
-                error_message=''
-            )
-        else:
-            Media.objects.filter(pk=media_instance.pk).update(
-                stream_status='failed',
-                is_stream_ready=False,
-                error_message=metadata.get('error', 'Error en la transcodificación'),
-                available_qualities=[]
-            )
-    except Exception as e:
-        Media.objects.filter(pk=media_instance.pk).update(
-            stream_status='failed',
-            is_stream_ready=False,
-            error_message=str(e),
-            available_qualities=[]
-        )
+# Hash calculado por los upload handlers al recibir el archivo
+@receiver(pre_save, sender=Media)
+def assign_content_hash(sender, instance, **kwargs):
+    if instance.file and not instance.file._committed:
+        instance.content_hash = getattr(instance.file.file, 'content_hash', '')
 
 # Cuando se guarda un nuevo video, iniciar el procesamiento
 @receiver(post_save, sender=Media)
 def handle_video_upload(sender, instance, created, **kwargs):
     if created and instance.media_type == 'video':
-        # Iniciar procesamiento en segundo plano
-        instance.stream_status = 'processing'
-        instance.save(update_fields=['stream_status'])
-        thread = threading.Thread(target=process_video, args=(instance,))
-        thread.start()
\ No newline at end of file
+        # Queda 'pending' hasta que el pool web o un worker externo lo reclame.
+        # Se encola al confirmar: antes el pool podría no ver la fila todavía
+        media_id = instance.pk
+        transaction.on_commit(lambda: get_executor().submit(process_media_job, media_id))
+        transaction.on_commit(notify_workers)
+
+# Start/stop (o cualquier cambio del estado) y borrados invalidan el snapshot de /api/sync/
+@receiver(post_save, sender=PlaylistState)
+def playlist_state_changed(sender, instance, **kwargs):
+    invalidate_sync_snapshot()
+
+@receiver(post_delete, sender=Media)
+def media_deleted_sync(sender, instance, **kwargs):
+    # Sacarlo del schedule: si no, su franja queda sin media hasta detener la reproducción.
+    # Sin estado guardado no hay schedule que corregir (y no se crea uno al borrar)
+    state = PlaylistState.objects.filter(pk=1).first()
+    if state is None:
+        return
+    state.remove_media(instance.pk)
+    invalidate_sync_snapshot()
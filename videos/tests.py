@@ -1,3 +1,1000 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import chunked_upload, playlist_sync
+from .chunked_upload import (
+    UploadError, UploadFeed, abort_session, append_chunk, finalize_session, live_worker_id, start_session,
+    streamable_head, transcode_while_uploading
+)
+from .media_cache import clear_media_info, get_media_info, invalidate_media_dir, invalidate_media_info
+from .middleware import HLS_CACHE_CONTROL, CacheControlMiddleware, StreamingMediaMiddleware, parse_range_header
+from .models import Media, PlaylistState, UploadSession
+from .transcoding import (
+    TranscodeExecutor, WakeupListener, claim_media, claim_next_media, claim_published_media, notify_workers,
+    process_media_job, release_published_media, renew_lease
+)
+from .utils import VideoProcessor
+from .views import sync_stream
+
+# Los tests no escriben en logs/ffmpeg.log ni logs/streaming.log
+_QUIET_LOGGERS = ('videos.ffmpeg', 'videos.streaming')
+_saved_handlers = {}
+
+
+def setUpModule():
+    for name in _QUIET_LOGGERS:
+        logger = logging.getLogger(name)
+        _saved_handlers[name] = logger.handlers[:]
+        logger.handlers = [logging.NullHandler()]
+
+
+def tearDownModule():
+    for name, handlers in _saved_handlers.items():
+        logging.getLogger(name).handlers = handlers
+
+
+class SyncStreamWaitressTests(TransactionTestCase):
+    """/api/sync/stream/ servido por Waitress con las opciones de run_waitress.py"""
+
+    def setUp(self):
+        from run_waitress import WAITRESS_OPTIONS
+        from waitress.server import create_server
+
+        options = dict(WAITRESS_OPTIONS, threads=4)
+        self.server = create_server(WSGIHandler(), host='127.0.0.1', port=0, **options)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        # Sin clientes la tarea SSE termina al vencer SYNC_STREAM_SECONDS y el loop se vacía
+        for sock in self.clients:
+            sock.close()
+        self.server.task_dispatcher.shutdown(timeout=5)
+        self.server.close()
+        self.thread.join(timeout=5)
+        self.assertFalse(self.thread.is_alive())
+
+    @override_settings(SYNC_STREAM_SECONDS=3)
+    def test_first_event_arrives_before_stream_closes(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.effective_port), timeout=4)
+        self.clients.append(sock)
+        sock.sendall(b'GET /api/sync/stream/ HTTP/1.1\r\nHost: testserver\r\n\r\n')
+
+        started = time.monotonic()
+        data = b''
+        try:
+            while b'event: sync' not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        self.assertIn(b'event: sync', data)
+        # Con la salida retenida el evento llegaría recién al cerrar el stream (3 s)
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class ParseRangeHeaderTests(TestCase):
+    def test_single_and_open_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), [(900, 999)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=50-150,0-99', 1000), [(0, 150)])
+        self.assertEqual(parse_range_header('bytes=0-9,10-19,30-39', 1000), [(0, 19), (30, 39)])
+
+    def test_unsatisfiable_returns_empty_list(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_malformed_or_excessive_is_ignored(self):
+        for header in ['bytes=abc', 'items=0-1', 'bytes=', 'bytes=5-1', 'bytes=-', 'bytes=0-1-2']:
+            self.assertIsNone(parse_range_header(header, 1000), header)
+        many = 'bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(20))
+        self.assertIsNone(parse_range_header(many, 1000, max_ranges=16))
+
+
+class StreamingMediaMiddlewareTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.data = bytes(range(256)) * 40
+        with open(f'{self.media_root}/clip.mp4', 'wb') as handle:
+            handle.write(self.data)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        override.enable()
+        self.addCleanup(override.disable)
+        clear_media_info()
+        self.middleware = StreamingMediaMiddleware(lambda request: HttpResponse('django', status=404))
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return self.middleware(self.factory.get('/media/clip.mp4', **headers))
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_response_has_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+    def test_single_range(self):
+        response = self.get(HTTP_RANGE='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {len(self.data) - 100}-{len(self.data) - 1}/{len(self.data)}')
+        self.assertEqual(self.body(response), self.data[-100:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_multipart_content_length_matches_body(self):
+        response = self.get(HTTP_RANGE='bytes=0-9,100-199,-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(self.data[100:200], body)
+        self.assertIn(self.data[-5:], body)
+
+    def test_conditional_requests(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # If-Range vigente: rango; cambiado: archivo completo
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"otro"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.body(response)), len(self.data))
+
+    def test_missing_file_and_traversal_fall_through(self):
+        self.assertEqual(self.middleware(self.factory.get('/media/nope.mp4')).content, b'django')
+        self.assertEqual(self.middleware(self.factory.get('/media/../secret.mp4')).content, b'django')
+
+
+class MediaInfoCacheTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.path = self.write('clip.mp4', b'x' * 100)
+        clear_media_info()
+        self.addCleanup(clear_media_info)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    @override_settings(MEDIA_INFO_CACHE_TTL=60)
+    def test_hit_inside_ttl_skips_stat(self):
+        info = get_media_info(self.path, 'video/mp4')
+        with mock.patch('videos.media_cache.os.stat', side_effect=AssertionError('stat')):
+            self.assertIs(get_media_info(self.path, 'video/mp4'), info)
+
+    @override_settings(MEDIA_INFO_CACHE_TTL=0)
+    def test_expired_entry_is_revalidated(self):
+        info = get_media_info(self.path, 'video/mp4')
+        self.assertEqual(get_media_info(self.path, 'video/mp4').etag, info.etag)
+        self.write('clip.mp4', b'y' * 150)
+        self.assertEqual(get_media_info(self.path, 'video/mp4').size, 150)
+        os.unlink(self.path)
+        self.assertIsNone(get_media_info(self.path, 'video/mp4'))
+
+    @override_settings(MEDIA_INFO_CACHE_TTL=60)
+    def test_invalidation(self):
+        segment = self.write('hls/abc/720p_000.ts', b's' * 10)
+        get_media_info(self.path, 'video/mp4')
+        get_media_info(segment, 'video/mp2t')
+        self.write('clip.mp4', b'y' * 150)
+        invalidate_media_info(self.path)
+        self.assertEqual(get_media_info(self.path, 'video/mp4').size, 150)
+        os.unlink(segment)
+        invalidate_media_dir(os.path.join(self.root, 'hls', 'abc'))
+        self.assertIsNone(get_media_info(segment, 'video/mp2t'))
+
+    @override_settings(MEDIA_INFO_CACHE_SIZE=2, MEDIA_INFO_CACHE_TTL=60)
+    def test_size_bound_evicts_least_recently_used(self):
+        paths = [self.write(f'{name}.mp4', b'x') for name in 'abc']
+        get_media_info(paths[0], 'video/mp4')
+        get_media_info(paths[1], 'video/mp4')
+        get_media_info(paths[0], 'video/mp4')
+        get_media_info(paths[2], 'video/mp4')
+        with mock.patch('videos.media_cache.os.stat', side_effect=OSError):
+            self.assertIsNotNone(get_media_info(paths[0], 'video/mp4'))
+            self.assertIsNone(get_media_info(paths[1], 'video/mp4'))
+
+
+class PlaylistScheduleTests(TestCase):
+    def setUp(self):
+        # bulk_create: sin post_save, los videos no se encolan para transcodificar
+        self.items = Media.objects.bulk_create([
+            Media(title='a', media_type='video', file='a.mp4', duration=30),
+            Media(title='b', media_type='image', file='b.jpg'),
+            Media(title='c', media_type='video', file='c.mp4', duration=20),
+        ])
+        self.state = PlaylistState.get_current_state()
+        self.state.is_active = True
+        self.state.playlist_data = [media.id for media in self.items]
+        self.state.schedule = PlaylistState.build_schedule(self.items)
+        self.now = timezone.now()
+
+    def position_after(self, seconds):
+        self.state.started_at = self.now - timedelta(seconds=seconds)
+        return self.state.get_position(self.now)
+
+    def test_schedule_offsets(self):
+        self.assertEqual(self.state.schedule['offsets'], [0, 30, 40])
+        self.assertEqual(self.state.schedule['total'], 60)
+
+    def test_position_lookup(self):
+        self.assertEqual(self.position_after(0), (0, 0))
+        self.assertEqual(self.position_after(29), (0, 29))
+        self.assertEqual(self.position_after(30), (1, 0))
+        self.assertEqual(self.position_after(45), (2, 5))
+        # La playlist se repite
+        self.assertEqual(self.position_after(125), (0, 5))
+
+    def test_removing_current_item_resumes_next(self):
+        self.position_after(35)
+        self.state.save()
+        self.state.remove_media(self.items[1].id, now=self.now)
+        self.assertEqual(self.state.schedule['ids'], [self.items[0].id, self.items[2].id])
+        index, offset = self.state.get_position(self.now)
+        self.assertEqual((self.state.schedule['ids'][index], offset), (self.items[2].id, 0))
+
+    def test_deleting_media_without_state_creates_nothing(self):
+        PlaylistState.objects.all().delete()
+        self.items[0].delete()
+        self.assertFalse(PlaylistState.objects.exists())
+
+
+class StreamableHeadTests(TestCase):
+    def write(self, data):
+        handle = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.unlink, handle.name)
+        handle.write(data)
+        handle.close()
+        return handle.name
+
+    @staticmethod
+    def box(kind, payload=b''):
+        return (8 + len(payload)).to_bytes(4, 'big') + kind + payload
+
+    def test_faststart_mp4(self):
+        data = self.box(b'ftyp', b'isom0000') + self.box(b'moov', b'\0' * 32) + self.box(b'mdat', b'\0' * 64)
+        path = self.write(data)
+        self.assertTrue(streamable_head(path, len(data)))
+        # moov aún incompleto
+        self.assertIsNone(streamable_head(path, 30))
+
+    def test_moov_at_end(self):
+        data = self.box(b'ftyp', b'isom0000') + self.box(b'mdat', b'\0' * 64) + self.box(b'moov', b'\0' * 32)
+        self.assertFalse(streamable_head(self.write(data), len(data)))
+
+    def test_matroska_needs_probe_bytes(self):
+        path = self.write(b'\x1a\x45\xdf\xa3' + b'\0' * 60)
+        self.assertIsNone(streamable_head(path, 64))
+        self.assertTrue(streamable_head(path, 8 * 1024 * 1024))
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, UPLOAD_CHUNK_SIZE=100)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = bytes(range(250))
+        self.session = start_session(
+            'foto', 'image', 'foto.jpg', len(self.data), hashlib.sha256(self.data).hexdigest()
+        )
+
+    def put(self, offset, data, chunk_sha256=''):
+        return append_chunk(self.session, offset, io.BytesIO(data), len(data), chunk_sha256)
+
+    def upload_all(self):
+        for offset in range(0, len(self.data), 100):
+            self.put(offset, self.data[offset:offset + 100])
+
+    def test_out_of_order_chunk_is_rejected(self):
+        self.put(0, self.data[:100])
+        with self.assertRaises(UploadError) as error:
+            self.put(200, self.data[200:])
+        self.assertEqual((error.exception.status, error.exception.offset), (409, 100))
+
+    def test_chunk_checksum_mismatch(self):
+        with self.assertRaises(UploadError) as error:
+            self.put(0, self.data[:100], chunk_sha256='0' * 64)
+        self.assertEqual((error.exception.status, error.exception.offset), (422, 0))
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).received, 0)
+
+    def test_finalize_requires_all_chunks(self):
+        self.put(0, self.data[:100])
+        with self.assertRaises(UploadError) as error:
+            finalize_session(self.session)
+        self.assertEqual(error.exception.status, 409)
+
+    def test_finalize_creates_media_once(self):
+        self.upload_all()
+        media = finalize_session(self.session)
+        self.assertEqual(media.file.read(), self.data)
+        self.assertEqual(media.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertFalse(self.session.staging_path.exists())
+        # Reintento del cliente: mismo Media
+        self.assertEqual(finalize_session(UploadSession.objects.get(pk=self.session.pk)).pk, media.pk)
+        self.assertEqual(Media.objects.count(), 1)
+
+    def test_finalize_uses_the_hash_kept_while_uploading(self):
+        self.upload_all()
+        with mock.patch('videos.chunked_upload.file_sha256', side_effect=AssertionError('relectura')):
+            media = finalize_session(self.session)
+        self.assertEqual(media.content_hash, hashlib.sha256(self.data).hexdigest())
+
+    def test_rejected_chunk_does_not_enter_the_hash(self):
+        self.put(0, self.data[:100])
+        with self.assertRaises(UploadError):
+            self.put(100, b'x' * 100, chunk_sha256='0' * 64)
+        self.put(100, self.data[100:200])
+        self.put(200, self.data[200:])
+        with mock.patch('videos.chunked_upload.file_sha256', side_effect=AssertionError('relectura')):
+            self.assertEqual(finalize_session(self.session).content_hash, hashlib.sha256(self.data).hexdigest())
+
+    def test_without_running_hash_the_file_is_read_only_to_verify(self):
+        self.upload_all()
+        # Partes recibidas por otro proceso (o antes de un reinicio)
+        chunked_upload._running_digests.pop(self.session.pk)
+        self.assertEqual(finalize_session(self.session).content_hash, hashlib.sha256(self.data).hexdigest())
+
+        session = start_session('foto', 'image', 'foto.jpg', len(self.data))
+        for offset in range(0, len(self.data), 100):
+            append_chunk(session, offset, io.BytesIO(self.data[offset:offset + 100]), len(self.data[offset:offset + 100]))
+        chunked_upload._running_digests.pop(session.pk)
+        with mock.patch('videos.chunked_upload.file_sha256', side_effect=AssertionError('relectura')):
+            # Sin SHA-256 del cliente no se relee: lo calcula el worker si hace falta
+            self.assertEqual(finalize_session(session).content_hash, '')
+
+    def test_file_checksum_mismatch_restarts_upload(self):
+        UploadSession.objects.filter(pk=self.session.pk).update(sha256='0' * 64)
+        self.session.refresh_from_db()
+        self.upload_all()
+        with self.assertRaises(UploadError) as error:
+            finalize_session(self.session)
+        self.assertEqual((error.exception.status, error.exception.offset), (422, 0))
+        session = UploadSession.objects.get(pk=self.session.pk)
+        self.assertEqual((session.status, session.received), ('uploading', 0))
+
+    def test_abort_removes_staging(self):
+        self.put(0, self.data[:100])
+        session_id, staging = self.session.pk, self.session.staging_path
+        abort_session(self.session)
+        self.assertFalse(staging.exists())
+        self.assertFalse(UploadSession.objects.filter(pk=session_id).exists())
+
+
+class PublishedLeaseTests(TestCase):
+    def setUp(self):
+        self.first, self.second = Media.objects.bulk_create([
+            Media(title='a', media_type='video', file='a.mp4', stream_status='ready',
+                  is_stream_ready=True, hls_path='hls/abc'),
+            Media(title='b', media_type='video', file='b.mp4', stream_status='ready',
+                  is_stream_ready=True, hls_path='hls/abc'),
+        ])
+
+    def test_only_one_sync_can_rewrite_a_directory(self):
+        self.assertTrue(claim_published_media(self.first.pk, 'sync:1'))
+        self.assertFalse(claim_published_media(self.first.pk, 'sync:2'))
+        # Otra fila con el mismo hls_path tampoco se puede tomar mientras dure el lease
+        self.assertFalse(claim_published_media(self.second.pk, 'sync:2'))
+        media = Media.objects.get(pk=self.first.pk)
+        self.assertEqual((media.stream_status, media.worker_id), ('ready', 'sync:1'))
+
+        release_published_media(self.first.pk, 'sync:1')
+        self.assertTrue(claim_published_media(self.second.pk, 'sync:2'))
+
+    def test_expired_lease_can_be_taken(self):
+        Media.objects.filter(pk=self.first.pk).update(
+            worker_id='sync:1', lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertTrue(claim_published_media(self.first.pk, 'sync:2'))
+
+
+class FakeProbe:
+    """Reemplazo de subprocess.run con salidas de ffprobe/ffmpeg enlatadas."""
+
+    def __init__(self, video, audio=None, keyframes=()):
+        self.video = video
+        self.audio = audio
+        self.keyframes = keyframes
+
+    def __call__(self, cmd, **kwargs):
+        if '-version' in cmd:
+            stdout = 'ffmpeg version 6.1-test'
+        elif 'packet=pts_time,flags' in cmd:
+            stdout = ''.join(f'{pts:.3f},K__\n' for pts in self.keyframes)
+        elif 'a:0' in cmd:
+            stdout = json.dumps({'streams': [self.audio] if self.audio else []})
+        else:
+            stdout = json.dumps(self.video)
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr='')
+
+
+@override_settings(
+    HLS_SEGMENT_FORMAT='mpegts', HLS_AUDIO_MODE='per_variant', HLS_SINGLE_FILE=False,
+    HLS_SINGLE_PASS=True, HLS_PARALLEL_RENDITIONS=True, HLS_FFMPEG_THREADS=0,
+    HLS_SOURCE_AWARE_LADDER=True, HLS_STREAM_COPY=False, HLS_ENCODER_PROFILE='',
+)
+class EncodeTestCase(SimpleTestCase):
+    """VideoProcessor sobre un origen 1080p30 H.264 + AAC descrito por ffprobe enlatado."""
+
+    VIDEO = {
+        'streams': [{
+            'width': 1920, 'height': 1080, 'avg_frame_rate': '30/1', 'codec_name': 'h264',
+            'profile': 'High', 'pix_fmt': 'yuv420p', 'level': 40, 'bit_rate': '8000000',
+        }],
+        'format': {'duration': '60.0', 'bit_rate': '8128000'},
+    }
+    AUDIO = {'codec_name': 'aac', 'bit_rate': '128000', 'sample_rate': '48000'}
+
+    def setUp(self):
+        self.output_dir = Path(tempfile.mkdtemp()).resolve()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        self.probe = FakeProbe(self.VIDEO, self.AUDIO)
+        for patcher in [
+            mock.patch('videos.utils.subprocess.run', side_effect=self.probe),
+            mock.patch.dict(VideoProcessor._ffmpeg_versions, clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def processor(self, **kwargs):
+        processor = VideoProcessor('/videos/origen.mp4', content_hash='a' * 64, output_dir=self.output_dir, **kwargs)
+        processor.encoder_profile = {}
+        return processor
+
+    @staticmethod
+    def arg(cmd, flag):
+        return cmd[cmd.index(flag) + 1]
+
+
+class SinglePassCommandTests(EncodeTestCase):
+    def test_one_decode_feeds_every_rendition(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        self.assertEqual([v['quality'] for v in plan['variants']], ['1080p', '720p'])
+        cmd = processor._build_single_pass_cmd(plan['variants'], plan['gop'], plan['has_audio'])
+
+        self.assertEqual(cmd.count('-i'), 1)
+        graph = self.arg(cmd, '-filter_complex')
+        self.assertTrue(graph.startswith('[0:v]split=2[v0][v1];'))
+        self.assertIn('[v1]scale=1280:720[v1out]', graph)
+        self.assertEqual(cmd.count('0:a:0'), 2)
+        self.assertEqual(
+            self.arg(cmd, '-var_stream_map'),
+            'v:0,a:0,name:1080p v:1,a:1,name:720p',
+        )
+        self.assertEqual(self.arg(cmd, '-b:v:1'), '3000k')
+        self.assertEqual(self.arg(cmd, '-b:a:0'), '128k')
+        self.assertEqual(self.arg(cmd, '-g'), '120')
+        self.assertEqual(self.arg(cmd, '-hls_segment_filename'), f'{self.output_dir.as_posix()}/%v_%03d.ts')
+        self.assertEqual(cmd[-1], f'{self.output_dir.as_posix()}/%v.m3u8')
+
+    def test_without_audio(self):
+        self.probe.audio = None
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        cmd = processor._build_single_pass_cmd(plan['variants'], plan['gop'], plan['has_audio'])
+        self.assertNotIn('0:a:0', cmd)
+        self.assertEqual(self.arg(cmd, '-var_stream_map'), 'v:0,name:1080p v:1,name:720p')
+
+    def test_master_playlist(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        lines = processor._build_master_lines(plan['variants'], plan['fps'], plan['has_audio'])
+        self.assertEqual(lines[:3], ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS'])
+        self.assertEqual(lines[3], (
+            '#EXT-X-STREAM-INF:BANDWIDTH=5128000,AVERAGE-BANDWIDTH=5078000,RESOLUTION=1920x1080,'
+            'FRAME-RATE=30,CODECS="avc1.64001f,mp4a.40.2"'
+        ))
+        self.assertEqual(lines[4::2], ['1080p.m3u8', '720p.m3u8'])
+        # Calidad conservada sin huella: su línea publicada se copia tal cual
+        kept = dict(plan['variants'][1], stream_inf='#EXT-X-STREAM-INF:BANDWIDTH=1')
+        self.assertEqual(processor._build_master_lines([kept], plan['fps'])[3:], ['#EXT-X-STREAM-INF:BANDWIDTH=1', '720p.m3u8'])
+
+
+class ParallelThreadBudgetTests(EncodeTestCase):
+    def test_cpus_are_split_between_jobs_and_renditions(self):
+        processor = self.processor()
+        with mock.patch('videos.utils.os.cpu_count', return_value=8):
+            self.assertEqual(processor.threads_per_encoder(1), 8)
+            self.assertEqual(processor.threads_per_encoder(3), 2)
+            with mock.patch.object(VideoProcessor, '_active_jobs', 2):
+                self.assertEqual(processor.threads_per_encoder(3), 1)
+                self.assertEqual(processor.threads_per_encoder(2), 2)
+
+    @override_settings(HLS_FFMPEG_THREADS=5)
+    def test_manual_threads_win(self):
+        with mock.patch('videos.utils.os.cpu_count', return_value=8):
+            self.assertEqual(self.processor().threads_per_encoder(3), 5)
+
+    @override_settings(HLS_SINGLE_PASS=False)
+    def test_parallel_renditions_share_the_budget(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        used = []
+
+        def run_variant(variant, gop, has_audio, threads=None):
+            cmd = processor._build_variant_cmd(variant, gop, has_audio, threads)
+            used.append((variant['quality'], threading.current_thread().name, self.arg(cmd, '-threads')))
+            return True
+
+        with mock.patch('videos.utils.os.cpu_count', return_value=8), \
+                mock.patch.object(processor, '_run_variant', side_effect=run_variant):
+            created = processor._encode_variants(plan['variants'], plan['gop'], plan['has_audio'])
+
+        self.assertEqual(created, ['1080p', '720p'])
+        self.assertEqual(sorted(quality for quality, _, _ in used), ['1080p', '720p'])
+        self.assertTrue(all(name.startswith('rendition') for _, name, _ in used))
+        self.assertEqual({threads for _, _, threads in used}, {'4'})
+
+    @override_settings(HLS_PARALLEL_RENDITIONS=False, HLS_SINGLE_PASS=False)
+    def test_sequential_renditions_use_all_cpus(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        with mock.patch('videos.utils.os.cpu_count', return_value=8):
+            cmd = processor._build_variant_cmd(plan['variants'][0], plan['gop'], plan['has_audio'])
+        self.assertEqual(self.arg(cmd, '-threads'), '8')
+
+
+class RenditionFingerprintTests(EncodeTestCase):
+    def publish(self, processor, plan, fingerprints=None):
+        """Deja en disco las calidades del plan y su renditions.json."""
+        fingerprints = fingerprints or plan['fingerprints']
+        for quality in fingerprints:
+            (self.output_dir / f'{quality}.m3u8').write_text('#EXTM3U\n')
+            (self.output_dir / f'{quality}_000.ts').write_bytes(b'')
+        processor._write_renditions_manifest({
+            quality: {'quality': quality, 'fingerprint': fingerprint} for quality, fingerprint in fingerprints.items()
+        })
+
+    def test_fingerprint_tracks_what_changes_the_output(self):
+        processor = self.processor()
+        variant = processor.plan_renditions()['variants'][0]
+        fingerprint = processor._rendition_fingerprint(variant, 120, True)
+        self.assertEqual(processor._rendition_fingerprint(dict(variant), 120, True), fingerprint)
+        self.assertNotEqual(processor._rendition_fingerprint(variant, 96, True), fingerprint)
+        self.assertNotEqual(processor._rendition_fingerprint(variant, 120, False), fingerprint)
+        self.assertNotEqual(processor._rendition_fingerprint(dict(variant, video_bitrate=4000), 120, True), fingerprint)
+        other_source = VideoProcessor('/videos/origen.mp4', content_hash='b' * 64, output_dir=self.output_dir)
+        self.assertNotEqual(other_source._rendition_fingerprint(variant, 120, True), fingerprint)
+        VideoProcessor._ffmpeg_versions[processor.ffmpeg_binary] = 'ffmpeg version 7.0'
+        self.assertNotEqual(processor._rendition_fingerprint(variant, 120, True), fingerprint)
+
+    def test_matching_renditions_are_kept(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        self.assertEqual(plan['missing'], ['1080p', '720p'])
+        self.publish(processor, plan)
+
+        plan = self.processor().plan_renditions()
+        self.assertEqual((plan['keep'], plan['missing'], plan['obsolete']), ({'1080p', '720p'}, [], []))
+
+    def test_changed_and_obsolete_renditions(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        self.publish(processor, plan, dict(plan['fingerprints'], **{'720p': 'vieja', '480p': 'otra'}))
+
+        plan = self.processor().plan_renditions(keep_existing=['720p'])
+        # La huella registrada manda aunque la calidad venga en keep_existing
+        self.assertEqual((plan['keep'], plan['missing'], plan['obsolete']), ({'1080p'}, ['720p'], ['480p']))
+
+    def test_published_without_record_is_adopted(self):
+        (self.output_dir / '720p.m3u8').write_text('#EXTM3U\n')
+        (self.output_dir / '720p_000.ts').write_bytes(b'')
+        self.assertEqual(self.processor().plan_renditions(keep_existing=['720p'])['keep'], {'720p'})
+        self.assertEqual(self.processor().plan_renditions()['keep'], set())
+
+
+class SourceAwareLadderTests(EncodeTestCase):
+    def ladder(self, source_w=1920, source_h=1080, **kwargs):
+        variants = self.processor()._plan_variants(source_w, source_h, **kwargs)
+        return [(v['quality'], v['width'], v['height'], v['video_bitrate']) for v in variants]
+
+    def test_tiers_with_the_same_resolution_are_merged(self):
+        self.assertEqual(self.ladder(1280, 720, fps=30), [('720p', 1280, 720, 3000), ('360p', 640, 360, 900)])
+
+    def test_bitrate_scales_only_below_24_fps(self):
+        for fps in (24, 25, 30, 60):
+            self.assertEqual(self.ladder(fps=fps)[0][3], 5000, fps)
+        self.assertEqual(self.ladder(fps=15)[0][3], 3125)
+        # Nunca por debajo de la mitad
+        self.assertEqual(self.ladder(fps=5)[0][3], 2500)
+
+    def test_source_bitrate_caps_each_tier_by_area(self):
+        self.assertEqual(self.ladder(source_kbps=2000, fps=30), [
+            ('1080p', 1920, 1080, 2000),
+            ('720p', 1280, 720, int(2000 * (4 / 9) ** 0.75)),
+        ])
+
+    def test_tier_too_close_to_the_previous_is_dropped(self):
+        # 720p quedaría en el mínimo de 200 kbps: menos de LADDER_MIN_STEP por debajo de 250
+        self.assertEqual(self.ladder(source_kbps=250, fps=30), [('1080p', 1920, 1080, 250)])
+
+    def test_audio_bitrate_follows_the_source(self):
+        variants = self.processor()._plan_variants(1920, 1080, fps=30, audio_kbps=96)
+        self.assertEqual([v['audio_bitrate'] for v in variants], [96, 96])
+
+    @override_settings(HLS_SOURCE_AWARE_LADDER=False)
+    def test_fixed_ladder_when_disabled(self):
+        self.assertEqual(self.ladder(source_kbps=250, fps=12), [
+            ('1080p', 1920, 1080, 5000), ('720p', 1280, 720, 3000),
+        ])
+
+
+@override_settings(HLS_STREAM_COPY=True)
+class StreamCopyTests(EncodeTestCase):
+    STREAM = dict(EncodeTestCase.VIDEO['streams'][0], bit_rate='5000000')
+
+    def setUp(self):
+        super().setUp()
+        self.probe.video = {'streams': [self.STREAM], 'format': {'duration': '60.0'}}
+        self.probe.keyframes = [float(second) for second in range(0, 60, 2)]
+        self.variant = {'quality': '1080p', 'width': 1920, 'height': 1080, 'maxrate': 5500}
+
+    def can_copy(self, processor=None, source_kbps=5000, **stream):
+        processor = processor or self.processor()
+        processor.duration = 60.0
+        return processor._can_stream_copy(dict(self.STREAM, **stream), self.probe.audio, self.variant, source_kbps)
+
+    def test_compatible_top_tier_is_copied(self):
+        processor = self.processor()
+        top = processor.plan_renditions()['variants'][0]
+        self.assertTrue(top['copy'])
+        self.assertTrue(top['copy_audio'])
+        self.assertEqual((top['codecs'], top['video_bitrate'], top['audio_bitrate']), ('avc1.640028', 5000, 128))
+
+        cmd = processor._build_variant_cmd(top, 120, has_audio=True)
+        self.assertEqual(self.arg(cmd, '-c:v'), 'copy')
+        self.assertEqual(self.arg(cmd, '-c:a'), 'copy')
+        self.assertNotIn('-vf', cmd)
+
+    def test_incompatible_sources_are_encoded(self):
+        self.assertTrue(self.can_copy())
+        self.assertFalse(self.can_copy(codec_name='hevc'))
+        self.assertFalse(self.can_copy(pix_fmt='yuv420p10le'))
+        self.assertFalse(self.can_copy(profile='High 4:4:4 Predictive'))
+        self.assertFalse(self.can_copy(width=1920, height=800))
+        self.assertFalse(self.can_copy(source_kbps=9000))
+        self.assertFalse(self.can_copy(processor=self.processor(input_feed=iter(()))))
+
+    def test_irregular_keyframes_are_encoded(self):
+        self.probe.keyframes = [0.0, 2.0, 12.0, 14.0]
+        self.assertFalse(self.can_copy())
+        self.probe.keyframes = []
+        self.assertFalse(self.can_copy())
+
+    @override_settings(HLS_STREAM_COPY=False)
+    def test_disabled(self):
+        self.assertFalse(self.can_copy())
+
+
+@override_settings(HLS_SEGMENT_FORMAT='fmp4')
+class FragmentedMp4Tests(EncodeTestCase):
+    def test_each_rendition_gets_its_own_init(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        cmd = processor._build_variant_cmd(plan['variants'][1], plan['gop'], plan['has_audio'])
+        self.assertEqual(self.arg(cmd, '-hls_segment_type'), 'fmp4')
+        self.assertEqual(self.arg(cmd, '-hls_fmp4_init_filename'), '720p_init.mp4')
+        self.assertEqual(self.arg(cmd, '-hls_segment_filename'), f'{self.output_dir.as_posix()}/720p_%03d.m4s')
+
+        cmd = processor._build_single_pass_cmd(plan['variants'], plan['gop'], plan['has_audio'])
+        self.assertEqual(self.arg(cmd, '-hls_fmp4_init_filename'), '%v_init.mp4')
+        self.assertEqual(self.arg(cmd, '-hls_segment_filename'), f'{self.output_dir.as_posix()}/%v_%03d.m4s')
+
+    def test_layout_and_master_version(self):
+        processor = self.processor()
+        self.assertEqual(processor.get_layout(), {
+            'segment_format': 'fmp4', 'segment_extension': '.m4s', 'init': True,
+            'audio': 'per_variant', 'single_file': False,
+        })
+        plan = processor.plan_renditions()
+        self.assertEqual(processor._build_master_lines(plan['variants'], plan['fps'])[1], '#EXT-X-VERSION:7')
+
+    def test_init_is_part_of_the_rendition(self):
+        for name in ['720p.m3u8', '720p_init.mp4', '720p_000.m4s', '1080p_init.mp4']:
+            (self.output_dir / name).write_bytes(b'')
+        files = self.processor()._rendition_files(self.output_dir, '720p')
+        self.assertEqual(sorted(path.name for path in files), ['720p.m3u8', '720p_000.m4s', '720p_init.mp4'])
+
+    def test_init_and_segments_share_the_playlist_cache_policy(self):
+        middleware = CacheControlMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        for path in ['/media/hls/x/720p_init.mp4', '/media/hls/x/720p_000.m4s', '/media/hls/x/720p.m3u8']:
+            self.assertEqual(middleware(factory.get(path))['Cache-Control'], HLS_CACHE_CONTROL, path)
+
+
+@override_settings(HLS_SINGLE_FILE=True)
+class SingleFileTests(EncodeTestCase):
+    def test_one_file_per_rendition(self):
+        processor = self.processor()
+        plan = processor.plan_renditions()
+        cmd = processor._build_variant_cmd(plan['variants'][1], plan['gop'], plan['has_audio'])
+        self.assertEqual(self.arg(cmd, '-hls_flags'), 'independent_segments+single_file')
+        self.assertEqual(self.arg(cmd, '-hls_segment_filename'), f'{self.output_dir.as_posix()}/720p.ts')
+        self.assertEqual(processor._build_master_lines(plan['variants'], plan['fps'])[1], '#EXT-X-VERSION:4')
+
+    @override_settings(HLS_SEGMENT_FORMAT='fmp4')
+    def test_fmp4_keeps_the_init_inside_the_file(self):
+        processor = self.processor()
+        self.assertFalse(processor.get_layout()['init'])
+        self.assertEqual(processor._segment_name('720p'), '720p.m4s')
+        plan = processor.plan_renditions()
+        self.assertEqual(processor._build_master_lines(plan['variants'], plan['fps'])[1], '#EXT-X-VERSION:7')
+
+
+@skipUnless(shutil.which(settings.FFMPEG_BIN) and shutil.which(settings.FFPROBE_BIN), 'ffmpeg no disponible')
+@override_settings(
+    HLS_SEGMENT_FORMAT='mpegts', HLS_AUDIO_MODE='per_variant', HLS_SINGLE_FILE=True, HLS_SINGLE_PASS=True,
+    HLS_STREAM_COPY=False, HLS_ENCODER_PROFILE='',
+)
+class SingleFileEncodeTests(SimpleTestCase):
+    def test_playlist_addresses_segments_by_byte_range(self):
+        workdir = Path(tempfile.mkdtemp()).resolve()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        clip = workdir / 'clip.mp4'
+        subprocess.run([
+            settings.FFMPEG_BIN, '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=25:duration=9',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', clip.as_posix(),
+        ], check=True, timeout=60)
+
+        processor = VideoProcessor(clip, output_dir=workdir / 'hls')
+        processor.encoder_profile = {}
+        success, metadata = processor.transcode_to_hls()
+        self.assertTrue(success, metadata)
+
+        self.assertIn('#EXT-X-VERSION:4', (workdir / 'hls' / 'master.m3u8').read_text())
+        playlist = (workdir / 'hls' / '360p.m3u8').read_text()
+        self.assertGreaterEqual(playlist.count('#EXT-X-BYTERANGE:'), 2)
+        self.assertEqual(sorted(path.name for path in (workdir / 'hls').glob('360p*')), ['360p.m3u8', '360p.ts'])
+
+
+class VideoUploadQueueTests(TestCase):
+    def test_video_is_queued_after_commit(self):
+        executor = mock.Mock()
+        with mock.patch('videos.signals.get_executor', return_value=executor), \
+                mock.patch('videos.signals.notify_workers') as notify:
+            with self.captureOnCommitCallbacks() as callbacks:
+                media = Media.objects.create(title='v', media_type='video', file='v.mp4')
+                executor.submit.assert_not_called()
+            for callback in callbacks:
+                callback()
+        executor.submit.assert_called_once_with(process_media_job, media.pk)
+        notify.assert_called_once_with()
+
+    def test_pool_threads_claim_with_their_own_id(self):
+        claimed = []
+
+        def run(name):
+            thread = threading.Thread(target=process_media_job, args=(1,), name=name)
+            thread.start()
+            thread.join()
+
+        with mock.patch('videos.transcoding.claim_media', side_effect=lambda media_id, worker_id: claimed.append(worker_id)):
+            run('transcode-1')
+            run('transcode-2')
+        self.assertEqual(len(set(claimed)), 2)
+        self.assertTrue(claimed[0].startswith('web:') and claimed[0].endswith(':transcode-1'))
+
+
+class ClaimTests(TestCase):
+    def setUp(self):
+        self.media = Media.objects.bulk_create([Media(title='v', media_type='video', file='v.mp4')])[0]
+
+    def test_only_one_claim_wins(self):
+        self.assertTrue(claim_media(self.media.pk, 'worker:a'))
+        self.assertFalse(claim_media(self.media.pk, 'worker:b'))
+        self.assertIsNone(claim_next_media('worker:b'))
+        media = Media.objects.get(pk=self.media.pk)
+        self.assertEqual((media.stream_status, media.worker_id), ('processing', 'worker:a'))
+        self.assertGreater(media.lease_expires_at, timezone.now())
+
+    def test_expired_lease_is_reclaimed(self):
+        self.assertTrue(claim_media(self.media.pk, 'worker:a', lease_seconds=60))
+        Media.objects.filter(pk=self.media.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(claim_next_media('worker:b').pk, self.media.pk)
+        # El worker que perdió el lease ya no puede renovarlo
+        self.assertFalse(renew_lease(self.media.pk, 'worker:a'))
+        self.assertTrue(renew_lease(self.media.pk, 'worker:b'))
+
+
+class WakeupTests(SimpleTestCase):
+    def free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def test_notify_wakes_the_listener(self):
+        port = self.free_port()
+        listener = WakeupListener(host='127.0.0.1', port=port)
+        self.addCleanup(listener.close)
+        self.assertFalse(listener.wait(0.05))
+        with override_settings(TRANSCODE_WAKEUP_PORT=port, TRANSCODE_WAKEUP_HOSTS=['127.0.0.1']):
+            notify_workers()
+            notify_workers()
+        self.assertTrue(listener.wait(2))
+        # Los avisos acumulados cuentan como uno
+        self.assertFalse(listener.wait(0.05))
+
+    def test_without_port_it_falls_back_to_sleep(self):
+        listener = WakeupListener(port=0)
+        self.assertIsNone(listener.sock)
+        started = time.monotonic()
+        self.assertFalse(listener.wait(0.05))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+class TranscodeExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = TranscodeExecutor(max_workers=1, max_queue=2)
+        # Sin barrido de recuperación: estos tests no tocan la base
+        self.executor.sweep = lambda: 0
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def test_full_queue_rejects_work(self):
+        self.assertTrue(self.executor.submit(self.block))
+        self.assertTrue(self.started.wait(2))
+        self.assertTrue(self.executor.submit(lambda: None))
+        self.assertTrue(self.executor.submit(lambda: None))
+        self.assertFalse(self.executor.submit(lambda: None))
+        self.assertEqual(self.executor.stats()['queue_depth'], 2)
+        self.assertEqual(self.executor.stats()['in_flight'], 1)
+
+    def test_priority_then_fifo(self):
+        executor = TranscodeExecutor(max_workers=1, max_queue=5)
+        executor.sweep = lambda: 0
+        ran = []
+        executor.submit(self.block)
+        self.assertTrue(self.started.wait(2))
+        executor.submit(ran.append, 'recuperado', priority=20)
+        executor.submit(ran.append, 'subida-1')
+        executor.submit(ran.append, 'subida-2')
+        self.release.set()
+        executor._queue.join()
+        self.assertEqual(ran, ['subida-1', 'subida-2', 'recuperado'])
+
+    def test_disabled_pool_rejects_everything(self):
+        self.assertFalse(TranscodeExecutor(max_workers=0).submit(lambda: None))
+
+
+class SyncStreamSlotTests(TestCase):
+    def open_streams(self):
+        return playlist_sync._open_streams
+
+    def test_slot_is_released_when_closed_before_iterating(self):
+        before = self.open_streams()
+        response = sync_stream(RequestFactory().get('/api/sync/stream/'))
+        self.assertEqual(self.open_streams(), before + 1)
+        response.close()
+        self.assertEqual(self.open_streams(), before)
+        # El servidor puede llamar close() más de una vez
+        response.close()
+        self.assertEqual(self.open_streams(), before)
+
+    @override_settings(SYNC_STREAM_MAX_CLIENTS=0)
+    def test_no_slots_left(self):
+        self.assertEqual(sync_stream(RequestFactory().get('/api/sync/stream/')).status_code, 503)
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=100, HLS_TRANSCODE_WHILE_UPLOADING=False)
+class LiveUploadFeedTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name, value in [('POLL_SECONDS', 0.01), ('MISSING_SECONDS', 0.05)]:
+            patcher = mock.patch.object(UploadFeed, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.data = bytes(range(250))
+        self.session = start_session('clip', 'video', 'clip.mp4', len(self.data))
+
+    def upload(self, end=None):
+        for offset in range(0, end or len(self.data), 100):
+            chunk = self.data[offset:offset + 100]
+            append_chunk(self.session, offset, io.BytesIO(chunk), len(chunk))
+
+    def test_feed_follows_the_file_through_finalize(self):
+        self.upload()
+        feed = iter(UploadFeed(self.session))
+        self.assertEqual(next(feed), self.data)
+        self.assertRaises(StopIteration, next, feed)
+
+    def test_restarted_upload_stops_the_feed(self):
+        self.upload(200)
+        feed = iter(UploadFeed(self.session))
+        self.assertEqual(next(feed), self.data[:200])
+        UploadSession.objects.filter(pk=self.session.pk).update(received=0)
+        with self.assertRaisesMessage(UploadError, 'La subida se reinició'):
+            next(feed)
+
+    def test_missing_file_falls_back_to_normal_transcoding(self):
+        self.upload()
+        UploadSession.objects.filter(pk=self.session.pk).update(live_status='running')
+        self.session.refresh_from_db()
+        media = finalize_session(self.session)
+        self.assertEqual(media.worker_id, live_worker_id(self.session.pk))
+        os.unlink(media.file.path)
+
+        errors = []
+
+        class FeedReader:
+            """ffmpeg leyendo stdin: la entrada interrumpida termina en error"""
+
+            def __init__(self, input_path, input_feed, **kwargs):
+                self.input_feed = input_feed
+
+            def transcode_to_hls(self):
+                try:
+                    for _ in self.input_feed:
+                        pass
+                except UploadError as exc:
+                    errors.append(str(exc))
+                    return False, {'error': 'ffmpeg_failed'}
+                return True, {}
+
+        executor = mock.Mock()
+        with mock.patch('videos.chunked_upload.VideoProcessor', FeedReader), \
+                mock.patch('videos.transcoding.get_executor', return_value=executor), \
+                mock.patch('videos.transcoding.notify_workers'):
+            self.assertFalse(transcode_while_uploading(self.session.pk))
+        self.assertEqual(errors, ['Archivo de la subida no encontrado'])
+
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).live_status, 'failed')
+        media.refresh_from_db()
+        self.assertEqual((media.stream_status, media.worker_id), ('pending', ''))
+        executor.submit.assert_called_once_with(process_media_job, media.pk)
+
+    def test_feed_gives_up_when_the_file_never_appears(self):
+        self.upload()
+        self.session.staging_path.unlink()
+        with self.assertRaisesMessage(UploadError, 'Archivo de la subida no encontrado'):
+            list(UploadFeed(self.session))
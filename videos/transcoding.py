@@ -0,0 +1,511 @@
+import itertools
+import logging
+import os
+import queue
+import select
+import shutil
+import socket
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Media
+from .upload_handlers import file_sha256
+from .utils import VideoProcessor
+
+logger = logging.getLogger('videos.ffmpeg')
+
+
+def default_worker_id(prefix='worker'):
+    """Identificador único por proceso (host:pid) para los reclamos."""
+    return f"{prefix}:{socket.gethostname()}:{os.getpid()}"
+
+
+def get_lease_seconds():
+    return int(getattr(settings, 'TRANSCODE_LEASE_SECONDS', 300))
+
+
+def _claimable(now):
+    """Pendientes, o en proceso con lease vencido/ausente (worker caído)."""
+    return (
+        Q(stream_status='pending')
+        | Q(stream_status='processing', lease_expires_at__lt=now)
+        | Q(stream_status='processing', lease_expires_at__isnull=True)
+    )
+
+
+def claim_media(media_id, worker_id, lease_seconds=None):
+    """Reclama un Media con un UPDATE condicional. True solo para un único worker."""
+    now = timezone.now()
+    lease_seconds = lease_seconds or get_lease_seconds()
+    updated = Media.objects.filter(_claimable(now), pk=media_id, media_type='video').update(
+        stream_status='processing',
+        worker_id=worker_id,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        error_message='',
+        progress={},
+    )
+    return updated == 1
+
+
+def claim_next_media(worker_id, lease_seconds=None):
+    """Reclama el video reclamable más antiguo. Devuelve el Media o None."""
+    candidates = list(
+        Media.objects.filter(_claimable(timezone.now()), media_type='video')
+        .order_by('uploaded_at')
+        .values_list('pk', flat=True)[:10]
+    )
+    for media_id in candidates:
+        if claim_media(media_id, worker_id, lease_seconds):
+            return Media.objects.get(pk=media_id)
+    return None
+
+
+def claim_published_media(media_id, worker_id, lease_seconds=None):
+    """Toma el lease de un Media listo para reescribir su directorio HLS publicado.
+
+    El video sigue en 'ready' (se sigue sirviendo). Falla si otro worker tiene un
+    lease vigente sobre esa fila o sobre otra que comparte el mismo ``hls_path``.
+    """
+    now = timezone.now()
+    lease_seconds = lease_seconds or get_lease_seconds()
+    media = Media.objects.filter(pk=media_id).only('hls_path').first()
+    if media is None:
+        return False
+    busy = Media.objects.filter(hls_path=media.hls_path, lease_expires_at__gte=now).exclude(pk=media_id)
+    if media.hls_path and busy.exists():
+        return False
+    updated = Media.objects.filter(
+        Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True),
+        pk=media_id,
+        stream_status='ready',
+    ).update(worker_id=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds))
+    return updated == 1
+
+
+def release_published_media(media_id, worker_id):
+    """Suelta el lease tomado con ``claim_published_media``."""
+    Media.objects.filter(pk=media_id, worker_id=worker_id, stream_status='ready').update(
+        worker_id='', lease_expires_at=None
+    )
+
+
+def renew_lease(media_id, worker_id, lease_seconds=None):
+    lease_seconds = lease_seconds or get_lease_seconds()
+    return Media.objects.filter(
+        pk=media_id, worker_id=worker_id, stream_status__in=('processing', 'ready')
+    ).update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds)) == 1
+
+
+class LeaseHeartbeat:
+    """Renueva el lease en segundo plano mientras dura la transcodificación."""
+
+    def __init__(self, media_id, worker_id, lease_seconds=None):
+        self.media_id = media_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds or get_lease_seconds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{media_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def renew(self):
+        return renew_lease(self.media_id, self.worker_id, self.lease_seconds)
+
+    def _run(self):
+        interval = max(5, self.lease_seconds // 3)
+        try:
+            while not self._stop.wait(interval):
+                try:
+                    if not self.renew():
+                        logger.warning(f"[Lease] Media {self.media_id} ya no pertenece a {self.worker_id}")
+                except Exception as exc:
+                    logger.warning(f"[Lease] No se pudo renovar media {self.media_id}: {exc}")
+        finally:
+            connection.close()
+
+
+class ProgressReporter:
+    """Callback de progreso que guarda en la fila como máximo cada ``TRANSCODE_PROGRESS_INTERVAL`` s.
+
+    Lo invocan los hilos que leen ffmpeg; si no es el hilo que creó el reporter
+    (calidades en paralelo) la conexión de ese hilo se cierra tras escribir.
+    """
+
+    def __init__(self, media_id, worker_id, interval=None):
+        self.media_id = media_id
+        self.worker_id = worker_id
+        self.interval = interval if interval is not None else getattr(settings, 'TRANSCODE_PROGRESS_INTERVAL', 2)
+        self._lock = threading.Lock()
+        self._last_saved = 0.0
+        self._owner = threading.current_thread()
+
+    def __call__(self, progress):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_saved < self.interval:
+                return
+            self._last_saved = now
+        try:
+            Media.objects.filter(pk=self.media_id, worker_id=self.worker_id).update(progress=progress)
+        except Exception as exc:
+            logger.warning(f"[Progreso] No se pudo guardar media {self.media_id}: {exc}")
+        finally:
+            # Los hilos de calidades en paralelo son efímeros: no dejar conexiones abiertas
+            if threading.current_thread() is not self._owner:
+                connection.close()
+
+
+def release_hls_dir(hls_path, exclude_pk=None):
+    """Borra el directorio HLS solo si ningún otro Media lo referencia.
+
+    Varios Media con el mismo ``content_hash`` comparten directorio; el conteo de
+    referencias es la cantidad de filas con ese ``hls_path``.
+    """
+    if not hls_path:
+        return False
+    references = Media.objects.filter(hls_path=hls_path)
+    if exclude_pk is not None:
+        references = references.exclude(pk=exclude_pk)
+    if references.exists():
+        logger.info(f"[HLS] {hls_path} sigue en uso, no se elimina")
+        return False
+    hls_dir = Path(settings.MEDIA_ROOT) / hls_path
+    if hls_dir.is_dir():
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        return True
+    return False
+
+
+def find_reusable_hls(media):
+    """Media listo con el mismo contenido cuyo HLS sigue en disco, o None."""
+    if not media.content_hash:
+        return None
+    candidates = (
+        Media.objects.filter(content_hash=media.content_hash, stream_status='ready', is_stream_ready=True)
+        .exclude(pk=media.pk)
+        .exclude(hls_path='')
+        .order_by('uploaded_at')
+    )
+    for candidate in candidates:
+        if (Path(settings.MEDIA_ROOT) / candidate.hls_path / 'master.m3u8').exists():
+            return candidate
+    return None
+
+
+def stream_ready_fields(metadata):
+    """Campos del Media cuando su HLS quedó listo (libera el reclamo del worker)."""
+    return {
+        'is_stream_ready': True,
+        'stream_status': 'ready',
+        'hls_path': metadata.get('relative_output_dir'),
+        'hls_layout': metadata.get('layout', {}),
+        'available_qualities': metadata.get('qualities', []),
+        'duration': metadata.get('duration') or 0.0,
+        'width': metadata.get('width'),
+        'height': metadata.get('height'),
+        'error_message': '',
+        'worker_id': '',
+        'lease_expires_at': None,
+        'progress': {},
+    }
+
+
+def requeue_media(media_id, worker_id):
+    """Devuelve a 'pending' un video reclamado por ``worker_id`` y lo encola de nuevo."""
+    released = Media.objects.filter(pk=media_id, worker_id=worker_id, stream_status='processing').update(
+        stream_status='pending', worker_id='', lease_expires_at=None, progress={}
+    )
+    if released:
+        get_executor().submit(process_media_job, media_id)
+        notify_workers()
+    return bool(released)
+
+
+def transcode_media(media, worker_id, lease_seconds=None):
+    """Transcodifica un Media ya reclamado por ``worker_id`` y actualiza su fila.
+
+    Las actualizaciones finales se filtran por ``worker_id`` para que un worker
+    que perdió su lease no pise el resultado de quien lo reclamó después.
+    """
+    owned = Media.objects.filter(pk=media.pk, worker_id=worker_id)
+    try:
+        previous_hls_path = media.hls_path
+        if not media.content_hash:
+            # Subidos antes del hash en la subida (o sin los upload handlers)
+            media.content_hash = file_sha256(media.file.path)
+            owned.update(content_hash=media.content_hash)
+
+        source = find_reusable_hls(media)
+        if source is not None:
+            logger.info(f"[Worker {worker_id}] Media {media.pk} idéntico a {source.pk}, reutilizando {source.hls_path}")
+            updated = owned.update(
+                is_stream_ready=True,
+                stream_status='ready',
+                hls_path=source.hls_path,
+                hls_layout=source.hls_layout,
+                available_qualities=source.available_qualities,
+                duration=source.duration,
+                width=source.width,
+                height=source.height,
+                error_message='',
+                worker_id='',
+                lease_expires_at=None,
+                progress={},
+            )
+            if updated and previous_hls_path != source.hls_path:
+                release_hls_dir(previous_hls_path, exclude_pk=media.pk)
+            return bool(updated)
+
+        processor = VideoProcessor(
+            media.file.path,
+            media_id=media.pk,
+            progress_callback=ProgressReporter(media.pk, worker_id),
+            content_hash=media.content_hash,
+        )
+        with LeaseHeartbeat(media.pk, worker_id, lease_seconds):
+            success, metadata = processor.transcode_to_hls()
+
+        if success:
+            new_hls_path = metadata.get('relative_output_dir')
+            updated = owned.update(**stream_ready_fields(metadata))
+            if updated and new_hls_path and previous_hls_path != new_hls_path:
+                release_hls_dir(previous_hls_path, exclude_pk=media.pk)
+            return bool(updated)
+
+        owned.update(
+            stream_status='failed',
+            is_stream_ready=False,
+            error_message=metadata.get('error', 'Error en la transcodificación'),
+            available_qualities=[],
+            worker_id='',
+            lease_expires_at=None,
+        )
+    except Exception as exc:
+        logger.exception(f"[Worker {worker_id}] Error transcodificando media {media.pk}: {exc}")
+        owned.update(
+            stream_status='failed',
+            is_stream_ready=False,
+            error_message=str(exc),
+            available_qualities=[],
+            worker_id='',
+            lease_expires_at=None,
+        )
+    return False
+
+
+def process_media_job(media_id):
+    """Trabajo del pool web: reclama el video y lo transcodifica si nadie más lo tomó."""
+    # Un id por hilo del pool: cada uno renueva y libera solo sus propios leases
+    worker_id = f"{default_worker_id('web')}:{threading.current_thread().name}"
+    if not claim_media(media_id, worker_id):
+        logger.info(f"[TranscodeExecutor] Media {media_id} ya reclamado por otro worker")
+        return False
+    return transcode_media(Media.objects.get(pk=media_id), worker_id)
+
+
+def _wakeup_port():
+    return int(getattr(settings, 'TRANSCODE_WAKEUP_PORT', 0) or 0)
+
+
+def notify_workers():
+    """Avisa por UDP a los workers externos que hay un trabajo nuevo (best effort)."""
+    port = _wakeup_port()
+    if not port:
+        return
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for host in getattr(settings, 'TRANSCODE_WAKEUP_HOSTS', ['127.0.0.1']):
+            try:
+                sock.sendto(b'wake', (host, port))
+            except OSError as exc:
+                logger.debug(f"[Wakeup] No se pudo avisar a {host}:{port}: {exc}")
+
+
+class WakeupListener:
+    """Socket UDP donde un worker espera avisos en lugar de dormir a ciegas.
+
+    Si el puerto no está configurado o no se puede abrir, ``wait`` degrada a
+    un simple ``sleep`` y el worker sigue funcionando solo con polling.
+    """
+
+    def __init__(self, host=None, port=None):
+        self.sock = None
+        port = _wakeup_port() if port is None else port
+        if not port:
+            return
+        host = host or getattr(settings, 'TRANSCODE_WAKEUP_BIND', '127.0.0.1')
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            sock.setblocking(False)
+            self.sock = sock
+        except OSError as exc:
+            logger.warning(f"[Wakeup] No se pudo escuchar en {host}:{port}, solo polling: {exc}")
+
+    def wait(self, timeout):
+        """Bloquea hasta un aviso o hasta ``timeout``. True si llegó un aviso."""
+        if self.sock is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return False
+        # Varios avisos seguidos cuentan como uno solo
+        while True:
+            try:
+                self.sock.recv(64)
+            except OSError:
+                break
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class TranscodeExecutor:
+    """Pool acotado de hilos para transcodificar dentro del proceso web.
+
+    - ``max_workers`` trabajos de ffmpeg simultáneos como máximo
+    - Cola con prioridad (FIFO dentro de la misma prioridad) y tamaño máximo
+    - ``submit`` no bloquea: si la cola está llena devuelve False (backpressure)
+    - ``stats`` expone profundidad de cola y trabajos en curso
+    - ``max_workers=0`` desactiva el pool (todo queda para los workers externos)
+    - Al arrancar (y cada ``recovery_interval`` s si no es 0) encola los videos
+      reclamables: la cola vive en memoria y se pierde al reiniciar el proceso
+    """
+
+    def __init__(self, max_workers=1, max_queue=20, recovery_interval=0):
+        self.max_workers = max(0, int(max_workers))
+        self.max_queue = max(1, int(max_queue))
+        self.recovery_interval = max(0, int(recovery_interval or 0))
+        self._queue = queue.PriorityQueue(maxsize=self.max_queue)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._threads = []
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.max_workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"transcode-{index + 1}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            if self.max_workers:
+                thread = threading.Thread(target=self._recover, name='transcode-recovery', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def start(self):
+        """Arranca los hilos y el barrido de recuperación sin esperar a un ``submit``."""
+        if self.max_workers:
+            self._ensure_started()
+
+    def submit(self, fn, *args, priority=10):
+        """Encola ``fn(*args)``. Devuelve False si la cola está llena o el pool está desactivado."""
+        if not self.max_workers:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((priority, next(self._counter), fn, args))
+        except queue.Full:
+            logger.warning(f"[TranscodeExecutor] Cola llena ({self.max_queue}), trabajo rechazado")
+            return False
+        logger.info(f"[TranscodeExecutor] Trabajo encolado {self.stats()}")
+        return True
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'queue_depth': self._queue.qsize(),
+            'in_flight': in_flight,
+        }
+
+    def sweep(self):
+        """Encola los videos pendientes o con lease vencido. Devuelve cuántos encoló.
+
+        Solo con la cola vacía: lo que ya está en cola no se duplica, y los que
+        otro proceso procese se descartan al reclamarlos (``claim_media``).
+        """
+        if not self._queue.empty():
+            return 0
+        candidates = list(
+            Media.objects.filter(_claimable(timezone.now()), media_type='video')
+            .order_by('uploaded_at')
+            .values_list('pk', flat=True)[:self.max_queue]
+        )
+        submitted = sum(1 for media_id in candidates if self.submit(process_media_job, media_id, priority=20))
+        if submitted:
+            logger.info(f"[TranscodeExecutor] Recuperados {submitted} videos pendientes")
+        return submitted
+
+    def _recover(self):
+        while True:
+            close_old_connections()
+            try:
+                self.sweep()
+            except Exception as exc:
+                logger.warning(f"[TranscodeExecutor] No se pudieron recuperar pendientes: {exc}")
+            finally:
+                close_old_connections()
+            if not self.recovery_interval:
+                return
+            time.sleep(self.recovery_interval)
+
+    def _worker(self):
+        while True:
+            _, _, fn, args = self._queue.get()
+            with self._lock:
+                self._in_flight += 1
+            close_old_connections()
+            try:
+                fn(*args)
+            except Exception as exc:
+                logger.exception(f"[TranscodeExecutor] Error en trabajo: {exc}")
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Devuelve el pool del proceso, creándolo con la configuración de settings."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = TranscodeExecutor(
+                max_workers=getattr(settings, 'TRANSCODE_MAX_WORKERS', 1),
+                max_queue=getattr(settings, 'TRANSCODE_QUEUE_SIZE', 20),
+                recovery_interval=getattr(settings, 'TRANSCODE_RECOVERY_SECONDS', 300),
+            )
+        return _executor
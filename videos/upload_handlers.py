@@ -0,0 +1,42 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 de un archivo ya guardado (videos subidos antes del hash en la subida)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentHashMixin:
+    """Calcula el SHA-256 mientras el archivo se recibe y lo deja en ``file.content_hash``.
+
+    Evita releer el archivo completo después de la subida; el hash permite
+    reutilizar el HLS de un video idéntico ya procesado.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self._content_hash = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._content_hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_hash = self._content_hash.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
@@ -16,6 +16,10 @@ urlpatterns = [
     path('upload/', views.upload_media, name='upload'),
     path('edit/<int:media_id>/', views.edit_media, name='edit_media'),
     path('delete/<int:media_id>/', views.delete_media, name='delete_media'),
+    # Subida por partes reanudable (videos grandes)
+    path('api/upload/', views.chunked_upload_init, name='chunked_upload_init'),
+    path('api/upload/<uuid:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('api/upload/<uuid:upload_id>/finalize/', views.chunked_upload_finalize, name='chunked_upload_finalize'),
     
     # Gestión de Tareas - Dashboard y Auth
     path('tareas/', views.tareas_dashboard, name='tareas_dashboard'),
@@ -70,5 +74,7 @@ urlpatterns = [
     
     # Sync API
     path('api/sync/', views.sync_status, name='sync_status'),
+    path('api/sync/stream/', views.sync_stream, name='sync_stream'),
     path('status/<int:media_id>/', views.media_status, name='media_status'),
+    path('api/transcode/status/', views.transcode_status, name='transcode_status'),
 ]
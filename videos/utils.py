@@ -1,8 +1,13 @@
 import os
 import subprocess
 import json
+import hashlib
 import logging
 import shutil
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from django.conf import settings
@@ -12,10 +17,20 @@ class VideoProcessor:
     """Maneja la transcodificación de videos a múltiples calidades usando FFmpeg.
 
     Refactor enfocado en estabilidad para streaming HLS bajo WhiteNoise/Waitress:
-    - Bitrates fijos por perfil (evita exceder ancho de banda en conexiones medias)
+    - Bitrates por perfil, ajustados al bitrate/resolución/fps del origen
     - GOP alineado con duración de segmentos (seg_time * fps)
     - Master playlist con atributos recomendados
+    - Una sola decodificación por video (split/scale + var_stream_map)
     - Manejo resiliente: si una calidad falla continúa con las demás
+    - Reparto de hilos de CPU entre trabajos y calidades simultáneas
+    - Progreso en vivo (``-progress``): porcentaje, velocidad y ETA por calidad
+    - Huella por calidad (``renditions.json``): al reprocesar solo se codifica lo que cambió
+    - Copia sin recodificar (``-c copy``) de la calidad superior si el origen ya es compatible
+    - Segmentos MPEG-TS o fMP4/CMAF (``HLS_SEGMENT_FORMAT``)
+    - Audio por variante, compartido (un solo grupo EXT-X-MEDIA) o sin audio (``HLS_AUDIO_MODE``)
+    - Un archivo por calidad con EXT-X-BYTERANGE (``HLS_SINGLE_FILE``)
+    - Preset/hilos por calidad medidos en el servidor (``tune_encoder`` -> ``HLS_ENCODER_PROFILE``)
+    - Origen leído por stdin mientras se sube (``input_feed``), en una sola pasada
     - Limpieza de artefactos si ninguna calidad se genera
     """
 
@@ -55,7 +70,42 @@ class VideoProcessor:
         }
     }
 
-    def __init__(self, input_path, media_id=None):
+    RENDITIONS_MANIFEST = 'renditions.json'
+
+    AUDIO_MODES = ('per_variant', 'shared', 'none')
+    AUDIO_GROUP_ID = 'aud'
+    AUDIO_RENDITION = 'audio'
+
+    # Extensión de segmento por formato (fMP4 agrega un init por calidad: {calidad}_init.mp4)
+    SEGMENT_EXTENSIONS = {
+        'mpegts': '.ts',
+        'fmp4': '.m4s',
+    }
+
+    # Perfiles H.264 que se pueden copiar tal cual (profile_idc y constraint flags para CODECS)
+    COPYABLE_H264_PROFILES = {
+        'constrained baseline': '42e0',
+        'baseline': '4200',
+        'main': '4d00',
+        'high': '6400',
+    }
+    DEFAULT_VIDEO_CODECS = 'avc1.64001f'
+
+    # Escalera adaptada al origen: bitrate mínimo y salto mínimo entre calidades
+    LADDER_MIN_KBPS = 200
+    LADDER_MIN_STEP = 1.3
+    # Los perfiles valen para 24-60 fps (cine, PAL, 30/60): solo se reduce el bitrate por debajo de 24
+    LADDER_REFERENCE_FPS = 24
+
+    # Trabajos de transcodificación en curso en este proceso (para repartir CPU)
+    _active_jobs = 0
+    _active_lock = threading.Lock()
+    _ffmpeg_versions = {}
+    _encoder_profile = None
+    _encoder_profile_lock = threading.Lock()
+
+    def __init__(self, input_path, media_id=None, progress_callback=None, content_hash=None, output_dir=None,
+                 input_feed=None):
         self.input_path = Path(str(input_path))
         self.media_id = media_id
         self.media_root = Path(settings.MEDIA_ROOT)
@@ -63,9 +113,54 @@ class VideoProcessor:
         self.logger = logging.getLogger('videos.ffmpeg')
         self.segment_time = int(os.getenv('HLS_SEGMENT_SECONDS', '4'))
         self.fps = None        # Determinado dinámicamente
+        self.single_pass = getattr(settings, 'HLS_SINGLE_PASS', True)
+        self.parallel_renditions = getattr(settings, 'HLS_PARALLEL_RENDITIONS', True)
+        self.ffmpeg_threads = int(getattr(settings, 'HLS_FFMPEG_THREADS', 0) or 0)
+        self.progress_callback = progress_callback
+        self.content_hash = content_hash  # SHA-256 del origen; se calcula si falta
+        # Iterable de bytes del origen mientras se sube: ffmpeg lo lee por stdin una sola vez.
+        # input_path solo se usa para ffprobe (la cabecera ya recibida) y debe tener
+        # el índice al inicio (MP4 con moov adelante, Matroska/WebM)
+        self.input_feed = input_feed
+        self.segment_format = getattr(settings, 'HLS_SEGMENT_FORMAT', 'mpegts')
+        if self.segment_format not in self.SEGMENT_EXTENSIONS:
+            self.logger.warning(f"{self.logger_prefix} HLS_SEGMENT_FORMAT desconocido '{self.segment_format}', usando mpegts")
+            self.segment_format = 'mpegts'
+        self.audio_mode = getattr(settings, 'HLS_AUDIO_MODE', 'per_variant')
+        if self.audio_mode not in self.AUDIO_MODES:
+            self.logger.warning(f"{self.logger_prefix} HLS_AUDIO_MODE desconocido '{self.audio_mode}', usando per_variant")
+            self.audio_mode = 'per_variant'
+        self.single_file = getattr(settings, 'HLS_SINGLE_FILE', False)
+        self.encoder_profile = self.load_encoder_profile()
+        self.duration = 0.0    # Determinada por ffprobe, base del porcentaje
+        self._progress = {}
+        self._progress_lock = threading.Lock()
 
         self._configure_binaries()
-        self.output_dir = self._get_hls_output_dir()
+        # output_dir permite trabajar sobre un hls_path existente (p.ej. compartido)
+        self.output_dir = Path(output_dir).resolve() if output_dir else self._get_hls_output_dir()
+
+    @classmethod
+    def load_encoder_profile(cls, reload=False):
+        """Ajustes por calidad generados por ``tune_encoder`` (se leen una vez por proceso).
+
+        Devuelve ``{calidad: {'preset': ..., 'crf': ...}}`` o ``{}`` si no hay perfil;
+        en ese caso se usa ``BASE_CONFIG``. Los hilos medidos quedan solo como
+        referencia: el reparto de CPU lo decide ``threads_per_encoder``.
+        """
+        with cls._encoder_profile_lock:
+            if cls._encoder_profile is None or reload:
+                path = getattr(settings, 'HLS_ENCODER_PROFILE', '')
+                tiers = {}
+                if path and os.path.exists(path):
+                    try:
+                        with open(path, 'r', encoding='utf-8') as handle:
+                            tiers = json.load(handle).get('tiers') or {}
+                        logging.getLogger('videos.ffmpeg').info(f"[VideoProcessor] Perfil de encoder cargado de {path}")
+                    except (OSError, ValueError, AttributeError) as exc:
+                        logging.getLogger('videos.ffmpeg').warning(f"[VideoProcessor] Perfil de encoder inválido {path}: {exc}")
+                cls._encoder_profile = tiers
+            return cls._encoder_profile
 
     def _configure_binaries(self):
         """Enforce PATH and binary names for ffmpeg/ffprobe."""
@@ -95,10 +190,8 @@ class VideoProcessor:
         return (self.media_root / 'hls' / folder).resolve()
 
     def _prepare_output_dir(self):
-        """Limpiar y recrear el directorio de salida."""
+        """Crear el directorio de salida conservando las calidades ya generadas."""
         try:
-            if self.output_dir.exists():
-                shutil.rmtree(self.output_dir)
             self.output_dir.mkdir(parents=True, exist_ok=True)
         except Exception as exc:
             self.logger.warning(f"{self.logger_prefix} No se pudo preparar directorio HLS: {exc}")
@@ -116,7 +209,7 @@ class VideoProcessor:
         cmd = [
             self.ffprobe_binary, '-v', 'error',
             '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height,duration,r_frame_rate,avg_frame_rate',
+            '-show_entries', 'stream=width,height,duration,r_frame_rate,avg_frame_rate,bit_rate,codec_name,profile,pix_fmt,level',
             '-show_entries', 'format=duration,bit_rate',
             '-of', 'json', self.input_path.as_posix()
         ]
@@ -178,127 +271,972 @@ class VideoProcessor:
                 continue
         return 0.0
 
-    def transcode_to_hls(self):
-        """Transcodifica el video a múltiples calidades HLS de forma robusta."""
-        self._prepare_output_dir()
+    def _probe_audio(self):
+        """Devuelve el primer stream de audio (o None si el origen no tiene audio)."""
+        cmd = [
+            self.ffprobe_binary, '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name,profile,bit_rate,sample_rate',
+            '-of', 'json', self.input_path.as_posix()
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=30)
+            streams = json.loads(result.stdout).get('streams') or []
+            return streams[0] if streams else None
+        except Exception as e:
+            self.logger.warning(f"{self.logger_prefix} ffprobe audio error: {e}")
+            return None
+
+    def _source_video_kbps(self, ffprobe_data, audio_stream=None):
+        """Bitrate de video del origen en kbps (0 si ffprobe no lo reporta)."""
+        stream = (ffprobe_data.get('streams') or [{}])[0]
+        try:
+            return int(stream['bit_rate']) // 1000
+        except (KeyError, TypeError, ValueError):
+            pass
+        # Sin bitrate por stream (p.ej. MKV/WebM): total del contenedor menos el audio
+        try:
+            total = int(ffprobe_data.get('format', {})['bit_rate']) // 1000
+        except (KeyError, TypeError, ValueError):
+            return 0
+        try:
+            audio = int(audio_stream['bit_rate']) // 1000 if audio_stream else 0
+        except (KeyError, TypeError, ValueError):
+            audio = 128
+        return max(0, total - audio)
+
+    def _probe_max_keyframe_gap(self):
+        """Mayor distancia en segundos entre keyframes del video (None si no se pudo medir).
+
+        Lee solo los paquetes (sin decodificar), así que es rápido incluso en videos largos.
+        """
+        cmd = [
+            self.ffprobe_binary, '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0', self.input_path.as_posix()
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=120)
+        except Exception as e:
+            self.logger.warning(f"{self.logger_prefix} ffprobe keyframes error: {e}")
+            return None
+        keyframes = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags:
+                try:
+                    keyframes.append(float(pts_time))
+                except ValueError:
+                    continue
+        keyframes.sort()
+        if len(keyframes) < 2:
+            return None
+        gaps = [b - a for a, b in zip(keyframes, keyframes[1:])]
+        # El último tramo hasta el final del video también forma un segmento
+        if self.duration:
+            gaps.append(max(0.0, self.duration - keyframes[-1]))
+        return max(gaps)
+
+    def _h264_codecs_string(self, stream):
+        """Atributo CODECS (avc1.PPCCLL) a partir del perfil y nivel reportados por ffprobe."""
+        profile = self.COPYABLE_H264_PROFILES.get(str(stream.get('profile', '')).lower())
+        try:
+            level = int(stream.get('level'))
+        except (TypeError, ValueError):
+            level = -1
+        if not profile or level <= 0:
+            return self.DEFAULT_VIDEO_CODECS
+        return f"avc1.{profile}{level:02x}"
+
+    def _can_stream_copy(self, stream, audio_stream, variant, source_kbps):
+        """True si la calidad ``variant`` puede salir del origen sin recodificar el video.
+
+        Requiere H.264 en un perfil compatible, yuv420p, la misma resolución que la
+        calidad, un bitrate dentro de su maxrate y keyframes regulares (a lo sumo
+        1.5 segmentos entre keyframes, para que los segmentos no se alarguen).
+        """
+        if not getattr(settings, 'HLS_STREAM_COPY', True):
+            return False
+        if self.input_feed is not None:
+            # Los keyframes del origen aún no se conocen completos
+            return False
+        if stream.get('codec_name') != 'h264' or stream.get('pix_fmt') != 'yuv420p':
+            return False
+        if str(stream.get('profile', '')).lower() not in self.COPYABLE_H264_PROFILES:
+            return False
+        if (int(stream.get('width', 0)), int(stream.get('height', 0))) != (variant['width'], variant['height']):
+            return False
+        if not source_kbps or source_kbps > variant['maxrate']:
+            return False
+        max_gap = self._probe_max_keyframe_gap()
+        if max_gap is None:
+            self.logger.info(f"{self.logger_prefix} No se pudieron medir los keyframes, se recodifica")
+            return False
+        if max_gap > self.segment_time * 1.5:
+            self.logger.info(f"{self.logger_prefix} Keyframes irregulares (máx {max_gap:.1f}s), se recodifica")
+            return False
+        return True
+
+    def _plan_variants(self, source_w, source_h, source_kbps=0, fps=None, audio_kbps=0):
+        """Calcula las variantes a generar, ordenadas por resolución descendente.
+
+        Con ``HLS_SOURCE_AWARE_LADDER`` la escalera se ajusta al origen:
+        - Calidades que quedan con la misma resolución se funden en la menor
+        - Bitrate reducido solo para orígenes de menos de 24 fps (un origen de 15 fps no necesita el de 30)
+        - Tope por el bitrate del origen proporcional al área (no inflar bits)
+        - Se descarta una calidad si no baja al menos ``LADDER_MIN_STEP`` veces
+          el bitrate de la anterior (no se notaría la diferencia)
+        """
+        source_aware = getattr(settings, 'HLS_SOURCE_AWARE_LADDER', True)
+        variants = []
+        for quality, profile in sorted(self.QUALITY_PROFILES.items(), key=lambda x: x[1]['width'], reverse=True):
+            target_w, target_h = self._adapt_to_source(profile['width'], profile['height'], source_w, source_h)
+            if target_w * target_h < (0.20 * source_w * source_h):
+                self.logger.info(f"{self.logger_prefix} Saltando {quality}, demasiado pequeño vs origen")
+                continue
+            if source_aware and variants and (variants[-1]['width'], variants[-1]['height']) == (target_w, target_h):
+                self.logger.info(f"{self.logger_prefix} {variants[-1]['quality']} queda igual a {quality}, se usa solo {quality}")
+                variants.pop()
+            variants.append({
+                'quality': quality,
+                'width': target_w,
+                'height': target_h,
+                'video_bitrate': profile['video_bitrate'],
+                'maxrate_ratio': profile['maxrate_ratio'],
+                'bufsize_ratio': profile['bufsize_ratio'],
+                'audio_bitrate': profile['audio_bitrate'],
+            })
+
+        planned = []
+        for variant in variants:
+            v_kbps = variant['video_bitrate']
+            a_kbps = variant['audio_bitrate']
+            if source_aware:
+                if fps:
+                    v_kbps *= min(1.0, max(0.5, fps / self.LADDER_REFERENCE_FPS))
+                if source_kbps:
+                    area_ratio = (variant['width'] * variant['height']) / (source_w * source_h)
+                    v_kbps = min(v_kbps, source_kbps * area_ratio ** 0.75)
+                v_kbps = max(self.LADDER_MIN_KBPS, int(v_kbps))
+                if audio_kbps:
+                    a_kbps = max(64, min(a_kbps, audio_kbps))
+                if planned and v_kbps * self.LADDER_MIN_STEP > planned[-1]['video_bitrate']:
+                    self.logger.info(
+                        f"{self.logger_prefix} Saltando {variant['quality']}, {v_kbps}kbps no se distingue "
+                        f"de {planned[-1]['quality']} ({planned[-1]['video_bitrate']}kbps)"
+                    )
+                    continue
+            tuned = self.encoder_profile.get(variant['quality'], {})
+            planned.append({
+                'quality': variant['quality'],
+                'width': variant['width'],
+                'height': variant['height'],
+                'video_bitrate': v_kbps,
+                'maxrate': int(v_kbps * variant['maxrate_ratio']),
+                'bufsize': int(v_kbps * variant['bufsize_ratio']),
+                'audio_bitrate': a_kbps,
+                'preset': tuned.get('preset') or self.BASE_CONFIG['preset'],
+            })
+            if tuned.get('crf'):
+                planned[-1]['crf'] = int(tuned['crf'])
+        return planned
+
+    @classmethod
+    def _job_started(cls):
+        with cls._active_lock:
+            cls._active_jobs += 1
 
+    @classmethod
+    def _job_finished(cls):
+        with cls._active_lock:
+            cls._active_jobs = max(0, cls._active_jobs - 1)
+
+    def threads_per_encoder(self, concurrent_encoders):
+        """Hilos de ffmpeg por codificador según núcleos, trabajos activos y calidades simultáneas.
+
+        ``HLS_FFMPEG_THREADS`` fija el valor manualmente (0 = automático).
+        """
+        if self.ffmpeg_threads:
+            return self.ffmpeg_threads
+        with self._active_lock:
+            jobs = max(1, self._active_jobs)
+        cpus = os.cpu_count() or 1
+        return max(1, cpus // (jobs * max(1, concurrent_encoders)))
+
+    def _rate_control_args(self, variant, index=None):
+        """Bitrate objetivo (o CRF con tope si el perfil afinado lo define), maxrate y bufsize."""
+        suffix = '' if index is None else f':v:{index}'
+        if variant.get('crf'):
+            args = [f'-crf{suffix}', str(variant['crf'])]
+        else:
+            args = ['-b:v' if index is None else f'-b:v:{index}', self._format_bitrate(variant['video_bitrate'])]
+        return args + [
+            f'-maxrate{suffix}', self._format_bitrate(variant['maxrate']),
+            f'-bufsize{suffix}', self._format_bitrate(variant['bufsize']),
+        ]
+
+    def _run_ffmpeg(self, cmd, timeout, label, stdin_feed=None):
+        """Ejecuta ffmpeg leyendo ``-progress`` en vivo.
+
+        stderr se drena en otro hilo (solo se guarda la cola para los logs) para
+        que ffmpeg no se bloquee con el pipe lleno. Devuelve ``(returncode, stderr)``;
+        lanza ``subprocess.TimeoutExpired`` si se supera ``timeout`` (``None``: sin límite).
+        Con ``stdin_feed`` otro hilo escribe sus bytes en stdin; si el iterable falla
+        ffmpeg se mata para que una entrada truncada no termine como éxito.
+        """
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE if stdin_feed is not None else subprocess.DEVNULL,
+            text=True, errors='replace', bufsize=1
+        )
+        stderr_tail = deque(maxlen=50)
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_tail.extend(process.stderr), name=f"ffmpeg-stderr-{label}", daemon=True
+        )
+        stderr_thread.start()
+        feed_thread = None
+        if stdin_feed is not None:
+            feed_thread = threading.Thread(
+                target=self._feed_stdin, args=(process, stdin_feed), name=f"ffmpeg-stdin-{label}", daemon=True
+            )
+            feed_thread.start()
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            block = {}
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'progress':
+                    self._report_progress(label, block, value == 'end')
+                    block = {}
+                elif key:
+                    block[key] = value
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            stderr_thread.join(timeout=5)
+            if feed_thread:
+                feed_thread.join(timeout=5)
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return process.returncode, ''.join(stderr_tail)
+
+    def _feed_stdin(self, process, stdin_feed):
+        """Copia ``stdin_feed`` a stdin de ffmpeg y lo cierra al terminar."""
+        try:
+            for data in stdin_feed:
+                process.stdin.buffer.write(data)
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            # ffmpeg terminó antes de leer todo (su propio error queda en stderr)
+            pass
+        except Exception as exc:
+            self.logger.error(f"{self.logger_prefix} Entrada interrumpida: {exc}")
+            process.kill()
+
+    def _report_progress(self, label, block, finished=False):
+        """Actualiza el avance de ``label`` y lo entrega al callback (si hay)."""
+        previous = self._progress.get(label) or {}
+        try:
+            out_time = int(block.get('out_time_us') or block.get('out_time_ms') or 0) / 1_000_000
+        except ValueError:
+            # ffmpeg reporta N/A antes del primer frame y en algunos bloques finales
+            out_time = previous.get('out_time', 0.0)
+        try:
+            speed = float(block.get('speed', '').rstrip('x'))
+        except ValueError:
+            speed = None
+
+        if finished:
+            percent = 100.0
+        elif self.duration:
+            percent = min(99.9, round(out_time / self.duration * 100, 1))
+        else:
+            percent = None
+        eta = None
+        if speed and self.duration and not finished:
+            eta = round(max(0.0, self.duration - out_time) / speed, 1)
+
+        with self._progress_lock:
+            self._progress[label] = {
+                'percent': percent,
+                'speed': round(speed, 2) if speed else None,
+                'eta': eta,
+                'out_time': round(out_time, 1),
+            }
+            snapshot = self.get_progress()
+        if self.progress_callback:
+            try:
+                self.progress_callback(snapshot)
+            except Exception as exc:
+                self.logger.warning(f"{self.logger_prefix} Error en callback de progreso: {exc}")
+
+    def get_progress(self):
+        """Avance global (la calidad más atrasada) y el detalle por calidad."""
+        renditions = {label: dict(data) for label, data in self._progress.items()}
+        percents = [data['percent'] for data in renditions.values() if data['percent'] is not None]
+        etas = [data['eta'] for data in renditions.values() if data['eta'] is not None]
+        speeds = [data['speed'] for data in renditions.values() if data['speed'] is not None]
+        return {
+            'percent': min(percents) if percents else None,
+            'speed': min(speeds) if speeds else None,
+            'eta': max(etas) if etas else None,
+            'duration': self.duration,
+            'renditions': renditions,
+        }
+
+    def ffmpeg_version(self):
+        """Primera línea de ``ffmpeg -version`` (cacheada por binario)."""
+        version = self._ffmpeg_versions.get(self.ffmpeg_binary)
+        if version is None:
+            try:
+                result = subprocess.run([self.ffmpeg_binary, '-version'], capture_output=True, text=True, timeout=10)
+                version = (result.stdout.splitlines() or [''])[0].strip()
+            except Exception as exc:
+                self.logger.warning(f"{self.logger_prefix} No se pudo obtener versión de ffmpeg: {exc}")
+                version = ''
+            self._ffmpeg_versions[self.ffmpeg_binary] = version
+        return version
+
+    def _get_content_hash(self):
+        if not self.content_hash:
+            from .upload_handlers import file_sha256
+            self.content_hash = file_sha256(self.input_path)
+        return self.content_hash
+
+    def _rendition_fingerprint(self, variant, gop, has_audio):
+        """Huella de lo que determina el resultado de una calidad.
+
+        Cambia si cambia el origen, el perfil calculado, ``BASE_CONFIG``, la
+        duración de segmento/GOP, la presencia de audio o la versión de ffmpeg.
+        """
+        payload = {
+            'source': self._get_content_hash(),
+            'variant': variant,
+            'base_config': self.BASE_CONFIG,
+            'segment_time': self.segment_time,
+            'gop': gop,
+            'has_audio': has_audio,
+            'segment_format': self.segment_format,
+            'hls_args': self._hls_output_args(),
+            'ffmpeg': self.ffmpeg_version(),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load_renditions_manifest(self):
+        path = self.output_dir / self.RENDITIONS_MANIFEST
+        try:
+            with path.open('r', encoding='utf-8') as handle:
+                data = json.load(handle)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_renditions_manifest(self, renditions):
+        path = self.output_dir / self.RENDITIONS_MANIFEST
+        tmp_path = path.with_suffix('.json.tmp')
+        with tmp_path.open('w', encoding='utf-8') as handle:
+            json.dump(renditions, handle, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _rendition_files(self, directory, quality):
+        """Playlist, segmentos e init de una calidad (incluido el archivo único)."""
+        files = [path for path in directory.glob(f"{quality}_*") if path.is_file()]
+        for extension in ['.m3u8', *self.SEGMENT_EXTENSIONS.values()]:
+            path = directory / f"{quality}{extension}"
+            if path.is_file():
+                files.append(path)
+        return files
+
+    def _remove_rendition_files(self, quality):
+        """Borra la playlist y los segmentos de una calidad (incluido el archivo único)."""
+        for path in self._rendition_files(self.output_dir, quality):
+            path.unlink(missing_ok=True)
+
+    def _publish_rendition(self, staging_dir, quality):
+        """Mueve una calidad codificada en ``staging_dir`` al directorio publicado.
+
+        Primero los segmentos y al final su playlist, cada uno con ``os.replace``:
+        quien lee la playlist nueva ya encuentra todos sus segmentos. Después se
+        borran los archivos viejos que la versión nueva no reemplazó.
+        """
+        previous = {path.name for path in self._rendition_files(self.output_dir, quality)}
+        new_files = sorted(self._rendition_files(staging_dir, quality), key=lambda path: path.suffix == '.m3u8')
+        for path in new_files:
+            os.replace(path, self.output_dir / path.name)
+        for name in previous - {path.name for path in new_files}:
+            (self.output_dir / name).unlink(missing_ok=True)
+
+    def _published_stream_inf(self):
+        """Líneas EXT-X-STREAM-INF del master publicado, por calidad."""
+        try:
+            lines = (self.output_dir / 'master.m3u8').read_text(encoding='utf-8').splitlines()
+        except OSError:
+            return {}
+        return {
+            uri[:-len('.m3u8')]: line
+            for line, uri in zip(lines, lines[1:])
+            if line.startswith('#EXT-X-STREAM-INF:') and uri.endswith('.m3u8')
+        }
+
+    @property
+    def segment_extension(self):
+        return self.SEGMENT_EXTENSIONS[self.segment_format]
+
+    def get_layout(self):
+        """Cómo se nombran los archivos HLS (se guarda en ``Media.hls_layout``)."""
+        return {
+            'segment_format': self.segment_format,
+            'segment_extension': self.segment_extension,
+            # Con archivo único el init de fMP4 va al inicio del mismo archivo
+            'init': self.segment_format == 'fmp4' and not self.single_file,
+            'audio': self.audio_mode,
+            'single_file': self.single_file,
+        }
+
+    def _segment_name(self, quality, pattern='%03d'):
+        """Nombre del segmento; con ``HLS_SINGLE_FILE`` es el único archivo de la calidad."""
+        if self.single_file:
+            return f"{quality}{self.segment_extension}"
+        return f"{quality}_{pattern}{self.segment_extension}"
+
+    def _variant_paths(self, quality):
+        manifest = (self.output_dir / f"{quality}.m3u8").as_posix()
+        segments = (self.output_dir / self._segment_name(quality)).as_posix()
+        return manifest, segments
+
+    def _hls_output_args(self, quality='%v'):
+        args = [
+            '-hls_time', str(self.segment_time),
+            '-hls_playlist_type', 'vod',
+            '-hls_flags', 'independent_segments+single_file' if self.single_file else 'independent_segments',
+        ]
+        if self.segment_format == 'fmp4':
+            # Relativo al directorio de la playlist; %v se reemplaza por la calidad
+            args += ['-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', f"{quality}_init.mp4"]
+        return args
+
+    def _build_copy_cmd(self, variant, has_audio):
+        """Comando ffmpeg que solo re-empaqueta el video del origen en segmentos HLS."""
+        variant_manifest, segments_pattern = self._variant_paths(variant['quality'])
+        cmd = [
+            self.ffmpeg_binary, '-y', '-i', self.input_path.as_posix(),
+            '-map', '0:v:0', '-c:v', 'copy',
+        ]
+        if has_audio:
+            cmd += ['-map', '0:a:0']
+            if variant.get('copy_audio'):
+                cmd += ['-c:a', 'copy']
+            else:
+                cmd += [
+                    '-c:a', self.BASE_CONFIG['audio_codec'], '-b:a', f"{variant['audio_bitrate']}k",
+                    '-ac', '2', '-ar', '48000',
+                ]
+        cmd += self._hls_output_args(variant['quality'])
+        cmd += ['-hls_segment_filename', segments_pattern, '-f', 'hls', variant_manifest]
+        return cmd
+
+    def _build_audio_cmd(self, rendition):
+        """Comando ffmpeg para la rendición de audio compartida (sin video)."""
+        manifest, segments_pattern = self._variant_paths(rendition['quality'])
+        cmd = [self.ffmpeg_binary, '-y', '-i', self.input_path.as_posix(), '-map', '0:a:0', '-vn']
+        if rendition.get('copy_audio'):
+            cmd += ['-c:a', 'copy']
+        else:
+            cmd += [
+                '-c:a', self.BASE_CONFIG['audio_codec'], '-b:a', f"{rendition['audio_bitrate']}k",
+                '-ac', '2', '-ar', '48000',
+            ]
+        cmd += self._hls_output_args(rendition['quality'])
+        cmd += ['-hls_segment_filename', segments_pattern, '-f', 'hls', manifest]
+        return cmd
+
+    def build_variant_command(self, variant, threads=None):
+        """Comando ffmpeg de una calidad sin audio tal como la codifica el pipeline.
+
+        Para medir el encoder (``tune_encoder``); el GOP sale de los fps del origen.
+        """
+        if self.fps is None:
+            self._get_video_info()
+        gop = max(12, int((self.fps or 25) * self.segment_time))
+        return self._build_variant_cmd(variant, gop, has_audio=False, threads=threads)
+
+    def probe_duration(self):
+        """Duración del origen en segundos según ffprobe (0.0 si no se puede leer)."""
+        info = self._get_video_info()
+        return self._extract_duration(info) if info else 0.0
+
+    def _build_variant_cmd(self, variant, gop, has_audio, threads=None):
+        """Comando ffmpeg para una sola variante (un decode por calidad)."""
+        if variant.get('audio_only'):
+            return self._build_audio_cmd(variant)
+        if variant.get('copy'):
+            return self._build_copy_cmd(variant, has_audio)
+        variant_manifest, segments_pattern = self._variant_paths(variant['quality'])
+        threads = threads or self.threads_per_encoder(1)
+        cmd = [
+            self.ffmpeg_binary, '-y', '-i', self.input_path.as_posix(),
+            '-threads', str(threads),
+            '-c:v', self.BASE_CONFIG['video_codec'],
+            '-preset', variant.get('preset') or self.BASE_CONFIG['preset'],
+            '-tune', self.BASE_CONFIG['tune'],
+            '-vf', f"scale={variant['width']}:{variant['height']}",
+            *self._rate_control_args(variant),
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+        ]
+        if has_audio:
+            cmd += [
+                '-c:a', self.BASE_CONFIG['audio_codec'], '-b:a', f"{variant['audio_bitrate']}k",
+                '-ac', '2', '-ar', '48000',
+            ]
+        else:
+            cmd += ['-an']
+        cmd += self._hls_output_args(variant['quality'])
+        cmd += ['-hls_segment_filename', segments_pattern, '-f', 'hls', variant_manifest]
+        return cmd
+
+    def _build_single_pass_cmd(self, variants, gop, has_audio):
+        """Comando ffmpeg que decodifica una sola vez y emite todas las variantes.
+
+        Usa un filtro split/scale y ``-var_stream_map`` para que cada salida
+        escalada (y su copia de audio) termine en su propia playlist HLS.
+        """
+        labels = [f"v{index}" for index in range(len(variants))]
+        graph = [f"[0:v]split={len(variants)}" + ''.join(f"[{label}]" for label in labels)]
+        for label, variant in zip(labels, variants):
+            graph.append(f"[{label}]scale={variant['width']}:{variant['height']}[{label}out]")
+
+        source = 'pipe:0' if self.input_feed is not None else self.input_path.as_posix()
+        cmd = [
+            self.ffmpeg_binary, '-y', '-i', source,
+            '-filter_complex', ';'.join(graph),
+        ]
+        for label in labels:
+            cmd += ['-map', f"[{label}out]"]
+            if has_audio:
+                cmd += ['-map', '0:a:0']
+
+        cmd += [
+            '-threads', str(self.threads_per_encoder(len(variants))),
+            '-c:v', self.BASE_CONFIG['video_codec'],
+            '-tune', self.BASE_CONFIG['tune'],
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+        ]
+        if has_audio:
+            cmd += ['-c:a', self.BASE_CONFIG['audio_codec'], '-ac', '2', '-ar', '48000']
+
+        stream_map = []
+        for index, variant in enumerate(variants):
+            cmd += [f'-preset:v:{index}', variant.get('preset') or self.BASE_CONFIG['preset']]
+            cmd += self._rate_control_args(variant, index)
+            if has_audio:
+                cmd += [f'-b:a:{index}', f"{variant['audio_bitrate']}k"]
+                stream_map.append(f"v:{index},a:{index},name:{variant['quality']}")
+            else:
+                stream_map.append(f"v:{index},name:{variant['quality']}")
+
+        variant_manifest, segments_pattern = self._variant_paths('%v')
+        cmd += self._hls_output_args()
+        cmd += [
+            '-hls_segment_filename', segments_pattern,
+            '-var_stream_map', ' '.join(stream_map),
+            '-f', 'hls', variant_manifest
+        ]
+        return cmd
+
+    def _encode_single_pass(self, variants, gop, has_audio):
+        """Genera todas las variantes en una sola invocación. Devuelve las calidades creadas."""
+        cmd = self._build_single_pass_cmd(variants, gop, has_audio)
+        self.logger.info(
+            f"{self.logger_prefix} Generando en una pasada: "
+            + ', '.join(f"{v['quality']} {v['width']}x{v['height']} @ {v['video_bitrate']}kbps" for v in variants)
+        )
+        try:
+            if self.input_feed is not None:
+                # Se avanza al ritmo de la subida: el límite lo pone el feed (subida detenida)
+                returncode, stderr = self._run_ffmpeg(cmd, None, 'all', stdin_feed=self.input_feed)
+            else:
+                returncode, stderr = self._run_ffmpeg(cmd, 900 * len(variants), 'all')
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"{self.logger_prefix} Timeout en pasada única")
+            return []
+        if returncode != 0:
+            self.logger.error(f"{self.logger_prefix} Error en pasada única: {stderr[-400:]}")
+            return []
+        return [
+            variant['quality'] for variant in variants
+            if Path(self._variant_paths(variant['quality'])[0]).exists()
+        ]
+
+    def _encode_variant(self, variant, gop, has_audio, threads=None):
+        """Genera una variante con su propio proceso ffmpeg. Devuelve True si se creó.
+
+        Si la copia sin recodificar falla, la calidad se recodifica normalmente.
+        """
+        if self._run_variant(variant, gop, has_audio, threads):
+            return True
+        if variant.get('audio_only') and variant.get('copy_audio'):
+            self.logger.warning(f"{self.logger_prefix} Copia de audio falló, recodificando")
+            variant.update(copy_audio=False)
+        elif variant.get('copy'):
+            self.logger.warning(f"{self.logger_prefix} Copia de {variant['quality']} falló, recodificando")
+            variant.update(copy=False, copy_audio=False, codecs=self.DEFAULT_VIDEO_CODECS)
+        else:
+            return False
+        self._remove_rendition_files(variant['quality'])
+        return self._run_variant(variant, gop, has_audio, threads)
+
+    def _run_variant(self, variant, gop, has_audio, threads=None):
+        quality = variant['quality']
+        cmd = self._build_variant_cmd(variant, gop, has_audio, threads)
+        if variant.get('audio_only'):
+            mode = 'copia' if variant.get('copy_audio') else f"{variant['audio_bitrate']}kbps"
+            self.logger.info(f"{self.logger_prefix} Generando audio compartido ({mode})")
+        elif variant.get('copy'):
+            self.logger.info(f"{self.logger_prefix} Generando {quality} {variant['width']}x{variant['height']} sin recodificar (-c copy)")
+        else:
+            self.logger.info(
+                f"{self.logger_prefix} Generando {quality} {variant['width']}x{variant['height']} "
+                f"@ {variant['video_bitrate']}kbps (fps={self.fps}, gop={gop}, threads={cmd[cmd.index('-threads') + 1]})"
+            )
+        try:
+            returncode, stderr = self._run_ffmpeg(cmd, 900, quality)
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"{self.logger_prefix} Timeout en {quality}")
+            return False
+        except Exception as exc:
+            self.logger.exception(f"{self.logger_prefix} Excepción en {quality}: {exc}")
+            return False
+        if returncode != 0:
+            self.logger.error(f"{self.logger_prefix} Error {quality}: {stderr[-400:]}")
+            return False
+        if not Path(self._variant_paths(quality)[0]).exists():
+            self.logger.error(f"{self.logger_prefix} Variante {quality} no creada")
+            return False
+        return True
+
+    def _encode_variants(self, variants, gop, has_audio):
+        """Genera las variantes por separado, en paralelo si ``HLS_PARALLEL_RENDITIONS``.
+
+        Devuelve las calidades creadas.
+        """
+        if not variants:
+            return []
+        if not self.parallel_renditions or len(variants) == 1:
+            return [v['quality'] for v in variants if self._encode_variant(v, gop, has_audio)]
+
+        threads = self.threads_per_encoder(len(variants))
+        with ThreadPoolExecutor(max_workers=len(variants), thread_name_prefix='rendition') as pool:
+            results = list(pool.map(lambda v: self._encode_variant(v, gop, has_audio, threads), variants))
+        return [variant['quality'] for variant, ok in zip(variants, results) if ok]
+
+    def _build_master_lines(self, variants, fps, has_audio=True, audio_rendition=None):
+        """Líneas del master. Con ``audio_rendition`` el audio va en un grupo EXT-X-MEDIA
+        compartido por todas las variantes en lugar de ir dentro de cada una."""
+        frame_rate_str = f"{fps:.3f}".rstrip('0').rstrip('.')
+        # fMP4 requiere versión 7 y EXT-X-BYTERANGE (archivo único) versión 4
+        version = 7 if self.segment_format == 'fmp4' else (4 if self.single_file else 3)
+        master_lines = ['#EXTM3U', f'#EXT-X-VERSION:{version}', '#EXT-X-INDEPENDENT-SEGMENTS']
+        if audio_rendition:
+            master_lines.append(
+                f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{self.AUDIO_GROUP_ID}",NAME="Audio",'
+                f'DEFAULT=YES,AUTOSELECT=YES,CHANNELS="2",URI="{audio_rendition["quality"]}.m3u8"'
+            )
+        for variant in variants:
+            if variant.get('stream_inf'):
+                # Calidad conservada sin registro en renditions.json: se publica como estaba
+                master_lines += [variant['stream_inf'], f"{variant['quality']}.m3u8"]
+                continue
+            codecs = variant.get('codecs') or self.DEFAULT_VIDEO_CODECS
+            audio_kbps = 0
+            if has_audio:
+                audio_kbps = variant['audio_bitrate']
+            elif audio_rendition:
+                audio_kbps = audio_rendition['audio_bitrate']
+            if audio_kbps:
+                codecs += ',mp4a.40.2'
+            bandwidth = (variant['video_bitrate'] + audio_kbps) * 1000
+            avg_bandwidth = max(50000, bandwidth - 50000)
+            master_lines.append(
+                (
+                    "#EXT-X-STREAM-INF:BANDWIDTH={bw},AVERAGE-BANDWIDTH={avg},RESOLUTION={res},"
+                    "FRAME-RATE={fps},CODECS=\"{codecs}\"{audio}"
+                ).format(
+                    bw=bandwidth,
+                    avg=avg_bandwidth,
+                    res=f"{variant['width']}x{variant['height']}",
+                    fps=frame_rate_str,
+                    codecs=codecs,
+                    audio=f',AUDIO="{self.AUDIO_GROUP_ID}"' if audio_rendition else '',
+                )
+            )
+            master_lines.append(f"{variant['quality']}.m3u8")
+        return master_lines
+
+    def plan_renditions(self, keep_existing=()):
+        """Analiza el origen y compara las calidades configuradas con las del disco.
+
+        Una calidad se conserva si su huella coincide con ``renditions.json`` o si
+        está en ``keep_existing`` (calidades ya publicadas sin huella registrada)
+        y su playlist existe. Devuelve un dict con ``variants``, ``keep``,
+        ``missing`` y ``obsolete``, o ``{'error': ...}``.
+        """
         info = self._get_video_info()
         if not info:
             self.logger.error(f"{self.logger_prefix} No se pudo obtener info del video")
-            return False, {'error': 'ffprobe_failed'}
+            return {'error': 'ffprobe_failed'}
 
         stream = info['streams'][0]
         source_w = int(stream.get('width', 0))
         source_h = int(stream.get('height', 0))
         if not source_w or not source_h:
             self.logger.error(f"{self.logger_prefix} Resolución inválida")
-            return False, {'error': 'invalid_resolution'}
+            return {'error': 'invalid_resolution'}
 
         # Calcular GOP (fps * segment_time)
         fps = self.fps or 25
         gop = max(12, int(fps * self.segment_time))
 
-        successful = []
-        variant_meta = {}
-        master_lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
-        frame_rate_str = f"{fps:.3f}".rstrip('0').rstrip('.')
+        self.duration = self._extract_duration(info)
+        audio_stream = self._probe_audio()
+        # has_audio: si cada variante lleva su propio audio (solo en modo per_variant)
+        has_audio = audio_stream is not None and self.audio_mode == 'per_variant'
+        try:
+            audio_kbps = int(audio_stream['bit_rate']) // 1000 if audio_stream else 0
+        except (KeyError, TypeError, ValueError):
+            audio_kbps = 0
+        source_kbps = self._source_video_kbps(info, audio_stream)
+        variants = self._plan_variants(
+            source_w, source_h,
+            source_kbps=source_kbps,
+            fps=fps,
+            audio_kbps=audio_kbps,
+        )
+        if variants and self._can_stream_copy(stream, audio_stream, variants[0], source_kbps):
+            top = variants[0]
+            top.update(
+                copy=True,
+                copy_audio=has_audio and audio_stream.get('codec_name') == 'aac',
+                codecs=self._h264_codecs_string(stream),
+                video_bitrate=source_kbps,
+            )
+            if top['copy_audio'] and audio_kbps:
+                top['audio_bitrate'] = audio_kbps
+            self.logger.info(f"{self.logger_prefix} {top['quality']} compatible con el origen, se copia sin recodificar")
 
-        # Ordenar perfiles por resolución descendente
-        for quality, profile in sorted(self.QUALITY_PROFILES.items(), key=lambda x: x[1]['width'], reverse=True):
-            try:
-                target_w, target_h = self._adapt_to_source(profile['width'], profile['height'], source_w, source_h)
-                if target_w * target_h < (0.20 * source_w * source_h):
-                    self.logger.info(f"{self.logger_prefix} Saltando {quality}, demasiado pequeño vs origen")
-                    continue
+        audio_rendition = None
+        if variants and audio_stream is not None and self.audio_mode == 'shared':
+            copy_audio = audio_stream.get('codec_name') == 'aac'
+            audio_rendition = {
+                'quality': self.AUDIO_RENDITION,
+                'audio_only': True,
+                'copy_audio': copy_audio,
+                'audio_bitrate': audio_kbps if copy_audio and audio_kbps else variants[0]['audio_bitrate'],
+            }
 
-                v_kbps = profile['video_bitrate']
-                maxrate = int(v_kbps * profile['maxrate_ratio'])
-                bufsize = int(v_kbps * profile['bufsize_ratio'])
-                a_kbps = profile['audio_bitrate']
-
-                variant_manifest = (self.output_dir / f"{quality}.m3u8").as_posix()
-                segments_pattern = (self.output_dir / f"{quality}_%03d.ts").as_posix()
-
-                cmd = [
-                    self.ffmpeg_binary, '-y', '-i', self.input_path.as_posix(),
-                    '-c:v', self.BASE_CONFIG['video_codec'],
-                    '-preset', self.BASE_CONFIG['preset'],
-                    '-tune', self.BASE_CONFIG['tune'],
-                    '-vf', f'scale={target_w}:{target_h}',
-                    '-b:v', self._format_bitrate(v_kbps),
-                    '-maxrate', self._format_bitrate(maxrate),
-                    '-bufsize', self._format_bitrate(bufsize),
-                    '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
-                    '-c:a', self.BASE_CONFIG['audio_codec'], '-b:a', f'{a_kbps}k', '-ac', '2', '-ar', '48000',
-                    '-hls_time', str(self.segment_time),
-                    '-hls_playlist_type', 'vod',
-                    '-hls_flags', 'independent_segments',
-                    '-hls_segment_filename', segments_pattern,
-                    '-f', 'hls', variant_manifest
-                ]
+        fingerprints = {v['quality']: self._rendition_fingerprint(v, gop, has_audio) for v in variants}
+        if audio_rendition:
+            fingerprints[self.AUDIO_RENDITION] = self._rendition_fingerprint(audio_rendition, gop, True)
+        on_disk = self._load_renditions_manifest()
+        keep = set()
+        for quality, fingerprint in fingerprints.items():
+            if not Path(self._variant_paths(quality)[0]).exists():
+                continue
+            recorded = on_disk.get(quality)
+            if recorded is not None:
+                # Con huella registrada manda la huella: si cambió, se recodifica
+                if recorded.get('fingerprint') == fingerprint:
+                    keep.add(quality)
+            elif quality in keep_existing and self._has_current_layout(quality):
+                keep.add(quality)
 
-                self.logger.info(
-                    f"{self.logger_prefix} Generando {quality} {target_w}x{target_h} @ {v_kbps}kbps (fps={fps}, gop={gop})"
-                )
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=900)
-                if result.returncode != 0:
-                    self.logger.error(f"{self.logger_prefix} Error {quality}: {result.stderr[:400]}")
-                    continue
-                if not Path(variant_manifest).exists():
-                    self.logger.error(f"{self.logger_prefix} Variante {quality} no creada")
-                    continue
+        return {
+            'source_w': source_w,
+            'source_h': source_h,
+            'fps': fps,
+            'gop': gop,
+            'has_audio': has_audio,
+            'variants': variants,
+            'audio_rendition': audio_rendition,
+            'fingerprints': fingerprints,
+            'keep': keep,
+            'recorded': on_disk,
+            'missing': [quality for quality in fingerprints if quality not in keep],
+            'obsolete': sorted((set(on_disk) | set(keep_existing)) - set(fingerprints)),
+        }
 
-                bandwidth = (v_kbps + a_kbps) * 1000
-                avg_bandwidth = max(50000, bandwidth - 50000)
-                master_lines.append(
-                    (
-                        "#EXT-X-STREAM-INF:BANDWIDTH={bw},AVERAGE-BANDWIDTH={avg},RESOLUTION={res},"
-                        "FRAME-RATE={fps},CODECS=\"avc1.64001f,mp4a.40.2\""
-                    ).format(
-                        bw=bandwidth,
-                        avg=avg_bandwidth,
-                        res=f"{target_w}x{target_h}",
-                        fps=frame_rate_str,
-                    )
-                )
-                master_lines.append(f"{quality}.m3u8")
-                successful.append(quality)
-                variant_meta[quality] = {
-                    'width': target_w,
-                    'height': target_h,
-                    'video_bitrate': v_kbps,
-                    'audio_bitrate': a_kbps,
-                }
+    def _has_current_layout(self, quality):
+        """True si los segmentos de ``quality`` en disco tienen el formato configurado."""
+        return (self.output_dir / self._segment_name(quality, '000')).exists()
 
-            except subprocess.TimeoutExpired:
-                self.logger.error(f"{self.logger_prefix} Timeout en {quality}")
-                continue
-            except Exception as exc:
-                self.logger.exception(f"{self.logger_prefix} Excepción en {quality}: {exc}")
+    def _write_master(self, variants, fps, has_audio, audio_rendition=None):
+        """Reescribe master.m3u8 de forma atómica (los reproductores nunca leen uno a medias)."""
+        master_path = self.output_dir / 'master.m3u8'
+        tmp_path = self.output_dir / 'master.m3u8.tmp'
+        lines = self._build_master_lines(variants, fps, has_audio, audio_rendition)
+        with tmp_path.open('w', encoding='utf-8') as manifest:
+            manifest.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, master_path)
+
+    def transcode_to_hls(self, keep_existing=()):
+        """Transcodifica el video a múltiples calidades HLS de forma robusta.
+
+        Por defecto (``HLS_SINGLE_PASS``) el origen se decodifica una sola vez y
+        todas las variantes salen de la misma invocación de ffmpeg; si esa pasada
+        falla, las calidades faltantes se generan con procesos separados que
+        corren en paralelo y se reparten los núcleos disponibles. Las calidades
+        cuya huella coincide con ``renditions.json`` (o listadas en
+        ``keep_existing``) no se vuelven a codificar, y las que ya no están
+        configuradas se borran después de reescribir el master.
+        """
+        self._prepare_output_dir()
+
+        plan = self.plan_renditions(keep_existing)
+        if 'error' in plan:
+            return False, {'error': plan['error']}
+        fps, gop, has_audio = plan['fps'], plan['gop'], plan['has_audio']
+        variants, fingerprints, reused = plan['variants'], plan['fingerprints'], plan['keep']
+        audio_rendition = plan['audio_rendition']
+        renditions = variants + ([audio_rendition] if audio_rendition else [])
+
+        to_encode = [variant for variant in renditions if variant['quality'] not in reused]
+        if reused:
+            self.logger.info(f"{self.logger_prefix} Reutilizando calidades sin cambios: {', '.join(sorted(reused))}")
+
+        publish_dir = self.output_dir
+        published = (publish_dir / 'master.m3u8').exists()
+        staging_dir = None
+        if published and to_encode:
+            # El master publicado sigue apuntando a estas calidades mientras se codifican:
+            # se generan aparte y se cambian recién al terminar bien
+            staging_dir = publish_dir / f".staging-{uuid.uuid4().hex[:12]}"
+            staging_dir.mkdir()
+            self.output_dir = staging_dir
+        else:
+            for variant in to_encode:
+                self._remove_rendition_files(variant['quality'])
+
+        created = set(reused)
+        self._job_started()
+        try:
+            # Las calidades copiadas y el audio compartido no pasan por el encoder de video
+            single_pass = [
+                variant for variant in to_encode
+                if not variant.get('copy') and not variant.get('audio_only')
+            ]
+            if self.input_feed is not None:
+                # El origen llega una sola vez por stdin: no hay segunda lectura para reintentar
+                created.update(self._encode_single_pass(single_pass, gop, has_audio))
+            elif self.single_pass and len(single_pass) > 1:
+                created.update(self._encode_single_pass(single_pass, gop, has_audio))
+                if not {variant['quality'] for variant in single_pass} <= created:
+                    self.logger.warning(f"{self.logger_prefix} Pasada única incompleta, generando calidades faltantes por separado")
+                    with self._progress_lock:
+                        self._progress.pop('all', None)
+
+            if self.input_feed is None:
+                pending = [variant for variant in renditions if variant['quality'] not in created]
+                created.update(self._encode_variants(pending, gop, has_audio))
+        finally:
+            self._job_finished()
+            self.output_dir = publish_dir
+
+        if staging_dir is not None:
+            try:
+                for quality in sorted(created - reused):
+                    self._publish_rendition(staging_dir, quality)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+        if self.input_feed is not None and getattr(self.input_feed, 'sha256', None):
+            # El hash del origen recién se conoce al terminar de leerlo
+            self.content_hash = self.input_feed.sha256
+            fingerprints = {v['quality']: self._rendition_fingerprint(v, gop, has_audio) for v in variants}
+            if audio_rendition:
+                fingerprints[self.AUDIO_RENDITION] = self._rendition_fingerprint(audio_rendition, gop, True)
+
+        # Lo conservado se publica con lo registrado al generarlo (huella, bitrates), no con el plan nuevo.
+        # Una calidad ya publicada cuya recodificación falló sigue como estaba
+        recorded = plan['recorded']
+        stream_inf = self._published_stream_inf() if published else {}
+        failed = []
+        final = []
+        for variant in renditions:
+            quality = variant['quality']
+            if quality in created and quality not in reused:
+                final.append(dict(variant, fingerprint=fingerprints[quality]))
                 continue
+            if quality not in reused:
+                failed.append(quality)
+                if not (published and Path(self._variant_paths(quality)[0]).exists() and self._has_current_layout(quality)):
+                    continue
+            if quality in recorded:
+                final.append(recorded[quality])
+            elif quality in stream_inf:
+                final.append(dict(variant, stream_inf=stream_inf[quality]))
+            elif quality in reused:
+                final.append(dict(variant))
+        if failed:
+            self.logger.warning(f"{self.logger_prefix} No se generaron: {', '.join(failed)}")
+
+        variants = [variant for variant in final if not variant.get('audio_only')]
+        successful = [variant['quality'] for variant in variants]
+        kept_audio = [variant for variant in final if variant.get('audio_only')]
+        if audio_rendition and not kept_audio:
+            self.logger.warning(f"{self.logger_prefix} No se generó el audio compartido, el video queda sin audio")
+        audio_rendition = kept_audio[0] if kept_audio else None
 
         if not successful:
             self.logger.error(f"{self.logger_prefix} Ninguna calidad generada")
-            try:
-                shutil.rmtree(self.output_dir)
-            except Exception:
-                pass
+            # Un directorio ya publicado se deja como estaba
+            if not published and not keep_existing:
+                try:
+                    shutil.rmtree(self.output_dir)
+                except Exception:
+                    pass
             return False, {'error': 'no_variant_generated'}
 
-        master_path = self.output_dir / 'master.m3u8'
-        with master_path.open('w', encoding='utf-8') as manifest:
-            manifest.write('\n'.join(master_lines) + '\n')
-
-        duration = self._extract_duration(info)
+        self._write_renditions_manifest({
+            variant['quality']: variant for variant in final if variant.get('fingerprint')
+        })
+        self._write_master(variants, fps, has_audio, audio_rendition)
+        # Recién ahora nadie referencia las calidades que sobran
+        for quality in plan['obsolete']:
+            self._remove_rendition_files(quality)
 
         metadata = {
             'qualities': successful,
-            'variants': variant_meta,
+            'reused': sorted(reused),
+            'failed': failed,
+            'removed': plan['obsolete'],
+            'layout': dict(
+                self.get_layout(),
+                audio='shared' if audio_rendition else ('per_variant' if has_audio else 'none'),
+            ),
+            'variants': {
+                variant['quality']: {
+                    'width': variant['width'],
+                    'height': variant['height'],
+                    'video_bitrate': variant['video_bitrate'],
+                    'audio_bitrate': variant['audio_bitrate'],
+                }
+                for variant in variants
+            },
             'relative_output_dir': self.relative_output_dir,
             'output_dir': self.output_dir.as_posix(),
-            'duration': duration,
-            'width': source_w,
-            'height': source_h,
+            'duration': self.duration,
+            'width': plan['source_w'],
+            'height': plan['source_h'],
             'fps': fps,
         }
 
@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET, require_POST
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import authenticate, login, logout
@@ -7,14 +7,23 @@ from functools import wraps
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.db import models
 from django.db.models import Q
 from functools import wraps
 from .models import (
-    Media, PlaylistState, PerfilUsuario, Proyecto, Tarea, MiembroProyecto,
+    Media, PlaylistState, UploadSession, PerfilUsuario, Proyecto, Tarea, MiembroProyecto,
     ArchivoProyecto, ArchivoTarea, ComentarioProyecto, ComentarioTarea, ArchivoComentario
 )
+from .transcoding import get_executor
+from .chunked_upload import (
+    UploadError, abort_session, append_chunk, finalize_session, get_chunk_size, start_session
+)
+from .playlist_sync import (
+    acquire_stream_slot, get_sync_snapshot, release_stream_slot,
+    snapshot_version, sync_payload, wait_for_sync_change
+)
 from .forms import (
     MediaForm, ProyectoForm, TareaForm, MiembroProyectoForm,
     ComentarioProyectoForm, ComentarioTareaForm, ArchivoProyectoForm, ArchivoTareaForm
@@ -27,6 +36,7 @@ import json
 import random
 import os
 import mimetypes
+import time
 
 # Decorador personalizado para repositorio
 def repositorio_login_required(view_func):
@@ -97,6 +107,7 @@ def media_status(request, media_id):
         'available_qualities': media.available_qualities,
         'stream_url': media.get_stream_url(),
         'error_message': media.error_message,
+        'progress': media.progress if media.stream_status == 'processing' else None,
     })
 
 # ============ NUEVAS VISTAS PARA SISTEMA LIVE ============
@@ -165,6 +176,15 @@ def upload_login_required(view_func):
         return view_func(request, *args, **kwargs)
     return wrapper
 
+def _uploaded_media_payload(media):
+    return {
+        'id': media.id,
+        'title': media.title,
+        'status': media.stream_status,
+        'is_stream_ready': media.is_stream_ready,
+        'stream_url': media.get_stream_url(),
+    }
+
 @upload_login_required
 def upload_media(request):
     """Vista de upload protegida con login"""
@@ -174,13 +194,7 @@ def upload_media(request):
             media = form.save()
             # Respuesta JSON para peticiones AJAX
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({
-                    'id': media.id,
-                    'title': media.title,
-                    'status': media.stream_status,
-                    'is_stream_ready': media.is_stream_ready,
-                    'stream_url': media.get_stream_url(),
-                })
+                return JsonResponse(_uploaded_media_payload(media))
             messages.success(request, 'Contenido subido correctamente')
             return redirect('upload')
     else:
@@ -217,6 +231,7 @@ def start_playlist(request):
     state.is_active = True
     state.current_media_id = all_media[0].id
     state.playlist_data = [m.id for m in all_media]
+    state.schedule = PlaylistState.build_schedule(all_media)
     state.started_at = timezone.now()
     state.save()
     
@@ -230,63 +245,135 @@ def stop_playlist(request):
     state.is_active = False
     state.current_media_id = None
     state.started_at = None
+    state.schedule = {}
     state.save()
     
     return JsonResponse({'success': True})
 
 @require_GET
-def sync_status(request):
-    """API para sincronización de clientes"""
-    state = PlaylistState.get_current_state()
-    
-    if not state.is_active or not state.playlist_data:
-        return JsonResponse({
-            'active': False,
-            'message': 'Reproducción no iniciada'
-        })
-    
-    current_media = state.get_current_media()
-    if not current_media:
+@upload_login_required
+def transcode_status(request):
+    """Estado del pool de transcodificación (cola y trabajos en curso)"""
+    return JsonResponse(get_executor().stats())
+
+def _upload_error_response(error):
+    payload = {'error': str(error)}
+    if error.offset is not None:
+        payload['offset'] = error.offset
+    return JsonResponse(payload, status=error.status)
+
+@require_POST
+@upload_login_required
+def chunked_upload_init(request):
+    """Inicia una subida por partes: ``{title, media_type, filename, size, sha256?}``"""
+    try:
+        data = json.loads(request.body or b'{}')
+        size = int(data.get('size') or 0)
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    try:
+        session = start_session(
+            data.get('title', '').strip(), data.get('media_type', ''),
+            data.get('filename', ''), size, data.get('sha256', ''),
+        )
+    except UploadError as error:
+        return _upload_error_response(error)
+    return JsonResponse({
+        'upload_id': str(session.pk),
+        'offset': 0,
+        'chunk_size': get_chunk_size(),
+    }, status=201)
+
+@upload_login_required
+def chunked_upload(request, upload_id):
+    """GET: offset recibido. PUT: agrega una parte en ``Upload-Offset``. DELETE: cancela."""
+    session = get_object_or_404(UploadSession, pk=upload_id)
+    if request.method == 'GET':
         return JsonResponse({
-            'active': False,
-            'message': 'Media no encontrado'
+            'upload_id': str(session.pk),
+            'offset': session.received,
+            'size': session.total_size,
+            'status': session.status,
+            'media_id': session.media_id,
+            'chunk_size': get_chunk_size(),
         })
-    
-    # Calcular información adicional necesaria
-    elapsed_time = state.get_elapsed_time()
-    current_index = state.get_current_index()
-    total_items = len(state.playlist_data)
-    
-    # Obtener duración del media actual
-    if current_media.media_type == 'image':
-        duration = 10  # Imágenes 10 segundos
-    else:
-        duration = int(current_media.duration) if current_media.duration else 30
-    
-    # Preparar datos del media para el frontend
-    media_data = {
-        'id': current_media.id,
-        'title': current_media.title,
-        'media_type': current_media.media_type,
-        'file_url': current_media.file.url if current_media.file else None,
-        'stream_url': current_media.get_stream_url(),
-        'hls_manifest_url': current_media.get_hls_manifest_url() if current_media.media_type == 'video' else None,
-        'is_stream_ready': current_media.is_stream_ready,
-        'width': current_media.width or 0,
-        'height': current_media.height or 0
-    }
-    
-    # Respuesta completa con todos los datos necesarios
-    return JsonResponse({
-        'active': True,
-        'current_media': media_data,
-        'position': elapsed_time,
-        'elapsed': elapsed_time,
-        'duration': duration,
-        'current_index': current_index,
-        'total_items': total_items,
-        'playlist': state.playlist_data
-    })
+    if request.method == 'DELETE':
+        abort_session(session)
+        return JsonResponse({'success': True})
+    if request.method != 'PUT':
+        return HttpResponse(status=405, headers={'Allow': 'GET, PUT, DELETE'})
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.GET.get('offset', '')))
+        length = int(request.headers.get('Content-Length') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Offset inválido', 'offset': session.received}, status=400)
+    try:
+        # Se lee el cuerpo en bloques directo al staging (sin cargar la parte en memoria)
+        received = append_chunk(session, offset, request, length, request.headers.get('X-Chunk-SHA256', ''))
+    except UploadError as error:
+        return _upload_error_response(error)
+    return JsonResponse({'offset': received, 'size': session.total_size})
+
+@require_POST
+@upload_login_required
+def chunked_upload_finalize(request, upload_id):
+    """Verifica el archivo y crea el Media (la transcodificación arranca aquí)"""
+    session = get_object_or_404(UploadSession, pk=upload_id)
+    try:
+        media = finalize_session(session)
+    except UploadError as error:
+        return _upload_error_response(error)
+    return JsonResponse(_uploaded_media_payload(media))
+
+@require_GET
+def sync_status(request):
+    """API para sincronización de clientes (servida desde el snapshot compartido).
+
+    Con ``?wait=<version>`` funciona como long-poll: responde cuando el elemento
+    cambia o tras ``SYNC_LONG_POLL_SECONDS``. Sin hilos libres responde de inmediato.
+    """
+    snapshot = get_sync_snapshot()
+    wait_version = request.GET.get('wait')
+    if wait_version and snapshot_version(snapshot) == wait_version and acquire_stream_slot():
+        try:
+            snapshot = wait_for_sync_change(wait_version, settings.SYNC_LONG_POLL_SECONDS) or snapshot
+        finally:
+            release_stream_slot()
+    return JsonResponse(sync_payload(snapshot))
+
+@require_GET
+def sync_stream(request):
+    """Server-Sent Events: empuja inicio/parada/cambio de elemento a las pantallas"""
+    if not acquire_stream_slot():
+        return JsonResponse({'error': 'Sin conexiones disponibles, usar /api/sync/'}, status=503)
+
+    def events():
+        # Conexiones acotadas: el navegador reconecta solo (retry) y libera el hilo
+        deadline = time.time() + settings.SYNC_STREAM_SECONDS
+        snapshot = get_sync_snapshot()
+        yield f"retry: 3000\nevent: sync\ndata: {json.dumps(sync_payload(snapshot))}\n\n"
+        while time.time() < deadline:
+            previous = snapshot
+            snapshot = wait_for_sync_change(snapshot_version(previous), min(15, deadline - time.time()))
+            if snapshot is None:
+                snapshot = previous
+                yield ": ping\n\n"
+                continue
+            if previous['active'] != snapshot['active']:
+                event = 'started' if snapshot['active'] else 'stopped'
+            else:
+                event = 'item'
+            payload = dict(sync_payload(snapshot), event=event)
+            yield f"event: sync\ndata: {json.dumps(payload)}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    # El servidor llama close() aunque el cliente corte antes del primer evento
+    # (un finally en el generador no corre si nunca se empezó a iterar)
+    response._resource_closers.append(release_stream_slot)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 # ================================
 # DECORADOR PARA SISTEMA DE TAREAS